@@ -0,0 +1,114 @@
+
+"""Memory and allocation benchmark of the Stop and Bus assets.
+Compares the current slotted assets with the former __dict__ based ones (replicated below as _DictStop and _DictBus).
+Run: python benchmarks/assets_memory.py [number of objects]
+"""
+
+# Native libraries
+import gc
+import sys
+import os
+import timeit
+import tracemalloc
+from typing import Callable, List, Dict
+# Own modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pybuses.assets import Stop, Bus
+
+DEFAULT_COUNT = 100000
+
+
+class _DictBus(object):
+    """Bus as it was implemented before using __slots__ (reference for the benchmark)."""
+    def __init__(self, line, route, time=None, distance=None, other=None):
+        self.line = str(line).strip()
+        self.route = str(route).strip()
+        self.time = time
+        self.distance = distance
+        self.other = other if other is not None else dict()
+
+    def asdict(self):
+        return _clean_dict(self.__dict__)
+
+    def __iter__(self):
+        for k, v in self.asdict().items():
+            yield k, v
+
+
+class _DictStop(object):
+    """Stop as it was implemented before using __slots__ (reference for the benchmark)."""
+    def __init__(self, stopid, name, lat=None, lon=None, other=None):
+        self.stopid = int(stopid)
+        self.name = name.strip()
+        self.other = other if other is not None else dict()
+        if lat is None or lon is None:
+            self.lat = None
+            self.lon = None
+        else:
+            self.lat = float(lat)
+            self.lon = float(lon)
+
+    def asdict(self):
+        return _clean_dict(self.__dict__)
+
+    def __iter__(self):
+        for k, v in self.asdict().items():
+            yield k, v
+
+
+def _clean_dict(d) -> Dict:
+    dc = d.copy()
+    for k, v in d.items():
+        if v is None:
+            dc.pop(k)
+    return dc
+
+
+def measure_memory(factory: Callable[[int], object], count: int) -> (int, int):
+    """Create count objects with the factory and return the memory they allocate, and the number of allocated blocks.
+    :return: tuple (bytes allocated, memory blocks allocated)
+    """
+    gc.collect()
+    tracemalloc.start()
+    objects: List = [None] * count
+    before = tracemalloc.take_snapshot()
+    for i in range(count):
+        objects[i] = factory(i)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    return sum(stat.size_diff for stat in stats), sum(stat.count_diff for stat in stats)
+
+
+def measure_time(function: Callable, number: int) -> float:
+    """Return the mean time of a call to the function, in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def run(count: int = DEFAULT_COUNT):
+    factories = {
+        "Stop": (
+            lambda i: _DictStop(stopid=i, name=f"Stop {i}", lat=42.2 + i * 1e-6, lon=-8.7),
+            lambda i: Stop(stopid=i, name=f"Stop {i}", lat=42.2 + i * 1e-6, lon=-8.7)
+        ),
+        "Bus": (
+            lambda i: _DictBus(line="C1", route="Praza de América", time=i % 60, distance=i),
+            lambda i: Bus(line="C1", route="Praza de América", time=i % 60, distance=i)
+        )
+    }
+    print(f"Creating {count} objects of each class")
+    for name, (old_factory, new_factory) in factories.items():
+        old_size, old_blocks = measure_memory(old_factory, count)
+        new_size, new_blocks = measure_memory(new_factory, count)
+        old_object, new_object = old_factory(1), new_factory(1)
+        old_asdict = measure_time(lambda: dict(old_object), 100000)
+        new_asdict = measure_time(lambda: dict(new_object), 100000)
+        print(f"{name}:")
+        print(f"  memory:  {old_size / count:7.1f} B/object ({old_blocks / count:.1f} blocks) with __dict__, "
+              f"{new_size / count:7.1f} B/object ({new_blocks / count:.1f} blocks) with __slots__ "
+              f"({100 * (1 - new_size / old_size):.0f}% less)")
+        print(f"  dict(x): {old_asdict:7.2f} us with __dict__, {new_asdict:7.2f} us with __slots__")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT)
@@ -29,18 +29,22 @@ getter_vitrasa: StopGetter = getter_vitrasa
 
 
 def test_find_all_stops_threaded():
-    pybuses.find_all_stops(start=1, end=1000, threads=10)
+    crawl = pybuses.find_all_stops(start=1, end=1000, threads=10)
+    for stop in crawl:
+        print(f"Stop {stop.stopid} found! Name={stop.name}, lat={stop.lat}, lon={stop.lon}")
+    print(crawl.progress())
 
 
 def test_find_all_stops_nonthreaded():
-    pybuses.find_all_stops(start=5800, end=5810, threads=0)
+    crawl = pybuses.find_all_stops(start=5800, end=5810, threads=0)
+    print(crawl.progress())
 
 
 if __name__ == "__main__":
     pybuses = PyBuses()
     pybuses.add_stop_getter(getter_vitrasa, online=True)
-    pybuses.add_stop_getter(db.find_stop)
-    pybuses.add_stop_setter(db.save_stop)
+    pybuses.add_stop_getter(db.find_stop, bulk=db.find_stops)
+    pybuses.add_stop_setter(db.save_stop, bulk=db.save_stops)
     # pybuses.add_stop_deleter(db.delete_stop)
 
     test_find_all_stops_threaded()
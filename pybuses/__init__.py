@@ -1,5 +1,21 @@
 
-from .core import PyBuses
+from .core import PyBuses, BusSortMethods
+from .aio import AsyncPyBuses
+from .hedging import HedgePolicy
+from .cache import BusesCache, StopsCache
+from .crawl import StopsCrawl, AsyncStopsCrawl, CrawlProgress, CrawlOutcomes, AdaptiveDiscovery
+from .checkpoint import CrawlCheckpoint
+from .sync import StopsSync, SyncSummary
+from .writebehind import StopsWriteBehind, WriteBehindBatchError
 from .assets import *
 from .exceptions import *
 from .mongodb import MongoDB
+from .sqlite import SQLite
+from .spatial import StopSpatialIndex
+from .viewport import StopsViewport, StopCluster
+from .search import StopNameIndex
+from .table import StopTable
+from .snapshot import StopSnapshot, write_snapshot
+from .shared import SharedStopsCache, SharedStopsCacheServer
+from .migrate import migrate_stops, MigrationProgress
+from .metrics import PyBusesMetrics, CallOutcomes, CallableKinds
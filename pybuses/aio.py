@@ -0,0 +1,461 @@
+
+# Native modules
+import asyncio
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError, CancelledError as FutureCancelledError
+from typing import Optional, List, Dict, Set, Tuple, Iterable, Callable, Any, Union
+# Own modules
+from .core import _BasePyBuses, _Call, _Steps, BusSortMethods, sort_buses
+from .hedging import HedgePolicy
+from .crawl import AsyncStopsCrawl, AdaptiveDiscovery
+from .checkpoint import CrawlCheckpoint
+from .sync import StopsSync
+from .writebehind import StopsWriteBehind
+from .metrics import CallableKinds
+from .exceptions import *
+from .assets import *
+
+__all__ = ["AsyncPyBuses", "DEFAULT_MAX_WORKERS"]
+
+DEFAULT_MAX_WORKERS = 32
+_WRITE_BEHIND_LOOP_CHECK_INTERVAL = 0.5
+
+
+class AsyncPyBuses(_BasePyBuses):
+    """An asyncio-native version of PyBuses.
+    Getters, Setters and Deleters are registered in the same way as on PyBuses, and they can be either
+    coroutine functions or plain (blocking) callables.
+    Coroutine functions are awaited directly on the running event loop,
+    while plain callables are executed on a bounded thread pool executor, so they never block the loop.
+
+    The find_stop(), save_stop(), delete_stop() and get_buses() methods are coroutines, and find_all_stops()
+    returns an AsyncStopsCrawl handle. They run the same steps as their PyBuses counterparts, so they keep the same
+    fallback semantics; only the way each call to a Getter, Setter or Deleter is run differs.
+    AsyncPyBuses is not a subclass of PyBuses, since its methods are not interchangeable with the blocking ones.
+    Many queries can be awaited concurrently from a single event loop.
+    """
+
+    def __init__(self, *args, max_workers: int = DEFAULT_MAX_WORKERS, **kwargs):
+        """All the parameters of PyBuses are accepted, plus:
+        :param max_workers: max number of threads used to run plain (non-coroutine) callables (default=32)
+        :type max_workers: int
+        """
+        super().__init__(*args, **kwargs)
+        self.max_workers: int = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._promotion_tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Get the thread pool executor used to run plain callables, creating it on first use.
+        :rtype: ThreadPoolExecutor
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="AsyncPyBuses")
+        return self._executor
+
+    async def _call(self, f: Callable, *args, **kwargs) -> Any:
+        """Call a Getter/Setter/Deleter, awaiting it if is a coroutine function,
+        or running it on the executor if is a plain callable.
+        :param f: function to call
+        :return: the value returned by the function
+        """
+        if _is_coroutine_function(f):
+            return await f(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._get_executor(), functools.partial(f, *args, **kwargs))
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _instrumented_call(self, kind: str, f: Callable, *args, **kwargs) -> Any:
+        """Call a Getter/Setter/Deleter like _call(), recording its outcome and latency if metrics are enabled.
+        :param kind: role of the callable (one of CallableKinds)
+        :param f: function to call
+        :return: the value returned by the function
+        """
+        if self.metrics is None:
+            return await self._call(f, *args, **kwargs)
+        with self.metrics.timed(kind, self.get_callable_label(f)):
+            return await self._call(f, *args, **kwargs)
+
+    async def _run_call(self, call: _Call) -> Any:
+        """Run a call requested by the steps of an operation, recording it on the metrics if it has a kind."""
+        if call.kind is None:
+            return await self._call(call.f, *call.args, **call.kwargs)
+        return await self._instrumented_call(call.kind, call.f, *call.args, **call.kwargs)
+
+    async def _run_steps(self, steps: _Steps) -> Any:
+        """Run the steps of an operation, awaiting the requested Getters/Setters/Deleters
+        (or running them on the executor). The calls of a list are run concurrently.
+        :param steps: generator with the steps of the operation
+        :return: the value returned by the operation
+        """
+        result, error = None, None
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as ex:
+                return ex.value
+            result, error = None, None
+            if isinstance(step, list):
+                result = await asyncio.gather(*(self._run_call(call) for call in step), return_exceptions=True)
+            else:
+                try:
+                    result = await self._run_call(step)
+                except Exception as ex:
+                    error = ex
+
+    def close(self, wait: bool = True):
+        """Shutdown the thread pool executor used to run plain callables, if it was created.
+        AsyncPyBuses can also be used as a context manager, that calls close() on exit.
+        :param wait: if True, wait until pending calls finish (default=True)
+        :type wait: bool
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    async def find_stop(self, stopid: int, online: bool = False) -> Stop:
+        """Find a Stop using the defined Stop Getters on this AsyncPyBuses instance.
+        Same behaviour as PyBuses.find_stop(), including the Stops caches.
+        :param stopid: ID of the Stop to find
+        :param online: if True, only search on Online Getters, ignoring cached negative results (default=False)
+        :type stopid: int
+        :type online: bool
+        :return: Stop object
+        :rtype: Stop
+        :raise: MissingGetters or StopNotFound or StopNotExist or StopGetterUnavailable
+        """
+        return await self._run_steps(self._find_stop_steps(stopid, online))
+
+    async def find_stops(self, stopids: Iterable[int], online: bool = False) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Find many Stops using the defined Stop Getters on this AsyncPyBuses instance.
+        Same behaviour as PyBuses.find_stops(). The Stops searched one by one on a getter without
+        a Bulk Getter paired are searched concurrently.
+        :param stopids: IDs of the Stops to find
+        :param online: if True, only search on Online Getters, ignoring cached negative results (default=False)
+        :type stopids: iterable of int
+        :type online: bool
+        :return: dict of the found Stops by their Stop ID, and set of IDs of the Stops not found
+        :rtype: (dict of int: Stop, set of int)
+        :raise: MissingGetters
+        """
+        return await self._run_steps(self._find_stops_steps(stopids, online))
+
+    def _promote_stop(self, stop: Stop, setters: List[StopSetter]):
+        """Save a Stop on the given Tier Setters, on a background task, out of the caller latency path.
+        Same behaviour as PyBuses._promote_stop().
+        :param stop: Stop object to promote
+        :param setters: Tier Setters where the Stop will be saved
+        :type stop: Stop
+        :type setters: list of StopSetter
+        """
+        if not self._begin_promotion(stop.stopid):
+            return
+        task = asyncio.ensure_future(self._run_steps(self._promotion_steps(stop, setters)))
+        self._promotion_tasks.add(task)
+        task.add_done_callback(self._promotion_tasks.discard)
+
+    async def save_stop(self, stop: Stop, update: bool = True, use_all_stop_setters: Optional[bool] = None):
+        """Save the provided Stop object on the Stop setters defined.
+        Same behaviour as PyBuses.save_stop(), including the write-behind queue.
+        :param stop: Stop object to save
+        :param update: if True, when the Stop currently exists on a Setter data destination,
+                       update stop on destination with the current data of the Stop provided (default=True)
+        :param use_all_stop_setters: if True, save the Stop on all the Stop Setters
+               (default=use the value declared on this PyBuses instance)
+        :type stop: Stop
+        :type update: bool
+        :type use_all_stop_setters: bool or None
+        :raise: MissingSetters or StopSetterUnavailable
+        """
+        await self._run_steps(self._save_stop_steps(stop, update, use_all_stop_setters))
+
+    async def save_stops(
+            self,
+            stops: Iterable[Stop],
+            update: bool = True,
+            use_all_stop_setters: Optional[bool] = None
+    ) -> List[Stop]:
+        """Save many Stops on the Stop setters defined, with the same behaviour as save_stop() for each Stop.
+        When a Stop setter has a Bulk Setter paired (see add_stop_setter()), all the Stops are saved with
+        a single call to the Bulk Setter. Otherwise, the Stop setter is called for each Stop.
+        The Stops are always saved directly, even if the write-behind queue is enabled.
+        Stops that could not be saved on any of the Stop setters are returned, instead of raising an exception.
+        :param stops: Stop objects to save
+        :param update: if True, when a Stop currently exists on a Setter data destination,
+                       update stop on destination with the current data of the Stop provided (default=True)
+        :param use_all_stop_setters: if True, save each Stop on all the Stop Setters
+               (default=use the value declared on this PyBuses instance)
+        :type stops: iterable of Stop
+        :type update: bool
+        :type use_all_stop_setters: bool or None
+        :return: Stops that could not be saved
+        :rtype: list of Stop
+        :raise: MissingSetters
+        """
+        return await self._run_steps(self._save_stops_steps(stops, update, use_all_stop_setters))
+
+    def enable_write_behind(self, *args, **kwargs) -> StopsWriteBehind:
+        """Enable the write-behind queue. Same behaviour as PyBuses.enable_write_behind().
+        Must be called from the running event loop where this AsyncPyBuses is used,
+        since the batches are saved with save_stops() on that loop.
+        From that loop, the queue must be flushed and closed with its aflush() and aclose() coroutines,
+        or with disable_write_behind().
+        """
+        self._loop = asyncio.get_running_loop()
+        write_behind = super().enable_write_behind(*args, **kwargs)
+        write_behind.loop = self._loop
+        return write_behind
+
+    def _write_behind_saver(self) -> Callable[[List[Stop], bool, Optional[bool]], List[Stop]]:
+        """Get the function used by the write-behind flusher thread to save batches of Stops,
+        that runs save_stops() on the event loop where the write-behind queue was enabled.
+        When that loop is no longer running (e.g. after asyncio.run() returned, and the pending Stops
+        are flushed at exit), or it stops while saving a batch, the batch is saved on a private event loop
+        of the flusher thread.
+        """
+        loop = self._loop
+
+        def _saver(stops: List[Stop], update: bool, use_all_stop_setters: Optional[bool]) -> List[Stop]:
+            if loop.is_running():
+                future = asyncio.run_coroutine_threadsafe(self.save_stops(stops, update, use_all_stop_setters), loop)
+                while loop.is_running():
+                    try:
+                        return future.result(timeout=_WRITE_BEHIND_LOOP_CHECK_INTERVAL)
+                    except FutureTimeoutError:
+                        continue
+                    except FutureCancelledError:
+                        break
+                future.cancel()
+            return asyncio.run(self.save_stops(stops, update, use_all_stop_setters))
+
+        return _saver
+
+    async def disable_write_behind(self, timeout: Optional[float] = None) -> bool:
+        """Flush the pending Stops of the write-behind queue and disable it, without blocking the event loop.
+        Same behaviour as PyBuses.disable_write_behind().
+        :param timeout: max time to wait for the pending Stops, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if all the pending Stops were saved (or failed), False if timeout expired
+        :rtype: bool
+        """
+        write_behind, self.write_behind = self.write_behind, None
+        if write_behind is None:
+            return True
+        return await write_behind.aclose(timeout)
+
+    async def delete_stop(self, stopid: int):
+        """Delete the stop that matches the given Stop ID using the defined Stop Deleters.
+        Same behaviour as PyBuses.delete_stop().
+        :param stopid: Stop ID of the Stop to delete
+        :type stopid: int
+        :raise: MissingDeleters or StopDeleterUnavailable
+        """
+        await self._run_steps(self._delete_stop_steps(stopid))
+
+    def find_all_stops(
+            self,
+            end: int,
+            start: int = 1,
+            concurrency: int = 1,
+            update: bool = True,
+            use_all_stop_getters: bool = False,
+            use_all_stop_setters: Optional[bool] = None,
+            checkpoint: Optional[Union[str, CrawlCheckpoint]] = None,
+            refresh_age: Optional[Union[int, float]] = None,
+            resume: bool = True,
+            adaptive: Union[bool, AdaptiveDiscovery] = False,
+            sync: Optional[Union[str, StopsSync]] = None
+    ) -> AsyncStopsCrawl:
+        """Find all the stops when the online resources do not provide a full list of Stops.
+        Same behaviour as PyBuses.find_all_stops(), but the Stops are searched concurrently on the event loop.
+        Must be called from a running event loop.
+        An AsyncStopsCrawl handle is returned, that can be used to join or cancel the crawl, check its progress,
+        and iterate (async for) over the found Stops while they are found.
+        :param end: Stop ID limit to search
+        :param start: First Stop ID to search (default=1)
+        :param concurrency: max number of Stops being searched at the same time (default=1)
+        :param update: if True, when a found Stop currently exists on a Setter data destination,
+                       update stop on destination with the current data of the Stop provided (default=True)
+        :param use_all_stop_getters: if True, ignore the StopNotExist/StopNotFound exceptions
+                                     and keep searching on next getters (default=False)
+        :param use_all_stop_setters: if True, save each Stop on all the Stop Setters
+                                     (default=use the value declared on this PyBuses instance)
+        :param checkpoint: checkpoint file path or object. If set, the outcome of each searched Stop ID
+                           is persisted, and an interrupted crawl is resumed from it (default=None)
+        :param refresh_age: re-scan mode: skip the IDs known to be non-existing from previous crawls of the checkpoint,
+                            unless they were searched more than these seconds ago (default=None: search them)
+        :param resume: if True, resume the last crawl of the checkpoint if it was not finished (default=True)
+        :param adaptive: if True or an AdaptiveDiscovery object, use the adaptive discovery strategy,
+                         which samples long runs of non-existing IDs and densifies around hits,
+                         instead of searching all the IDs (default=False: search all the IDs)
+        :param sync: incremental sync mode: fingerprints file path or StopsSync object. If set, only the Stops
+                     that are new or changed since the last sync are saved, in batches, and a summary of changes
+                     is available on the sync attribute of the returned crawl. Found Stops are only recorded on
+                     the checkpoint after their batch is saved (default=None)
+        :type end: int
+        :type start: int
+        :type concurrency: int
+        :type update: bool
+        :type use_all_stop_getters: bool
+        :type use_all_stop_setters: bool or None
+        :type checkpoint: str or CrawlCheckpoint or None
+        :type refresh_age: int or float or None
+        :type resume: bool
+        :type adaptive: bool or AdaptiveDiscovery
+        :type sync: str or StopsSync or None
+        :return: handle of the crawl, already started
+        :rtype: AsyncStopsCrawl
+        :raise: MissingGetters or MissingSetters
+        """
+        getters, checkpoint, sync, stopids = self._prepare_crawl(end, start, checkpoint, adaptive, sync)
+
+        async def _probe(stopid: int) -> Tuple[str, Optional[Stop], Optional[bool]]:
+            return await self._run_steps(self._find_stop_and_save_steps(
+                getters, stopid, update, use_all_stop_getters, use_all_stop_setters, sync, _on_commit
+            ))
+
+        def _on_commit(saved: List[int], failed: List[int]):
+            crawl.record_commit(saved, failed)
+
+        async def _on_end():
+            if sync is not None:
+                await self._run_steps(self._save_sync_batch_steps(
+                    sync, sync.drain(), update, use_all_stop_setters, _on_commit
+                ))
+                sync.save()
+
+        crawl = AsyncStopsCrawl(
+            probe=_probe,
+            stopids=stopids,
+            concurrency=concurrency,
+            checkpoint=checkpoint,
+            refresh_age=refresh_age,
+            resume=resume,
+            on_end=_on_end
+        )
+        crawl.sync = sync
+        return crawl.start()
+
+    async def get_buses(
+            self,
+            stopid: int,
+            sort_by: Optional[int] = BusSortMethods.TIME,
+            reverse: bool = False,
+            hedge: Optional[bool] = None,
+            max_age: Optional[Union[int, float]] = None,
+            use_cache: bool = True
+    ) -> List[Bus]:
+        """Get a live list of all the Buses coming to a certain Stop and the remaining until arrival.
+        Same behaviour as PyBuses.get_buses(), including the hedged mode and the Buses cache.
+        :param stopid: ID of the Stop to search buses on
+        :param sort_by: method used to sort buses (use constants available in BusSortMethods) (default=TIME)
+        :param reverse: if True, reverse sort the buses (default=False)
+        :param hedge: if False, do not use hedged mode even if a hedge policy is defined (default=None)
+        :param max_age: max age, in seconds, of cached buses to return (default=None: use the cache TTL)
+        :param use_cache: if False, ignore the cached buses and fetch them again;
+                          the fetched buses are still saved on the cache (default=True)
+        :type stopid: int
+        :type sort_by: int or None
+        :type reverse: bool
+        :type hedge: bool or None
+        :type max_age: int or float or None
+        :type use_cache: bool
+        :return: List of Buses
+        :rtype: List[Bus]
+        :raise: MissingGetters or StopNotFound or BusGetterUnavailable
+        """
+        getters: List[BusGetter] = self.get_bus_getters()
+        if not getters:
+            raise MissingGetters("No Bus getters defined on this PyBuses instance")
+
+        async def _fetch(_stopid: int) -> List[Bus]:
+            return await self._fetch_buses(getters, _stopid, hedge)
+
+        if self.buses_cache is not None:
+            buses = await self.buses_cache.afetch(stopid, _fetch, max_age=max_age, bypass=not use_cache)
+        else:
+            buses = await _fetch(stopid)
+        sort_buses(buses, sort_by, reverse)
+        return buses
+
+    async def _fetch_buses(self, getters: List[BusGetter], stopid: int, hedge: Optional[bool] = None) -> List[Bus]:
+        """Fetch the list of Buses of a Stop from the given Bus getters, without using the cache nor sorting them.
+        Same behaviour as PyBuses._fetch_buses().
+        :param getters: Bus getters to use, in order of preference
+        :param stopid: ID of the Stop to search buses on
+        :param hedge: if False, do not use hedged mode even if a hedge policy is defined (default=None)
+        :type getters: list of BusGetter
+        :type stopid: int
+        :type hedge: bool or None
+        :return: List of Buses (unsorted)
+        :rtype: List[Bus]
+        :raise: StopNotFound or BusGetterUnavailable
+        """
+        if self.bus_hedge_policy is not None and hedge is not False:
+            return await self._get_buses_hedged(getters, stopid)
+        return await self._run_steps(self._fetch_buses_steps(getters, stopid))
+
+    async def _get_buses_hedged(self, getters: List[BusGetter], stopid: int) -> List[Bus]:
+        """Race the given Bus getters using the Bus hedge policy of this AsyncPyBuses instance.
+        Same behaviour as PyBuses._get_buses_hedged(), but the losing getters are cancelled as asyncio tasks.
+        :param getters: Bus getters to use, in order of preference
+        :param stopid: ID of the Stop to search buses on
+        :type getters: list of BusGetter
+        :type stopid: int
+        :return: List of Buses (unsorted)
+        :rtype: List[Bus]
+        :raise: StopNotFound or BusGetterUnavailable
+        """
+        policy: HedgePolicy = self.bus_hedge_policy
+        remaining: List[BusGetter] = list(getters)
+        pending: Dict[asyncio.Task, BusGetter] = dict()
+
+        async def _timed_call(getter: BusGetter) -> List[Bus]:
+            start = time.perf_counter()
+            result = await self._instrumented_call(CallableKinds.BUS_GETTER, getter, stopid)
+            policy.tracker.record(getter, time.perf_counter() - start)
+            return result
+
+        def _launch() -> BusGetter:
+            getter = remaining.pop(0)
+            pending[asyncio.ensure_future(_timed_call(getter))] = getter
+            return getter
+
+        last_launched = _launch()
+        try:
+            while pending:
+                delay = policy.hedge_delay(last_launched) if remaining else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Current getter is too slow: start the next one in parallel
+                    last_launched = _launch()
+                    continue
+                for task in done:
+                    getter = pending.pop(task)
+                    try:
+                        buses = task.result()
+                    except BusGetterUnavailable:
+                        if remaining:
+                            last_launched = _launch()
+                    else:
+                        self._record_fallback("get_buses", getters.index(getter))
+                        return buses
+        finally:
+            for task in pending.keys():
+                task.cancel()
+        self._record_fallback("get_buses", None)
+        raise BusGetterUnavailable("Bus list could not be retrieved with any of the Bus getters defined")
+
+
+def _is_coroutine_function(f: Callable) -> bool:
+    """Check if the given callable is a coroutine function, or an object with a coroutine __call__ method.
+    :param f: callable to check
+    :rtype: bool
+    """
+    return inspect.iscoroutinefunction(f) or inspect.iscoroutinefunction(getattr(f, "__call__", None))
@@ -1,10 +1,10 @@
 
 # Native libraries
-from typing import Union, Optional, Callable, List, NewType, Dict
+from typing import Union, Optional, Callable, List, NewType, Dict, Set, Tuple, Iterable
 
 __all__ = [
     "Bus", "Stop",
-    "StopGetter", "StopSetter", "StopDeleter",
+    "StopGetter", "StopSetter", "StopDeleter", "StopsGetter", "StopsSetter",
     "BusGetter", "BusSetter", "BusDeleter",
 ]
 
@@ -14,7 +14,12 @@ __all__ = [
 
 
 class Bus(object):
-    """A Bus that will arrive to a Stop, or that is available on the bus service as a line-route."""
+    """A Bus that will arrive to a Stop, or that is available on the bus service as a line-route.
+    Attributes are stored on slots, and the "other" dict is only allocated when accessed,
+    keeping the Bus objects small when many of them are held in memory.
+    """
+    __slots__ = ("line", "route", "time", "distance", "_other")
+
     def __init__(
             self,
             line: str,
@@ -40,7 +45,18 @@ class Bus(object):
         self.route: str = str(route).strip()
         self.time: Optional[Union[int, float]] = time
         self.distance: Optional[Union[int, float]] = distance
-        self.other: Dict = other if other is not None else dict()
+        self._other: Optional[Dict] = other
+
+    @property
+    def other(self) -> Dict:
+        """Additional data for the Bus object, as a dict (allocated on first access)."""
+        if self._other is None:
+            self._other = dict()
+        return self._other
+
+    @other.setter
+    def other(self, other: Optional[Dict]):
+        self._other = other
 
     def asdict(self) -> Dict:
         """Return all the data available about this Bus as a dict.
@@ -48,15 +64,25 @@ class Bus(object):
         :return: all parameters of this Bus object as a dict
         :rtype: dict
         """
-        return _clean_dict(self.__dict__)
+        d = {"line": self.line, "route": self.route}
+        if self.time is not None:
+            d["time"] = self.time
+        if self.distance is not None:
+            d["distance"] = self.distance
+        d["other"] = self._other if self._other is not None else dict()
+        return d
 
     def __iter__(self):
-        for k, v in self.asdict().items():
-            yield k, v
+        return iter(self.asdict().items())
 
 
 class Stop(object):
-    """A bus Stop, identified by a Stop ID. Buses will arrive to it."""
+    """A bus Stop, identified by a Stop ID. Buses will arrive to it.
+    Attributes are stored on slots, and the "other" dict is only allocated when accessed,
+    keeping the Stop objects small when many of them are held in memory.
+    """
+    __slots__ = ("stopid", "name", "lat", "lon", "_other")
+
     def __init__(
             self,
             stopid: Union[int, str],
@@ -81,7 +107,7 @@ class Stop(object):
         self.stopid: int = int(stopid)
         # self.id: int = self.stopid
         self.name: str = name.strip()
-        self.other: Dict = other if other is not None else dict()
+        self._other: Optional[Dict] = other
         if lat is None or lon is None:
             self.lat: float = None
             self.lon: float = None
@@ -96,17 +122,32 @@ class Stop(object):
         """
         return not (self.lat, self.lon) == (None, None)
 
-    def asdict(self):
+    @property
+    def other(self) -> Dict:
+        """Additional data for the Stop object, as a dict (allocated on first access)."""
+        if self._other is None:
+            self._other = dict()
+        return self._other
+
+    @other.setter
+    def other(self, other: Optional[Dict]):
+        self._other = other
+
+    def asdict(self) -> Dict:
         """Return all the data available about this Stop as a dict.
         Parameters where values are None will be hidden.
         :return: all parameters of this Stop object as a dict
         :rtype: dict
         """
-        return _clean_dict(self.__dict__)
+        d = {"stopid": self.stopid, "name": self.name, "other": self._other if self._other is not None else dict()}
+        if self.lat is not None:
+            d["lat"] = self.lat
+        if self.lon is not None:
+            d["lon"] = self.lon
+        return d
 
     def __iter__(self):
-        for k, v in self.asdict().items():
-            yield k, v
+        return iter(self.asdict().items())
 
 
 # https://docs.python.org/3/library/typing.html#newtype
@@ -114,20 +155,9 @@ class Stop(object):
 StopGetter = NewType("StopGetter", Callable[[int], Stop])
 StopSetter = NewType("StopSetter", Callable[[Stop], None])
 StopDeleter = NewType("StopDeleter", Callable[[int], bool])
+StopsGetter = NewType("StopsGetter", Callable[[Iterable[int]], Tuple[Dict[int, Stop], Set[int]]])
+StopsSetter = NewType("StopsSetter", Callable[[List[Stop]], None])
 BusGetter = NewType("BusGetter", Callable[[int], List[Bus]])
 BusSetter = NewType("BusSetter", Callable)
 BusDeleter = NewType("BusDeleter", Callable)
 
-
-def _clean_dict(d) -> Dict:
-    """Remove null (None) elements from a dictionary.
-    :param d: original dict to analyze
-    :type d: dict
-    :return: copy of d, but keys with null values are removed
-    :rtype: dict
-    """
-    dc = d.copy()
-    for k, v in d.items():
-        if v is None:
-            dc.pop(k)
-    return dc
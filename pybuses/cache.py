@@ -0,0 +1,428 @@
+
+# Native modules
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import Optional, List, Dict, Set, Tuple, Iterable, Callable, Awaitable, Union, Type
+# Own modules
+from .assets import Bus, Stop, StopGetter, StopsGetter, StopSetter, StopDeleter
+from .exceptions import StopNotFound, StopNotExist
+
+__all__ = [
+    "BusesCache", "StopsCache",
+    "DEFAULT_BUSES_CACHE_TTL", "DEFAULT_BUSES_CACHE_SIZE",
+    "DEFAULT_STOPS_CACHE_TTL", "DEFAULT_STOPS_CACHE_SIZE", "DEFAULT_STOPS_CACHE_NEGATIVE_TTL"
+]
+
+DEFAULT_BUSES_CACHE_TTL = 15
+DEFAULT_BUSES_CACHE_SIZE = 2000
+DEFAULT_STOPS_CACHE_TTL = 3600
+DEFAULT_STOPS_CACHE_SIZE = 10000
+DEFAULT_STOPS_CACHE_NEGATIVE_TTL = 300
+
+
+class _FetchCancelled(Exception):
+    """Set as result of an async coalesced fetch when the coroutine fetching the buses was cancelled,
+    so the coroutines waiting for it retry the fetch instead of being cancelled too.
+    """
+    pass
+
+
+class BusesCache(object):
+    """A short-lived, in-memory cache for the realtime lists of Buses arriving to Stops, keyed by Stop ID.
+    The cache is bounded: when full, the least recently used Stop is evicted.
+    Concurrent fetches for the same Stop are coalesced (single-flight): only the first caller
+    fetches the buses from the getters, while the others wait for its result.
+    Fetches that reach the getters are counted as misses, while callers that waited for other's fetch
+    are counted as coalesced.
+    """
+    def __init__(
+            self,
+            ttl: Union[int, float] = DEFAULT_BUSES_CACHE_TTL,
+            maxsize: int = DEFAULT_BUSES_CACHE_SIZE
+    ):
+        """
+        :param ttl: time, in seconds, that a list of buses is considered fresh (default=15)
+        :param maxsize: max number of Stops kept on the cache (default=2000)
+        :type ttl: int or float
+        :type maxsize: int
+        """
+        self.ttl: Union[int, float] = ttl
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+        self._entries: "OrderedDict[int, Tuple[float, List[Bus]]]" = OrderedDict()
+        self._inflight: Dict[int, Future] = dict()
+        self._async_inflight: Dict[int, asyncio.Future] = dict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, stopid: int, max_age: Optional[Union[int, float]]) -> Optional[List[Bus]]:
+        """Get the cached buses of a Stop if they are fresh enough. Must be called with the lock acquired.
+        :return: copy of the cached list of Buses, or None if not cached or too old
+        """
+        try:
+            saved, buses = self._entries[stopid]
+        except KeyError:
+            return None
+        if time.monotonic() - saved > (self.ttl if max_age is None else max_age):
+            return None
+        self._entries.move_to_end(stopid)
+        return list(buses)
+
+    def get(self, stopid: int, max_age: Optional[Union[int, float]] = None) -> Optional[List[Bus]]:
+        """Get the cached list of Buses of a Stop.
+        :param stopid: ID of the Stop
+        :param max_age: max age, in seconds, of the cached buses (default=None: use the cache TTL)
+        :type stopid: int
+        :type max_age: int or float or None
+        :return: copy of the cached list of Buses, or None if not cached or too old
+        :rtype: list of Bus or None
+        """
+        with self._lock:
+            return self._lookup(stopid, max_age)
+
+    def put(self, stopid: int, buses: List[Bus]):
+        """Save the list of Buses of a Stop on the cache, evicting the least recently used Stop if full.
+        :param stopid: ID of the Stop
+        :param buses: list of Buses arriving to the Stop
+        :type stopid: int
+        :type buses: list of Bus
+        """
+        with self._lock:
+            self._entries[stopid] = (time.monotonic(), list(buses))
+            self._entries.move_to_end(stopid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, stopid: int):
+        """Remove the cached buses of a Stop, if cached.
+        :param stopid: ID of the Stop
+        :type stopid: int
+        """
+        with self._lock:
+            self._entries.pop(stopid, None)
+
+    def clear(self):
+        """Remove all the cached buses, and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.coalesced = 0
+
+    def stats(self) -> Dict:
+        """Get the counters of this cache.
+        :return: dict with the keys "hits", "misses", "coalesced" and "size"
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self._entries)}
+
+    def fetch(
+            self,
+            stopid: int,
+            fetcher: Callable[[int], List[Bus]],
+            max_age: Optional[Union[int, float]] = None,
+            bypass: bool = False
+    ) -> List[Bus]:
+        """Get the list of Buses of a Stop from the cache, or fetch it with the given function if not cached.
+        If the buses of the same Stop are being fetched by other thread, wait for its result instead.
+        Fetched buses are saved on the cache. Exceptions raised by the fetcher are raised to all the waiting callers.
+        :param stopid: ID of the Stop
+        :param fetcher: function that receives the Stop ID and returns the list of Buses
+        :param max_age: max age, in seconds, of the cached buses (default=None: use the cache TTL)
+        :param bypass: if True, ignore the cached buses and fetch them again (default=False)
+        :type stopid: int
+        :type max_age: int or float or None
+        :type bypass: bool
+        :return: list of Buses
+        :rtype: list of Bus
+        """
+        with self._lock:
+            if not bypass:
+                buses = self._lookup(stopid, max_age)
+                if buses is not None:
+                    self.hits += 1
+                    return buses
+            future = self._inflight.get(stopid)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._inflight[stopid] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return list(future.result())
+
+        try:
+            buses = fetcher(stopid)
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            self.put(stopid, buses)
+            future.set_result(buses)
+            return list(buses)
+        finally:
+            with self._lock:
+                self._inflight.pop(stopid, None)
+
+    async def afetch(
+            self,
+            stopid: int,
+            fetcher: Callable[[int], Awaitable[List[Bus]]],
+            max_age: Optional[Union[int, float]] = None,
+            bypass: bool = False
+    ) -> List[Bus]:
+        """Asyncio version of fetch(). The fetcher must be a coroutine function.
+        Fetches are coalesced among the coroutines running on the same event loop.
+        If the coroutine fetching the buses is cancelled, the cancellation is not propagated to the waiting ones:
+        these retry the fetch, the first of them becoming the new fetcher.
+        :param stopid: ID of the Stop
+        :param fetcher: coroutine function that receives the Stop ID and returns the list of Buses
+        :param max_age: max age, in seconds, of the cached buses (default=None: use the cache TTL)
+        :param bypass: if True, ignore the cached buses and fetch them again (default=False)
+        :type stopid: int
+        :type max_age: int or float or None
+        :type bypass: bool
+        :return: list of Buses
+        :rtype: list of Bus
+        """
+        while True:
+            with self._lock:
+                if not bypass:
+                    buses = self._lookup(stopid, max_age)
+                    if buses is not None:
+                        self.hits += 1
+                        return buses
+                future = self._async_inflight.get(stopid)
+                owner = future is None
+                if owner:
+                    self.misses += 1
+                    future = self._async_inflight[stopid] = asyncio.get_running_loop().create_future()
+                    break
+                self.coalesced += 1
+            try:
+                return list(await asyncio.shield(future))
+            except _FetchCancelled:
+                # The owner was cancelled: retry, so one of the waiters takes over the fetch
+                continue
+
+        try:
+            buses = await fetcher(stopid)
+        except BaseException as ex:
+            if isinstance(ex, asyncio.CancelledError):
+                future.set_exception(_FetchCancelled())
+            else:
+                future.set_exception(ex)
+            future.exception()  # Avoid "exception was never retrieved" warnings when nobody was waiting
+            raise
+        else:
+            self.put(stopid, buses)
+            future.set_result(buses)
+            return list(buses)
+        finally:
+            with self._lock:
+                self._async_inflight.pop(stopid, None)
+
+
+class StopsCache(object):
+    """An in-memory cache of Stops, to be used as the first (fastest) Stop getter of PyBuses.
+    The cache is bounded: when full, the least recently used Stop is evicted. Cached Stops expire after a TTL.
+
+    Negative results (Stops that do not exist, or were not found on any getter) are cached too,
+    on a separate space with its own TTL, so repeated queries for invalid Stop IDs do not reach the other getters.
+
+    The find_stop, save_stop and delete_stop methods can be used as StopGetter, StopSetter and StopDeleter.
+    However, the recommended way of using the cache is registering it with PyBuses.add_stops_cache(),
+    so the cache gets updated with every Stop found, saved or deleted by PyBuses, including negative results.
+    """
+    def __init__(
+            self,
+            ttl: Optional[Union[int, float]] = DEFAULT_STOPS_CACHE_TTL,
+            maxsize: int = DEFAULT_STOPS_CACHE_SIZE,
+            negative_ttl: Optional[Union[int, float]] = DEFAULT_STOPS_CACHE_NEGATIVE_TTL,
+            negative_maxsize: Optional[int] = None
+    ):
+        """
+        :param ttl: time, in seconds, that a Stop is kept on the cache; None to never expire (default=3600)
+        :param maxsize: max number of Stops kept on the cache (default=10000)
+        :param negative_ttl: time, in seconds, that a negative result is kept on the cache;
+                             None to never expire, 0 to disable negative caching (default=300)
+        :param negative_maxsize: max number of negative results kept on the cache (default=same as maxsize)
+        :type ttl: int or float or None
+        :type maxsize: int
+        :type negative_ttl: int or float or None
+        :type negative_maxsize: int or None
+        """
+        self.ttl: Optional[Union[int, float]] = ttl
+        self.maxsize: int = maxsize
+        self.negative_ttl: Optional[Union[int, float]] = negative_ttl
+        self.negative_maxsize: int = maxsize if negative_maxsize is None else negative_maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self.negative_hits: int = 0
+        self._stops: "OrderedDict[int, Tuple[float, Stop]]" = OrderedDict()
+        self._negatives: "OrderedDict[int, Tuple[float, Type[StopNotFound]]]" = OrderedDict()
+        self._lock = Lock()
+        self.find_stop: StopGetter = self.find_stop  # Set StopGetter data type on this embedded getter
+        self.find_stops: StopsGetter = self.find_stops  # Set StopsGetter data type on this embedded bulk getter
+        self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
+
+    def __len__(self):
+        return len(self._stops)
+
+    @staticmethod
+    def _expired(saved: float, ttl: Optional[Union[int, float]]) -> bool:
+        return ttl is not None and time.monotonic() - saved > ttl
+
+    def _get_negative(self, stopid: int) -> Optional[type]:
+        """Get the exception class of the negative result cached for a Stop. Must be called with the lock acquired.
+        :return: StopNotExist or StopNotFound class, or None if no fresh negative result is cached
+        """
+        try:
+            saved, exception = self._negatives[stopid]
+        except KeyError:
+            return None
+        if self._expired(saved, self.negative_ttl):
+            self._negatives.pop(stopid)
+            return None
+        return exception
+
+    def find_stop(self, stopid: int) -> Stop:
+        """Search a Stop on the cache.
+        This method is used as a StopGetter function of PyBuses.
+        :param stopid: ID of the Stop to search
+        :type stopid: int
+        :return: found Stop object
+        :rtype: Stop
+        :raise: StopNotExist if the Stop is cached as non-existing, or StopNotFound if the Stop is not cached
+        """
+        with self._lock:
+            try:
+                saved, stop = self._stops[stopid]
+            except KeyError:
+                pass
+            else:
+                if not self._expired(saved, self.ttl):
+                    self._stops.move_to_end(stopid)
+                    self.hits += 1
+                    return stop
+                self._stops.pop(stopid)
+            if self._get_negative(stopid) is StopNotExist:
+                self.negative_hits += 1
+                raise StopNotExist(f"Stop {stopid} is cached as non-existing")
+            self.misses += 1
+        raise StopNotFound(f"Stop {stopid} not found on cache")
+
+    def find_stops(self, stopids: Iterable[int]) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Search many Stops on the cache.
+        This method is used as a Bulk Getter (StopsGetter) function of PyBuses.
+        :param stopids: IDs of the Stops to search
+        :type stopids: iterable of int
+        :return: dict of the cached Stops by their Stop ID, and set of IDs not cached
+        :rtype: (dict of int: Stop, set of int)
+        """
+        found: Dict[int, Stop] = dict()
+        misses: Set[int] = set()
+        with self._lock:
+            for stopid in stopids:  # type: int
+                try:
+                    saved, stop = self._stops[stopid]
+                except KeyError:
+                    pass
+                else:
+                    if not self._expired(saved, self.ttl):
+                        self._stops.move_to_end(stopid)
+                        self.hits += 1
+                        found[stopid] = stop
+                        continue
+                    self._stops.pop(stopid)
+                self.misses += 1
+                misses.add(stopid)
+        return found, misses
+
+    def check_negative(self, stopid: int):
+        """Raise the exception of the negative result cached for a Stop, if any.
+        :param stopid: ID of the Stop to check
+        :type stopid: int
+        :raise: StopNotExist or StopNotFound if a negative result is cached for the Stop
+        """
+        with self._lock:
+            exception = self._get_negative(stopid)
+            if exception is None:
+                return
+            self.negative_hits += 1
+        raise exception(f"Stop {stopid} is cached as not found/non-existing")
+
+    def save_stop(self, stop: Stop, update: bool = True):
+        """Save or update a Stop on the cache. Any negative result cached for the Stop is removed.
+        This method is used as a StopSetter function of PyBuses.
+        :param stop: Stop object to save
+        :param update: if True, when the Stop is currently cached, replace it with the Stop provided (default=True)
+        :type stop: Stop
+        :type update: bool
+        """
+        with self._lock:
+            self._negatives.pop(stop.stopid, None)
+            if not update and stop.stopid in self._stops:
+                return
+            self._stops[stop.stopid] = (time.monotonic(), stop)
+            self._stops.move_to_end(stop.stopid)
+            while len(self._stops) > self.maxsize:
+                self._stops.popitem(last=False)
+
+    def save_negative(self, stopid: int, not_exist: bool = True):
+        """Cache a negative result for a Stop. The Stop is removed from the cache, if cached.
+        :param stopid: ID of the Stop
+        :param not_exist: True if the Stop does not exist (StopNotExist),
+                          False if the Stop might exist but was not found (StopNotFound) (default=True)
+        :type stopid: int
+        :type not_exist: bool
+        """
+        if self.negative_ttl == 0:
+            return
+        with self._lock:
+            self._stops.pop(stopid, None)
+            self._negatives[stopid] = (time.monotonic(), StopNotExist if not_exist else StopNotFound)
+            self._negatives.move_to_end(stopid)
+            while len(self._negatives) > self.negative_maxsize:
+                self._negatives.popitem(last=False)
+
+    def delete_stop(self, stopid: int) -> bool:
+        """Delete a Stop from the cache, including any negative result cached for it.
+        This method is used as a StopDeleter function of PyBuses.
+        :param stopid: ID of the Stop to delete
+        :type stopid: int
+        :return: True if the Stop was cached, False if not
+        :rtype: bool
+        """
+        with self._lock:
+            self._negatives.pop(stopid, None)
+            return self._stops.pop(stopid, None) is not None
+
+    def clear(self):
+        """Remove all the cached Stops and negative results, and reset the counters."""
+        with self._lock:
+            self._stops.clear()
+            self._negatives.clear()
+            self.hits = self.misses = self.negative_hits = 0
+
+    def stats(self) -> Dict:
+        """Get the counters of this cache.
+        :return: dict with the keys "hits", "misses", "negative_hits", "size" and "negative_size"
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits,
+                "size": len(self._stops),
+                "negative_size": len(self._negatives)
+            }
@@ -0,0 +1,187 @@
+
+# Native modules
+import json
+import os
+import time
+from threading import Lock
+from typing import Optional, List, Dict, Tuple, Union
+# Own modules
+from .crawl import CrawlOutcomes
+
+__all__ = ["CrawlCheckpoint", "DEFAULT_CHECKPOINT_INTERVAL", "CHECKPOINT_VERSION"]
+
+"""STRUCTURE OF THE CHECKPOINT FILE used by Stops crawls
+The checkpoint is a JSON file, where the outcomes of the Stop IDs searched are stored compacted as ranges.
+
+{
+    "version": 1,
+    "run_started": <dt>,
+    "finished": false,
+    "ranges": [
+        [<first stopid>, <last stopid>, <outcome>, <dt>],
+        ...
+    ]
+}
+
+<dt> are ints with the timestamp when the current crawl run started, and when the IDs of the range were searched.
+Contiguous Stop IDs with the same outcome are merged on a single range, keeping the oldest timestamp.
+Only "found", "not_exist" and "not_found" outcomes are stored: IDs that failed are searched again.
+Timestamps are saved on Unix/Epoch format, and UTC timezone.
+"""
+
+CHECKPOINT_VERSION = 1
+DEFAULT_CHECKPOINT_INTERVAL = 30
+
+_RECORDED_OUTCOMES = (CrawlOutcomes.FOUND, CrawlOutcomes.NOT_EXIST, CrawlOutcomes.NOT_FOUND)
+
+
+class CrawlCheckpoint(object):
+    """Persist the outcomes of a Stops crawl to a local file, so an interrupted crawl can be resumed.
+
+    When a crawl begins with a checkpoint of an unfinished run, the IDs already searched on that run are skipped.
+    Additionally, IDs known to be non-existing can be skipped on new runs (re-scan mode),
+    unless they were searched longer than a refresh age ago.
+    """
+    def __init__(self, path: str, interval: Union[int, float] = DEFAULT_CHECKPOINT_INTERVAL):
+        """The checkpoint file is loaded if exists.
+        :param path: location of the checkpoint file
+        :param interval: min time, in seconds, between automatic saves of the checkpoint file (default=30)
+        :type path: str
+        :type interval: int or float
+        """
+        self.path: str = path
+        self.interval: Union[int, float] = interval
+        self.run_started: int = current_datetime()
+        self.finished: bool = True
+        self._outcomes: Dict[int, Tuple[str, int]] = dict()
+        self._lock = Lock()
+        self._save_lock = Lock()
+        self._last_save: float = time.monotonic()
+        self.load()
+
+    def __len__(self):
+        return len(self._outcomes)
+
+    def load(self):
+        """Load the checkpoint file, if exists. Current outcomes in memory are replaced."""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version on {self.path}: {data.get('version')}")
+        with self._lock:
+            self.run_started = data["run_started"]
+            self.finished = data["finished"]
+            self._outcomes.clear()
+            for first, last, outcome, timestamp in data["ranges"]:
+                for stopid in range(first, last+1):
+                    self._outcomes[stopid] = (outcome, timestamp)
+
+    def save(self):
+        """Save the checkpoint file. The file is replaced atomically."""
+        with self._lock:
+            data = {
+                "version": CHECKPOINT_VERSION,
+                "run_started": self.run_started,
+                "finished": self.finished,
+                "ranges": self._compact()
+            }
+            self._last_save = time.monotonic()
+        tmp_path = self.path + ".tmp"
+        with self._save_lock:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+
+    def _compact(self) -> List[List]:
+        """Merge the outcomes of contiguous Stop IDs into ranges. Must be called with the lock acquired.
+        IDs searched on the current run and on previous runs are never merged together.
+        :return: list of [first stopid, last stopid, outcome, timestamp]
+        """
+        ranges = list()
+        current = None
+        for stopid in sorted(self._outcomes.keys()):
+            outcome, timestamp = self._outcomes[stopid]
+            if (
+                current is not None and current[1] == stopid - 1 and current[2] == outcome
+                and (current[3] >= self.run_started) == (timestamp >= self.run_started)
+            ):
+                current[1] = stopid
+                current[3] = min(current[3], timestamp)
+            else:
+                current = [stopid, stopid, outcome, timestamp]
+                ranges.append(current)
+        return ranges
+
+    def begin(self, resume: bool = True):
+        """Start a crawl run. If resume=True and the last run was not finished, the run is resumed.
+        Otherwise, a new run is started.
+        :param resume: if True, resume the last run if it was not finished (default=True)
+        :type resume: bool
+        """
+        with self._lock:
+            if not resume or self.finished:
+                # New run must start after all the outcomes registered on previous runs
+                latest = max((timestamp for _, timestamp in self._outcomes.values()), default=0)
+                self.run_started = max(current_datetime(), latest + 1)
+            self.finished = False
+        self.save()
+
+    def finish(self):
+        """Mark the current run as finished, and save the checkpoint file."""
+        with self._lock:
+            self.finished = True
+        self.save()
+
+    def record(self, stopid: int, outcome: str):
+        """Register the outcome of searching a Stop ID. Failed searches (ERROR outcome) are not registered.
+        The checkpoint file is saved if the save interval elapsed since the last save.
+        :param stopid: Stop ID searched
+        :param outcome: one of the CrawlOutcomes
+        :type stopid: int
+        :type outcome: str
+        """
+        if outcome not in _RECORDED_OUTCOMES:
+            return
+        with self._lock:
+            self._outcomes[stopid] = (outcome, max(current_datetime(), self.run_started))
+            must_save = time.monotonic() - self._last_save >= self.interval
+        if must_save:
+            self.save()
+
+    def known_outcome(self, stopid: int, refresh_age: Optional[Union[int, float]] = None) -> Optional[str]:
+        """Get the outcome of a Stop ID that does not need to be searched again.
+        That happens when the ID was searched on the current run (which is being resumed),
+        or when the ID is known to be non-existing and was searched less than refresh_age seconds ago.
+        :param stopid: Stop ID to check
+        :param refresh_age: max age, in seconds, of a non-existing outcome to skip the ID;
+                            None to never skip non-existing IDs from previous runs (default=None)
+        :type stopid: int
+        :type refresh_age: int or float or None
+        :return: the known outcome, or None if the ID must be searched
+        :rtype: str or None
+        """
+        with self._lock:
+            try:
+                outcome, timestamp = self._outcomes[stopid]
+            except KeyError:
+                return None
+            run_started = self.run_started
+        if timestamp >= run_started:
+            return outcome
+        if (
+            outcome == CrawlOutcomes.NOT_EXIST and refresh_age is not None
+            and current_datetime() - timestamp < refresh_age
+        ):
+            return outcome
+        return None
+
+
+def current_datetime() -> int:
+    """Return current datetime in Unix/Epoch format and UTC timezone.
+    :return: current Unix/Epoch timestamp in UTC timezone, parsed to int
+    :rtype: int
+    """
+    return int(time.time())
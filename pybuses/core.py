@@ -1,13 +1,24 @@
 
 # Native modules
-from typing import Optional, List  # Python => 3.5
+from typing import Optional, List, Dict, Set, Tuple, Iterable, Callable, Union, Any, Generator  # Python => 3.5
 from collections import namedtuple
-from threading import Thread, Lock
+from threading import Lock
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 # Own modules
 from .exceptions import *
 from .assets import *
+from .hedging import HedgePolicy
+from .cache import BusesCache, StopsCache
+from .crawl import StopsCrawl, CrawlOutcomes, AdaptiveDiscovery
+from .checkpoint import CrawlCheckpoint
+from .sync import StopsSync
+from .writebehind import *
+from .metrics import PyBusesMetrics, CallableKinds, callable_name
+from .spatial import StopSpatialIndex
+from .viewport import StopsViewport
+from .search import StopNameIndex
 
-__all__ = ["PyBuses"]
+__all__ = ["PyBuses", "BusSortMethods"]
 
 """Bus Sorting Methods are ints, but can be used with alias from the BusSortMethods named tuple.
 NONE = 0
@@ -18,37 +29,52 @@ ROUTE = 3
 _bus_sort_methods_namedtuple = namedtuple("BusSortMethods", ["NONE", "TIME", "LINE", "ROUTE"])
 BusSortMethods = _bus_sort_methods_namedtuple(0, 1, 2, 3)
 
+"""A Stops Index is an in-memory index of Stops, kept up to date by PyBuses (see PyBuses.add_stops_index()).
+It has a save_stop(stop, update) method (like a StopSetter) and a delete_stop(stopid) method (like a StopDeleter).
+"""
+StopsIndex = Union[StopSpatialIndex, StopsViewport, StopNameIndex]
 
-class PyBuses(object):
-    """A PyBuses object to help managing bus stops and look for incoming buses.
-    This object should be threated as a concrete transport service, i.e.:
-        - "the bus service of King's Landing"
-        - "the metro service of Liberty City"
-        - "the train service of Hamburg"
-        - "the bus service of Hamburg"
-    Each one of these services would have a PyBuses object, with their getters, setters and deleters.
 
-    Getters are custom, required functions that fetch Stop info and Bus lists from certain sources.
-    At least one Stop Getter and one Bus Getter are required to fetch stops and buses respectively.
+def sort_buses(buses: List[Bus], sort_by: Optional[int] = BusSortMethods.TIME, reverse: bool = False):
+    """Sort a list of Buses in place, using one of the BusSortMethods.
+    :param buses: list of Buses to sort
+    :param sort_by: method used to sort buses (use constants available in BusSortMethods) (default=TIME)
+    :param reverse: if True, reverse sort the buses (default=False)
+    :type buses: list of Bus
+    :type sort_by: int or None
+    :type reverse: bool
+    """
+    if sort_by == BusSortMethods.TIME:
+        buses.sort(key=lambda x: x.time, reverse=reverse)
+    elif sort_by == BusSortMethods.LINE:
+        buses.sort(key=lambda x: x.line, reverse=reverse)
+    elif sort_by == BusSortMethods.ROUTE:
+        buses.sort(key=lambda x: x.route, reverse=reverse)
 
-    Setters are custom, optional functions, that will save found Stops or list of buses to custom destinations
-    (i.e. a database, local variables, a file, cache...)
-    Setters are supposed to be executed after a Stop or Bus query is successful.
-    However, PyBuses will not do it automatically.
+class _Call(object):
+    """A call to a Getter, Setter or Deleter (or to a Stops cache) requested by the steps of a PyBuses operation.
+    The steps of the operations (find_stop(), save_stop()...) are generators shared by PyBuses and AsyncPyBuses:
+    they yield the calls to run, and receive back the value returned (or get the exception raised thrown into them).
+    PyBuses runs the calls directly, while AsyncPyBuses awaits them or runs them on its executor.
+    When a list of calls is yielded, the calls can run concurrently, and a list with the value returned or the
+    exception raised by each call is sent back.
+    The kind is one of the CallableKinds, or None for calls not recorded on the metrics.
+    """
+    __slots__ = ("kind", "f", "args", "kwargs")
 
-    Deleters are custom, optional functions, that will delete saved Stops or list of buses on custom destinations,
-    usually the same places as Setters.
+    def __init__(self, kind: Optional[str], f: Callable, *args, **kwargs):
+        self.kind: Optional[str] = kind
+        self.f: Callable = f
+        self.args: Tuple = args
+        self.kwargs: Dict = kwargs
 
-    The PyBuses methods that use these functions are:
-        - Stop Getters: find_stop()
-        - Stop Setters: save_stop()
-        - Stop Deleters: delete_stop()
-        - Bus Getters: get_buses()
-        - Bus Setters: save_buses()
-        - Bus Deleters: delete_buses()
 
-    Please refer to documentation in order to check how Getter, Setter and Deleter functions must work.
-    """
+"""Steps of a PyBuses operation: generator that yields calls (or lists of calls) to run, and returns the result."""
+_Steps = Generator[Union[_Call, List[_Call]], Any, Any]
+
+
+class _BasePyBuses(object):
+    """Common registry of Getters, Setters and Deleters, and steps of the operations, of PyBuses and AsyncPyBuses."""
 
     def __init__(
             self,
@@ -62,6 +88,11 @@ class PyBuses(object):
             use_all_bus_setters: bool = False,
             use_all_stop_deleters: bool = True,
             use_all_bus_deleters: bool = True,
+            bus_hedge_policy: Optional[HedgePolicy] = None,
+            buses_cache: Optional[BusesCache] = None,
+            stops_cache: Optional[StopsCache] = None,
+            promote_stops: bool = True,
+            metrics: Optional[PyBusesMetrics] = None
     ):
         """
         :param stop_getters: List of Stop getters functions
@@ -72,6 +103,12 @@ class PyBuses(object):
         :param use_all_bus_setters: if True, use all the defined Bus Setters when saving a Bus (default=False)
         :param use_all_stop_deleters: if True, use all the defined Stop Deleters when deleting a Stop (default=True)
         :param use_all_bus_deleters: if True, use all the defined Bus Deleters when deleting a Bus (default=True)
+        :param bus_hedge_policy: if set, Bus getters are raced using this policy on get_buses() (default=None)
+        :param buses_cache: if set, lists of buses are cached and fetches coalesced on get_buses() (default=None)
+        :param stops_cache: if set, register this Stops cache using add_stops_cache() (default=None)
+        :param promote_stops: if True, Stops found on a Stop getter are saved on the background
+                              on the Tier Setters of the previous (faster) getters (default=True)
+        :param metrics: if set, the calls to the getters, setters and deleters are recorded on it (default=None)
         :type stop_getters: list or None
         :type stop_setters: list or None
         :type stop_deleters: list or None
@@ -82,6 +119,11 @@ class PyBuses(object):
         :type use_all_bus_setters: bool
         :type use_all_stop_deleters: bool
         :type use_all_bus_deleters: bool
+        :type bus_hedge_policy: HedgePolicy or None
+        :type buses_cache: BusesCache or None
+        :type stops_cache: StopsCache or None
+        :type promote_stops: bool
+        :type metrics: PyBusesMetrics or None
         """
         self.stop_getters: List[StopGetter] = list() if stop_getters is None else list(stop_getters)
         self.stop_setters: List[StopSetter] = list() if stop_setters is None else list(stop_setters)
@@ -93,120 +135,339 @@ class PyBuses(object):
         self.use_all_bus_setters: bool = use_all_bus_setters
         self.use_all_stop_deleters: bool = use_all_stop_deleters
         self.use_all_bus_deleters: bool = use_all_bus_deleters
+        self.bus_hedge_policy: Optional[HedgePolicy] = bus_hedge_policy
+        self.buses_cache: Optional[BusesCache] = buses_cache
+        self.stops_caches: List[StopsCache] = list()
+        self.stops_indexes: List[StopsIndex] = list()
+        self.stop_tier_setters: Dict[StopGetter, StopSetter] = dict()
+        self.stop_bulk_getters: Dict[StopGetter, StopsGetter] = dict()
+        self.stop_bulk_setters: Dict[StopSetter, StopsSetter] = dict()
+        self.callable_labels: Dict[Callable, str] = dict()
+        if stops_cache is not None:
+            self.add_stops_cache(stops_cache)
+        self.write_behind: Optional[StopsWriteBehind] = None
+        self.promote_stops: bool = promote_stops
+        self._promotions_inflight: Set[int] = set()
+        self._promotions_lock = Lock()
+        self.metrics: Optional[PyBusesMetrics] = metrics
 
-    def find_stop(self, stopid: int, online: bool = False) -> Stop:
-        """Find a Stop using the defined Stop Getters on this PyBuses instances.
-        If no Getters are defined, MissingGetters exception is raised.
-        :param stopid: ID of the Stop to find
-        :param online: if True, only search on Online Getters (default=False)
-        :type stopid: int
-        :type online: bool
-        :return: Stop object
-        :rtype: list of Stop or False or Exception
-        :raise: MissingGetters or StopNotFound or StopGetterUnavailable
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_callable_label(self, f: Callable) -> str:
+        """Get the label of a Getter/Setter/Deleter used on the metrics: the label given when it was registered,
+        or its name (see metrics.callable_name()) if none was given.
+        :param f: Getter, Setter or Deleter registered on this PyBuses instance
+        :rtype: str
+        """
+        label = self.callable_labels.get(f)
+        return callable_name(f) if label is None else label
+
+    def _set_callable_label(self, label: Optional[str], *callables: Optional[Callable]):
+        """Set the metrics label of the given callables (None callables are ignored), if a label is given."""
+        if label is None:
+            return
+        for f in callables:
+            if f is not None:
+                self.callable_labels[f] = label
+
+    def _record_fallback(self, operation: str, depth: Optional[int], count: int = 1):
+        """Record the fallback depth of requests served by an operation, if metrics are enabled
+        (see PyBusesMetrics.record_fallback()).
         """
+        if self.metrics is not None and count:
+            self.metrics.record_fallback(operation, depth, count)
+
+    def _find_stop_steps(self, stopid: int, online: bool) -> _Steps:
+        """Steps of find_stop()."""
         getters: List[StopGetter] = self.get_stop_getters(online)
         if not getters:
             raise MissingGetters("No Stop getters defined on this PyBuses instance")
-        for getter in getters:  # type: StopGetter
+        if not online:
+            yield from self._call_caches_steps("check_negative", stopid)
+        cache_getters = [cache.find_stop for cache in self.stops_caches]
+        not_found = False
+        unavailable = False
+        for tier, getter in enumerate(getters):  # type: int, StopGetter
             try:
-                return getter(stopid)
+                stop = yield _Call(CallableKinds.STOP_GETTER, getter, stopid)
             except StopGetterUnavailable:
+                if getter not in cache_getters:
+                    unavailable = True
+                continue
+            except StopNotFound:
+                if getter not in cache_getters:
+                    not_found = True
                 continue
+            except StopNotExist:
+                self._record_fallback("find_stop", tier)
+                yield from self._cache_negative_stop_steps(stopid, not_exist=True)
+                raise
+            else:
+                self._record_fallback("find_stop", tier)
+                if getter not in cache_getters:
+                    yield from self._cache_stop_steps(stop)
+                promote_setters = self._get_promotion_setters(getters[:tier])
+                if promote_setters:
+                    self._promote_stop(stop, promote_setters)
+                return stop
+        self._record_fallback("find_stop", None)
+        if not_found:
+            if not unavailable:
+                # Only cache the negative result when all the getters answered it
+                yield from self._cache_negative_stop_steps(stopid, not_exist=False)
+            raise StopNotFound(f"Stop {stopid} not found on any of the Stop getters defined")
         raise StopGetterUnavailable("Stop info could not be retrieved for any of the Stop getters defined")
 
-    def save_stop(self, stop: Stop, update: bool = True, use_all_stop_setters: Optional[bool] = None):
-        """Save the provided Stop object on the Stop setters defined.
-        The stop will only be saved on the first Setter where the Stop was saved successfully,
-        unless use_all_stop_setters attribute of PyBuses class or on this method is True.
-        If no Setters are defined, MissingSetters exception is raised.
-        If any of the Stop setters worked, StopSetterUnavailable exception is raised.
-        :param stop: Stop object to save
-        :param update: if True, when the Stop currently exists on a Setter data destination,
-                       update stop on destination with the current data of the Stop provided (default=True)
-        :param use_all_stop_setters: if True, save the Stop on all the Stop Setters
-               (default=use the value declared on this PyBuses instance)
+    def _find_stops_steps(self, stopids: Iterable[int], online: bool) -> _Steps:
+        """Steps of find_stops(). The Stops searched one by one on a getter without a Bulk Getter paired
+        are requested as a list of calls."""
+        getters: List[StopGetter] = self.get_stop_getters(online)
+        if not getters:
+            raise MissingGetters("No Stop getters defined on this PyBuses instance")
+        found: Dict[int, Stop] = dict()
+        misses: Set[int] = set()
+        pending: List[int] = list()
+        for stopid in dict.fromkeys(stopids):  # type: int
+            try:
+                if not online:
+                    yield from self._call_caches_steps("check_negative", stopid)
+            except (StopNotFound, StopNotExist):
+                misses.add(stopid)
+            else:
+                pending.append(stopid)
+        cache_getters = [cache.find_stop for cache in self.stops_caches]
+        not_found: Set[int] = set()
+        unavailable: Set[int] = set()
+        for tier, getter in enumerate(getters):  # type: int, StopGetter
+            if not pending:
+                break
+            bulk_getter: Optional[StopsGetter] = self.stop_bulk_getters.get(getter)
+            if bulk_getter is not None:
+                try:
+                    hits, tier_misses = yield _Call(CallableKinds.STOPS_GETTER, bulk_getter, pending)
+                except StopGetterUnavailable:
+                    if getter not in cache_getters:
+                        unavailable.update(pending)
+                    continue
+                if getter not in cache_getters:
+                    not_found.update(tier_misses)
+            else:
+                hits = dict()
+                results = yield [_Call(CallableKinds.STOP_GETTER, getter, stopid) for stopid in pending]
+                for stopid, result in zip(pending, results):  # type: int, Union[Stop, BaseException]
+                    if isinstance(result, Stop):
+                        hits[stopid] = result
+                    elif isinstance(result, StopNotFound):
+                        if getter not in cache_getters:
+                            not_found.add(stopid)
+                    elif isinstance(result, StopNotExist):
+                        self._record_fallback("find_stops", tier)
+                        yield from self._cache_negative_stop_steps(stopid, not_exist=True)
+                        misses.add(stopid)
+                    elif isinstance(result, StopGetterUnavailable):
+                        if getter not in cache_getters:
+                            unavailable.add(stopid)
+                    else:
+                        raise result
+            self._record_fallback("find_stops", tier, len(hits))
+            promote_setters = self._get_promotion_setters(getters[:tier])
+            for stop in hits.values():  # type: Stop
+                if getter not in cache_getters:
+                    yield from self._cache_stop_steps(stop)
+                if promote_setters:
+                    self._promote_stop(stop, promote_setters)
+            found.update(hits)
+            pending = [stopid for stopid in pending if stopid not in found and stopid not in misses]
+        self._record_fallback("find_stops", None, len(pending))
+        for stopid in pending:  # type: int
+            if stopid in not_found and stopid not in unavailable:
+                yield from self._cache_negative_stop_steps(stopid, not_exist=False)
+            misses.add(stopid)
+        return found, misses
+
+    def _get_promotion_setters(self, faster_getters: List[StopGetter]) -> List[StopSetter]:
+        """Get the Tier Setters where a Stop found on a getter must be promoted,
+        given the getters that were queried before it.
+        :param faster_getters: Stop getters used before the getter where the Stop was found
+        :type faster_getters: list of StopGetter
+        :return: Tier Setters paired with the given getters, or empty list if promotion is disabled
+        :rtype: list of StopSetter
+        """
+        if not self.promote_stops or not self.stop_tier_setters:
+            return []
+        return [self.stop_tier_setters[g] for g in faster_getters if g in self.stop_tier_setters]
+
+    def _begin_promotion(self, stopid: int) -> bool:
+        """Register a Stop as being promoted.
+        :param stopid: ID of the Stop to promote
+        :return: False if the Stop is currently being promoted
+        :rtype: bool
+        """
+        with self._promotions_lock:
+            if stopid in self._promotions_inflight:
+                return False
+            self._promotions_inflight.add(stopid)
+            return True
+
+    def _promotion_steps(self, stop: Stop, setters: List[StopSetter]) -> _Steps:
+        """Steps of the promotion of a Stop (see _promote_stop()): save it on the given Tier Setters,
+        ignoring their errors, and unregister it as being promoted."""
+        try:
+            for setter in setters:  # type: StopSetter
+                try:
+                    yield _Call(CallableKinds.STOP_SETTER, setter, stop, update=True)
+                except SetterException:
+                    continue
+        finally:
+            with self._promotions_lock:
+                self._promotions_inflight.discard(stop.stopid)
+
+    def _call_caches_steps(self, method: str, *args, **kwargs) -> _Steps:
+        """Call a method on all the Stops caches registered on this PyBuses instance.
+        In-memory StopsCaches are called directly, while the calls to other caches (e.g. SharedStopsCache, which
+        does blocking requests to its server) are yielded, so AsyncPyBuses runs them on its executor.
+        :param method: name of the method to call
+        """
+        for cache in self.stops_caches:  # type: StopsCache
+            f = getattr(cache, method)
+            if isinstance(cache, StopsCache):
+                f(*args, **kwargs)
+            else:
+                yield _Call(None, f, *args, **kwargs)
+
+    def _cache_stop_steps(self, stop: Stop, update: bool = True) -> _Steps:
+        """Save the given Stop on all the Stops caches and Stops indexes registered on this PyBuses instance.
+        :param stop: Stop object to cache
+        :param update: if True, replace the Stop if currently cached (default=True)
         :type stop: Stop
         :type update: bool
-        :type use_all_stop_setters: bool or None
-        :raise: MissingSetters or StopSetterUnavailable
         """
+        yield from self._call_caches_steps("save_stop", stop, update=update)
+        for index in self.stops_indexes:  # type: StopsIndex
+            index.save_stop(stop, update=update)
+
+    def _uncache_stop_steps(self, stopid: int) -> _Steps:
+        """Delete a Stop from all the Stops caches and Stops indexes registered on this PyBuses instance.
+        :param stopid: ID of the Stop to delete
+        :type stopid: int
+        """
+        yield from self._call_caches_steps("delete_stop", stopid)
+        for index in self.stops_indexes:  # type: StopsIndex
+            index.delete_stop(stopid)
+
+    def _cache_negative_stop_steps(self, stopid: int, not_exist: bool) -> _Steps:
+        """Save a negative result on all the Stops caches registered on this PyBuses instance.
+        Non-existing Stops are also removed from the Stops indexes.
+        :param stopid: ID of the Stop not found/non-existing
+        :param not_exist: True if the Stop does not exist, False if the Stop was not found
+        :type stopid: int
+        :type not_exist: bool
+        """
+        yield from self._call_caches_steps("save_negative", stopid, not_exist=not_exist)
+        if not_exist:
+            for index in self.stops_indexes:  # type: StopsIndex
+                index.delete_stop(stopid)
+
+    def _save_stop_steps(self, stop: Stop, update: bool, use_all_stop_setters: Optional[bool]) -> _Steps:
+        """Steps of save_stop()."""
         setters: List[StopSetter] = self.get_stop_setters()
         if not setters:
             raise MissingSetters("No Stop setters defined on this PyBuses instance")
+        yield from self._cache_stop_steps(stop, update=update)
+        if self.write_behind is not None:
+            # put() might block when the queue is full (AsyncPyBuses runs it on its executor)
+            yield _Call(None, self.write_behind.put, stop, update=update, use_all_stop_setters=use_all_stop_setters)
+            return
         success = False
         if use_all_stop_setters is None:
             use_all_stop_setters = self.use_all_stop_setters
-        for setter in setters:  # type: StopSetter
+        for tier, setter in enumerate(setters):  # type: int, StopSetter
             try:
-                setter(stop, update=update)
+                yield _Call(CallableKinds.STOP_SETTER, setter, stop, update=update)
             except StopSetterUnavailable:
                 continue
             else:
+                if not success:
+                    self._record_fallback("save_stop", tier)
                 success = True
                 if not use_all_stop_setters:
                     break
         if not success:
+            self._record_fallback("save_stop", None)
             raise StopSetterUnavailable("Stop could not be saved on any of the Stop setters defined")
 
-    def delete_stop(self, stopid: int):
-        """Delete the stop that matches the given Stop ID using the defined Stop Deleters.
-        The stop will only be deleted on the first Deleter where the Stop was deleted successfully,
-        unless use_all_stop_deleters attribute of PyBuses class is True (which is by default).
-        No exceptions will be raised if the stop was not deleted because it was not registered.
-        Only when all the Deleters themselves failed, StopDeleterUnavailable will be raised.
-        If no Deleters are defined, MissingDeleters exception is raised.
-        :param stopid: Stop ID of the Stop to delete
-        :type stopid: int
-        :raise: MissingDeleters or StopDeleterUnavailable
-        """
+    def _save_stops_steps(self, stops: Iterable[Stop], update: bool, use_all_stop_setters: Optional[bool]) -> _Steps:
+        """Steps of save_stops()."""
+        setters: List[StopSetter] = self.get_stop_setters()
+        if not setters:
+            raise MissingSetters("No Stop setters defined on this PyBuses instance")
+        if use_all_stop_setters is None:
+            use_all_stop_setters = self.use_all_stop_setters
+        stops = list(stops)
+        for stop in stops:  # type: Stop
+            yield from self._cache_stop_steps(stop, update=update)
+        pending: List[Stop] = stops
+        for tier, setter in enumerate(setters):  # type: int, StopSetter
+            targets = stops if use_all_stop_setters else pending
+            if not targets:
+                break
+            bulk_setter: Optional[StopsSetter] = self.stop_bulk_setters.get(setter)
+            if bulk_setter is not None:
+                try:
+                    yield _Call(CallableKinds.STOPS_SETTER, bulk_setter, targets, update=update)
+                except StopSetterUnavailable:
+                    continue
+                saved_ids = {stop.stopid for stop in targets}
+            else:
+                saved_ids = set()
+                for stop in targets:  # type: Stop
+                    try:
+                        yield _Call(CallableKinds.STOP_SETTER, setter, stop, update=update)
+                    except StopSetterUnavailable:
+                        continue
+                    saved_ids.add(stop.stopid)
+            remaining = [stop for stop in pending if stop.stopid not in saved_ids]
+            self._record_fallback("save_stops", tier, len(pending) - len(remaining))
+            pending = remaining
+        self._record_fallback("save_stops", None, len(pending))
+        return pending
+
+    def _delete_stop_steps(self, stopid: int) -> _Steps:
+        """Steps of delete_stop()."""
         deleters: List[StopDeleter] = self.get_stop_deleters()
         if not deleters:
             raise MissingDeleters("No Stop deleters defined on this PyBuses instance")
+        yield from self._uncache_stop_steps(stopid)
         success = False
-        for deleter in deleters:  # type: StopDeleter
+        for tier, deleter in enumerate(deleters):  # type: int, StopDeleter
             try:
-                deleter(stopid)
+                yield _Call(CallableKinds.STOP_DELETER, deleter, stopid)
             except StopDeleterUnavailable:
                 continue
             else:
+                if not success:
+                    self._record_fallback("delete_stop", tier)
                 success = True
                 if not self.use_all_stop_deleters:
                     break
         if not success:
+            self._record_fallback("delete_stop", None)
             raise StopDeleterUnavailable("Stop could not be deleted with any of the Stop deleters defined")
 
-    def find_all_stops(
+    def _prepare_crawl(
             self,
             end: int,
-            start: int = 1,
-            threads: int = 0,
-            update: bool = True,
-            use_all_stop_getters: bool = False,
-            use_all_stop_setters: Optional[bool] = None
-    ):
-        """Find all the stops when the online resources do not provide a full list of Stops.
-        This method will manually search the Stops by ID sequentially
-        between the start and end ranges using the available Stop Getters.
-        The method can run on the background using thread.
-        The threads parameter define how many threads will be used. By default is 0, which means use no threads.
-        All the found stops will be saved/updated using the Stop setters defined on the PyBuses instance.
-        :param end: Stop ID limit to search
-        :param start: First Stop ID to search (default=1)
-        :param threads: number of threads to use (default=0: use no threads)
-        :param update: if True, when a found Stop currently exists on a Setter data destination,
-                       update stop on destination with the current data of the Stop provided (default=True)
-        :param use_all_stop_getters: if True, ignore the StopNotExist/StopNotFound exceptions
-                                     and keep searching on next getters (default=False)
-        :param use_all_stop_setters: if True, save each Stop on all the Stop Setters
-                                     (default=use the value declared on this PyBuses instance)
-        :type end: int
-        :type start: int
-        :type threads: int
-        :type update: bool
-        :type use_all_stop_getters: bool
-        :type use_all_stop_setters: bool or None
-        :return: List[Stop] or None
+            start: int,
+            checkpoint: Optional[Union[str, CrawlCheckpoint]],
+            adaptive: Union[bool, AdaptiveDiscovery],
+            sync: Optional[Union[str, StopsSync]]
+    ) -> Tuple[List[StopGetter], Optional[CrawlCheckpoint], Optional[StopsSync], Iterable[int]]:
+        """Check and prepare the parameters of find_all_stops().
+        :return: tuple with the Online Stop getters, the checkpoint, the StopsSync, and the Stop IDs to search
         :raise: MissingGetters or MissingSetters
         """
         getters: List[StopGetter] = self.get_stop_getters(True)  # Get all Online getters
@@ -214,113 +475,216 @@ class PyBuses(object):
             raise MissingGetters("No Stop getters defined on this PyBuses instance")
         if not self.get_stop_setters():
             raise MissingSetters("No Stop setters defined on this PyBuses instance")
+        if isinstance(checkpoint, str):
+            checkpoint = CrawlCheckpoint(checkpoint)
+        if isinstance(sync, str):
+            sync = StopsSync(sync)
+        if sync is not None:
+            sync.reset_summary()
+        if adaptive is True:
+            stopids = AdaptiveDiscovery(start=start, end=end)
+        elif adaptive:
+            stopids = adaptive
+        else:
+            stopids = range(start, end+1)
+        return getters, checkpoint, sync, stopids
 
-        def _find_stop_and_save(stopid_tofind):  # Function used by threads/no-thread
-            for getter in getters:  # type: StopGetter
-                try:
-                    print("Searching Stop", stopid_tofind)
-                    stop = getter(stopid_tofind)
-                except StopGetterUnavailable:
+    def _find_stop_and_save_steps(
+            self,
+            getters: List[StopGetter],
+            stopid: int,
+            update: bool,
+            use_all_stop_getters: bool,
+            use_all_stop_setters: Optional[bool],
+            sync: Optional[StopsSync] = None,
+            on_commit: Optional[Callable[[List[int], List[int]], None]] = None
+    ) -> _Steps:
+        """Search a Stop on the given getters and save it on the Stop setters if found.
+        These are the steps of the Crawl Probe used by find_all_stops().
+        If a StopsSync is given, found Stops are only saved if new or changed, in batches. The save of a queued
+        Stop is deferred (None is returned as saved): the result of each batch is passed to on_commit.
+        :return: tuple with the Crawl Outcome, the Stop found (or None) and False if the Stop could not be saved
+                 (None if the save was deferred)
+        :rtype: (str, Stop or None, bool or None)
+        """
+        outcome = CrawlOutcomes.ERROR
+        for getter in getters:  # type: StopGetter
+            try:
+                stop = yield _Call(CallableKinds.STOP_GETTER, getter, stopid)
+            except StopGetterUnavailable:
+                continue
+            except (StopNotFound, StopNotExist) as ex:
+                outcome = CrawlOutcomes.NOT_EXIST if isinstance(ex, StopNotExist) else CrawlOutcomes.NOT_FOUND
+                if use_all_stop_getters:
                     continue
-                except (StopNotFound, StopNotExist):
-                    if use_all_stop_getters:
-                        continue
-                    else:
-                        break
                 else:
-                    try:
-                        print(f"Stop {stop.stopid} found! Name={stop.name}, lat={stop.lat}, lon={stop.lon}")
-                        self.save_stop(stop, update=update, use_all_stop_setters=use_all_stop_setters)
-                    except StopSetterUnavailable:
-                        pass
-
-        if threads <= 0:  # Use no threads
-            for stopid in range(start, end+1):
-                _find_stop_and_save(stopid)
-        else:  # Use threads
-            # created_threads = list()
-
-            class Counter(object):
-                def __init__(self, initial, limit):
-                    self.value: int = initial
-                    self.limit: int = limit
-                    self.lock = Lock()
-
-                def get(self):
-                    self.lock.acquire()
-                    current = self.value
-                    if current > self.limit:
-                        self.lock.release()
-                        raise IndexError()
-                    self.value += 1
-                    self.lock.release()
-                    return current
-
-            counter = Counter(initial=start, limit=end)
-
-            def _thread_f(th_counter: Counter):  # Function for threads
-                while True:
-                    try:
-                        stopid_tofind = th_counter.get()
-                    except IndexError:
-                        break
-                    else:
-                        _find_stop_and_save(stopid_tofind)
+                    break
+            else:
+                if sync is not None:
+                    queued = sync.is_changed(stop)
+                    batch = sync.process(stopid, CrawlOutcomes.FOUND, stop)
+                    yield from self._save_sync_batch_steps(sync, batch, update, use_all_stop_setters, on_commit)
+                    return CrawlOutcomes.FOUND, stop, None if queued else True
+                try:
+                    yield from self._save_stop_steps(stop, update, use_all_stop_setters)
+                except StopSetterUnavailable:
+                    return CrawlOutcomes.FOUND, stop, False
+                return CrawlOutcomes.FOUND, stop, True
+        if sync is not None:
+            sync.process(stopid, outcome, None)
+        return outcome, None, True
 
-            for i in range(threads):
-                th = Thread(target=_thread_f, args=(counter,))
-                # created_threads.append(th)
-                th.start()
+    def _save_sync_batch_steps(
+            self,
+            sync: StopsSync,
+            batch: List[Stop],
+            update: bool,
+            use_all_stop_setters: Optional[bool],
+            on_commit: Optional[Callable[[List[int], List[int]], None]] = None
+    ) -> _Steps:
+        """Save a batch of new or changed Stops of an incremental sync, and commit the result on the StopsSync.
+        :param sync: StopsSync that generated the batch
+        :param batch: Stops to save
+        :param update: update the Stops if currently exist on a Setter data destination
+        :param use_all_stop_setters: save each Stop on all the Stop Setters
+        :param on_commit: function called with the IDs of the saved Stops and the IDs of the Stops that
+                          could not be saved, after the commit (default=None)
+        :type sync: StopsSync
+        :type batch: list of Stop
+        :type update: bool
+        :type use_all_stop_setters: bool or None
+        :type on_commit: function or None
+        """
+        if not batch:
+            return
+        failed = yield from self._save_stops_steps(batch, update, use_all_stop_setters)
+        sync.commit(batch, failed)
+        if on_commit is not None:
+            failed_ids = {stop.stopid for stop in failed}
+            on_commit([stop.stopid for stop in batch if stop.stopid not in failed_ids], list(failed_ids))
 
-    def get_buses(self, stopid: int, sort_by: Optional[int] = BusSortMethods.TIME, reverse: bool = False) -> List[Bus]:
-        """Get a live list of all the Buses coming to a certain Stop and the remaining until arrival.
-        If no Getters are defined, MissingGetters exception is raised.
-        :param stopid: ID of the Stop to search buses on
-        :param sort_by: method used to sort buses (use constants available in PyBuses (default=TIME: sort by Time)
-        :param reverse: if True, reverse sort the buses (default=False)
-        :type stopid: int
-        :type sort_by: int or None
-        :type reverse: bool
-        :return: List of Buses
-        :rtype: List[Bus]
-        :raise: MissingGetters or StopNotFound or BusGetterUnavailable
+    def _fetch_buses_steps(self, getters: List[BusGetter], stopid: int) -> _Steps:
+        """Steps of fetching the list of Buses of a Stop without hedging:
+        the next getter is only used when the current one raises BusGetterUnavailable.
         """
-        getters: List[BusGetter] = self.get_bus_getters()
-        if not getters:
-            raise MissingGetters("No Bus getters defined on this PyBuses instance")
-        for getter in getters:  # type: BusGetter
+        for tier, getter in enumerate(getters):  # type: int, BusGetter
             try:
-                buses: List[Bus] = getter(stopid)
-                if sort_by == BusSortMethods.TIME:
-                    buses.sort(key=lambda x: x.time, reverse=reverse)
-                elif sort_by == BusSortMethods.LINE:
-                    buses.sort(key=lambda x: x.line, reverse=reverse)
-                elif sort_by == BusSortMethods.ROUTE:
-                    buses.sort(key=lambda x: x.route, reverse=reverse)
-                return buses
+                buses = yield _Call(CallableKinds.BUS_GETTER, getter, stopid)
             except BusGetterUnavailable:
                 continue
+            self._record_fallback("get_buses", tier)
+            return buses
+        self._record_fallback("get_buses", None)
         raise BusGetterUnavailable("Bus list could not be retrieved with any of the Bus getters defined")
 
-    def save_buses(self):
-        pass
-
-    def delete_buses(self):
-        pass
-
-    def add_stop_getter(self, f: StopGetter, online: bool = False):
+    def add_stop_getter(
+            self,
+            f: StopGetter,
+            online: bool = False,
+            tier_setter: Optional[StopSetter] = None,
+            bulk: Optional[StopsGetter] = None,
+            label: Optional[str] = None
+    ):
+        """Add a Stop getter at the end of the Stop getters list (the slowest tier).
+        :param f: Stop getter function
+        :param online: True if the getter fetches Stops from an online, trustable source (default=False)
+        :param tier_setter: Stop setter that writes where this getter reads from. When a Stop is found on
+                            a later (slower) getter, it is promoted into this setter (default=None)
+        :param bulk: Bulk Getter that searches a list of Stops on the same source as the getter,
+                     used by find_stops() (default=None)
+        :param label: name of the getter (and its bulk getter) on the metrics (default=None: the function name)
+        :type online: bool
+        :type tier_setter: StopSetter or None
+        :type bulk: StopsGetter or None
+        :type label: str or None
+        """
         try:
             f.online = online
         except AttributeError:
             pass
         # TOFIX Los métodos no pueden llevar atributos, por lo que hay que buscar otra forma de definir el online
         self.stop_getters.append(f)
+        if tier_setter is not None:
+            self.stop_tier_setters[f] = tier_setter
+        if bulk is not None:
+            self.stop_bulk_getters[f] = bulk
+        self._set_callable_label(label, f, bulk)
 
-    def add_stop_setter(self, f: StopSetter):
+    def add_stops_cache(self, cache: StopsCache):
+        """Register an in-memory Stops cache on this PyBuses instance.
+        The find_stop method of the cache is added as the first Stop getter.
+        The cache is updated with every Stop found, saved or deleted through this PyBuses instance,
+        independently of the Stop setters and deleters defined, and it also keeps the negative results.
+        A SharedStopsCache can be registered too, to share the cache between processes.
+        :param cache: StopsCache object
+        :type cache: StopsCache or SharedStopsCache
+        """
+        self.stops_caches.append(cache)
+        self.stop_getters.insert(0, cache.find_stop)
+        self.stop_bulk_getters[cache.find_stop] = cache.find_stops
+
+    def add_stops_index(self, index: StopsIndex):
+        """Register an in-memory Stops index (StopSpatialIndex, StopsViewport or StopNameIndex)
+        on this PyBuses instance, to keep it up to date.
+        Like the Stops caches, the index is updated with every Stop found, saved or deleted through this PyBuses
+        instance, independently of the Stop setters and deleters defined and of use_all_stop_setters.
+        Stops reported as non-existing by a getter are removed from the index.
+        The index is not used as a getter: it must be queried directly.
+        :param index: Stops index object
+        :type index: StopSpatialIndex or StopsViewport or StopNameIndex
+        """
+        self.stops_indexes.append(index)
+
+    def add_stop_setter(self, f: StopSetter, bulk: Optional[StopsSetter] = None, label: Optional[str] = None):
+        """Add a Stop setter at the end of the Stop setters list.
+        :param f: Stop setter function
+        :param bulk: Bulk Setter that saves a list of Stops on the same destination as the setter,
+                     used by save_stops() and the write-behind queue (default=None)
+        :param label: name of the setter (and its bulk setter) on the metrics (default=None: the function name)
+        :type bulk: StopsSetter or None
+        :type label: str or None
+        """
         self.stop_setters.append(f)
+        if bulk is not None:
+            self.stop_bulk_setters[f] = bulk
+        self._set_callable_label(label, f, bulk)
+
+    def enable_write_behind(
+            self,
+            batch_size: int = DEFAULT_WRITE_BEHIND_BATCH_SIZE,
+            flush_interval: Union[int, float] = DEFAULT_WRITE_BEHIND_FLUSH_INTERVAL,
+            max_pending: int = DEFAULT_WRITE_BEHIND_MAX_PENDING,
+            on_error: Optional[Callable[[WriteBehindBatchError], None]] = None
+    ) -> StopsWriteBehind:
+        """Enable the write-behind queue: save_stop() will enqueue the Stops, and a background flusher will
+        save them in batches using save_stops() (so Bulk Setters are used when available).
+        :param batch_size: max number of Stops saved together (default=100)
+        :param flush_interval: max time, in seconds, that an enqueued Stop waits for its batch to fill (default=1)
+        :param max_pending: max number of Stops enqueued; save_stop() blocks when reached (default=10000)
+        :param on_error: function called with a WriteBehindBatchError when a batch fails (default=None)
+        :type batch_size: int
+        :type flush_interval: int or float
+        :type max_pending: int
+        :return: the write-behind queue, also available on the write_behind attribute
+        :rtype: StopsWriteBehind
+        """
+        if self.write_behind is None:
+            self.write_behind = StopsWriteBehind(
+                saver=self._write_behind_saver(),
+                batch_size=batch_size,
+                flush_interval=flush_interval,
+                max_pending=max_pending,
+                on_error=on_error
+            )
+        return self.write_behind
+
+    def add_stop_deleter(self, f: StopDeleter, label: Optional[str] = None):
+        self.stop_deleters.append(f)
+        self._set_callable_label(label, f)
 
-    def add_bus_getter(self, f: BusGetter):
+    def add_bus_getter(self, f: BusGetter, label: Optional[str] = None):
         self.bus_getters.append(f)
+        self._set_callable_label(label, f)
 
     def add_bus_setter(self, f: BusSetter):
         self.bus_setters.append(f)
@@ -353,6 +717,442 @@ class PyBuses(object):
     def get_bus_deleters(self) -> List[BusDeleter]:
         return self.bus_deleters
 
+
+
+class PyBuses(_BasePyBuses):
+    """A PyBuses object to help managing bus stops and look for incoming buses.
+    This object should be threated as a concrete transport service, i.e.:
+        - "the bus service of King's Landing"
+        - "the metro service of Liberty City"
+        - "the train service of Hamburg"
+        - "the bus service of Hamburg"
+    Each one of these services would have a PyBuses object, with their getters, setters and deleters.
+
+    Getters are custom, required functions that fetch Stop info and Bus lists from certain sources.
+    At least one Stop Getter and one Bus Getter are required to fetch stops and buses respectively.
+
+    Setters are custom, optional functions, that will save found Stops or list of buses to custom destinations
+    (i.e. a database, local variables, a file, cache...)
+    Setters are supposed to be executed after a Stop or Bus query is successful.
+    However, PyBuses will not do it automatically.
+
+    Deleters are custom, optional functions, that will delete saved Stops or list of buses on custom destinations,
+    usually the same places as Setters.
+
+    The PyBuses methods that use these functions are:
+        - Stop Getters: find_stop()
+        - Stop Setters: save_stop()
+        - Stop Deleters: delete_stop()
+        - Bus Getters: get_buses()
+        - Bus Setters: save_buses()
+        - Bus Deleters: delete_buses()
+
+    Please refer to documentation in order to check how Getter, Setter and Deleter functions must work.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """All the parameters are documented on _BasePyBuses.__init__()."""
+        super().__init__(*args, **kwargs)
+        self._promotion_executor: Optional[ThreadPoolExecutor] = None
+
+    def _instrumented_call(self, kind: str, f: Callable, *args, **kwargs) -> Any:
+        """Call a Getter/Setter/Deleter, recording its outcome and latency if metrics are enabled.
+        :param kind: role of the callable (one of CallableKinds)
+        :param f: function to call, with the given args and kwargs
+        :return: the value returned by the function
+        """
+        if self.metrics is None:
+            return f(*args, **kwargs)
+        return self.metrics.call(kind, self.get_callable_label(f), f, *args, **kwargs)
+
+    def _run_call(self, call: _Call) -> Any:
+        """Run a call requested by the steps of an operation, recording it on the metrics if it has a kind."""
+        if call.kind is None:
+            return call.f(*call.args, **call.kwargs)
+        return self._instrumented_call(call.kind, call.f, *call.args, **call.kwargs)
+
+    def _run_steps(self, steps: _Steps) -> Any:
+        """Run the steps of an operation, calling the requested Getters/Setters/Deleters directly.
+        The calls of a list are run one after another.
+        :param steps: generator with the steps of the operation
+        :return: the value returned by the operation
+        """
+        result, error = None, None
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as ex:
+                return ex.value
+            result, error = None, None
+            if isinstance(step, list):
+                result = list()
+                for call in step:  # type: _Call
+                    try:
+                        result.append(self._run_call(call))
+                    except Exception as ex:
+                        result.append(ex)
+            else:
+                try:
+                    result = self._run_call(step)
+                except Exception as ex:
+                    error = ex
+
+    def find_stop(self, stopid: int, online: bool = False) -> Stop:
+        """Find a Stop using the defined Stop Getters on this PyBuses instances.
+        If no Getters are defined, MissingGetters exception is raised.
+        The getters are used in order. When a getter raises StopGetterUnavailable or StopNotFound,
+        the next getter is used. When a getter raises StopNotExist, the search stops.
+        The Stops caches registered on this PyBuses instance are updated with the result,
+        including negative results (StopNotExist, or StopNotFound on all the getters). A StopNotFound result
+        is not cached when any of the getters was unavailable, so the Stop is searched again on the next call.
+        Getters are treated as ordered tiers: when a Stop is found on a getter, it is promoted (saved) on the
+        background into the Tier Setters paired with the previous getters (see add_stop_getter()).
+        :param stopid: ID of the Stop to find
+        :param online: if True, only search on Online Getters, ignoring cached negative results (default=False)
+        :type stopid: int
+        :type online: bool
+        :return: Stop object
+        :rtype: list of Stop or False or Exception
+        :raise: MissingGetters or StopNotFound or StopNotExist or StopGetterUnavailable
+        """
+        return self._run_steps(self._find_stop_steps(stopid, online))
+
+    def find_stops(self, stopids: Iterable[int], online: bool = False) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Find many Stops using the defined Stop Getters on this PyBuses instance.
+        The getters are used in order, like on find_stop(), but only the Stops still missing are searched on
+        each getter. When a Stop getter has a Bulk Getter paired (see add_stop_getter()), all the missing Stops
+        are searched with a single call to the Bulk Getter. Otherwise, the Stop getter is called for each Stop.
+        Stops caches and Stop promotion are used in the same way as on find_stop().
+        :param stopids: IDs of the Stops to find
+        :param online: if True, only search on Online Getters, ignoring cached negative results (default=False)
+        :type stopids: iterable of int
+        :type online: bool
+        :return: dict of the found Stops by their Stop ID, and set of IDs of the Stops not found
+                 (because they do not exist, were not found, or all the getters failed)
+        :rtype: (dict of int: Stop, set of int)
+        :raise: MissingGetters
+        """
+        return self._run_steps(self._find_stops_steps(stopids, online))
+
+    def _promote_stop(self, stop: Stop, setters: List[StopSetter]):
+        """Save a Stop on the given Tier Setters, on a background thread, out of the caller latency path.
+        If the same Stop is currently being promoted, nothing is done.
+        Errors of the setters are ignored.
+        :param stop: Stop object to promote
+        :param setters: Tier Setters where the Stop will be saved
+        :type stop: Stop
+        :type setters: list of StopSetter
+        """
+        if not self._begin_promotion(stop.stopid):
+            return
+        with self._promotions_lock:
+            if self._promotion_executor is None:
+                self._promotion_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="PyBusesPromote")
+            # Submitted with the lock acquired, so close() never shuts the executor down in between
+            self._promotion_executor.submit(self._run_steps, self._promotion_steps(stop, setters))
+
+    def close(self, wait: bool = True):
+        """Shutdown the thread pool executor used to promote Stops on the background (see find_stop()),
+        if it was created. PyBuses can also be used as a context manager, that calls close() on exit.
+        This PyBuses instance can still be used after closing it: the executor is created again when needed.
+        :param wait: if True, wait until the pending promotions finish (default=True)
+        :type wait: bool
+        """
+        with self._promotions_lock:
+            executor, self._promotion_executor = self._promotion_executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def save_stop(self, stop: Stop, update: bool = True, use_all_stop_setters: Optional[bool] = None):
+        """Save the provided Stop object on the Stop setters defined.
+        The stop will only be saved on the first Setter where the Stop was saved successfully,
+        unless use_all_stop_setters attribute of PyBuses class or on this method is True.
+        If no Setters are defined, MissingSetters exception is raised.
+        If any of the Stop setters worked, StopSetterUnavailable exception is raised.
+        The Stop is always saved on the Stops caches and Stops indexes registered on this PyBuses instance.
+        If the write-behind queue is enabled (see enable_write_behind()), the Stop is enqueued and this method
+        returns immediately; the Stop will be saved later, in a batch, by the write-behind flusher.
+        :param stop: Stop object to save
+        :param update: if True, when the Stop currently exists on a Setter data destination,
+                       update stop on destination with the current data of the Stop provided (default=True)
+        :param use_all_stop_setters: if True, save the Stop on all the Stop Setters
+               (default=use the value declared on this PyBuses instance)
+        :type stop: Stop
+        :type update: bool
+        :type use_all_stop_setters: bool or None
+        :raise: MissingSetters or StopSetterUnavailable
+        """
+        self._run_steps(self._save_stop_steps(stop, update, use_all_stop_setters))
+
+    def save_stops(
+            self,
+            stops: Iterable[Stop],
+            update: bool = True,
+            use_all_stop_setters: Optional[bool] = None
+    ) -> List[Stop]:
+        """Save many Stops on the Stop setters defined, with the same behaviour as save_stop() for each Stop.
+        When a Stop setter has a Bulk Setter paired (see add_stop_setter()), all the Stops are saved with
+        a single call to the Bulk Setter. Otherwise, the Stop setter is called for each Stop.
+        The Stops are always saved directly, even if the write-behind queue is enabled.
+        Stops that could not be saved on any of the Stop setters are returned, instead of raising an exception.
+        :param stops: Stop objects to save
+        :param update: if True, when a Stop currently exists on a Setter data destination,
+                       update stop on destination with the current data of the Stop provided (default=True)
+        :param use_all_stop_setters: if True, save each Stop on all the Stop Setters
+               (default=use the value declared on this PyBuses instance)
+        :type stops: iterable of Stop
+        :type update: bool
+        :type use_all_stop_setters: bool or None
+        :return: Stops that could not be saved
+        :rtype: list of Stop
+        :raise: MissingSetters
+        """
+        return self._run_steps(self._save_stops_steps(stops, update, use_all_stop_setters))
+
+    def delete_stop(self, stopid: int):
+        """Delete the stop that matches the given Stop ID using the defined Stop Deleters.
+        The stop will only be deleted on the first Deleter where the Stop was deleted successfully,
+        unless use_all_stop_deleters attribute of PyBuses class is True (which is by default).
+        No exceptions will be raised if the stop was not deleted because it was not registered.
+        Only when all the Deleters themselves failed, StopDeleterUnavailable will be raised.
+        If no Deleters are defined, MissingDeleters exception is raised.
+        The Stop is always deleted from the Stops caches and Stops indexes registered on this PyBuses instance.
+        :param stopid: Stop ID of the Stop to delete
+        :type stopid: int
+        :raise: MissingDeleters or StopDeleterUnavailable
+        """
+        self._run_steps(self._delete_stop_steps(stopid))
+
+    def find_all_stops(
+            self,
+            end: int,
+            start: int = 1,
+            threads: int = 0,
+            update: bool = True,
+            use_all_stop_getters: bool = False,
+            use_all_stop_setters: Optional[bool] = None,
+            checkpoint: Optional[Union[str, CrawlCheckpoint]] = None,
+            refresh_age: Optional[Union[int, float]] = None,
+            resume: bool = True,
+            adaptive: Union[bool, AdaptiveDiscovery] = False,
+            sync: Optional[Union[str, StopsSync]] = None
+    ) -> StopsCrawl:
+        """Find all the stops when the online resources do not provide a full list of Stops.
+        This method will manually search the Stops by ID sequentially
+        between the start and end ranges using the available Stop Getters.
+        The method can run on the background using a pool of threads.
+        The threads parameter define how many threads will be used. By default is 0, which means use no threads,
+        so the method returns when the crawl is finished.
+        All the found stops will be saved/updated using the Stop setters defined on the PyBuses instance.
+        A StopsCrawl handle is returned, that can be used to join or cancel the crawl, check its progress,
+        and iterate over the found Stops while they are found.
+        :param end: Stop ID limit to search
+        :param start: First Stop ID to search (default=1)
+        :param threads: number of threads to use (default=0: use no threads)
+        :param update: if True, when a found Stop currently exists on a Setter data destination,
+                       update stop on destination with the current data of the Stop provided (default=True)
+        :param use_all_stop_getters: if True, ignore the StopNotExist/StopNotFound exceptions
+                                     and keep searching on next getters (default=False)
+        :param use_all_stop_setters: if True, save each Stop on all the Stop Setters
+                                     (default=use the value declared on this PyBuses instance)
+        :param checkpoint: checkpoint file path or object. If set, the outcome of each searched Stop ID
+                           is persisted, and an interrupted crawl is resumed from it (default=None)
+        :param refresh_age: re-scan mode: skip the IDs known to be non-existing from previous crawls of the checkpoint,
+                            unless they were searched more than these seconds ago (default=None: search them)
+        :param resume: if True, resume the last crawl of the checkpoint if it was not finished (default=True)
+        :param adaptive: if True or an AdaptiveDiscovery object, use the adaptive discovery strategy,
+                         which samples long runs of non-existing IDs and densifies around hits,
+                         instead of searching all the IDs (default=False: search all the IDs)
+        :param sync: incremental sync mode: fingerprints file path or StopsSync object. If set, only the Stops
+                     that are new or changed since the last sync are saved, in batches, and a summary of changes
+                     is available on the sync attribute of the returned crawl. Found Stops are only recorded on
+                     the checkpoint after their batch is saved (default=None)
+        :type end: int
+        :type start: int
+        :type threads: int
+        :type update: bool
+        :type use_all_stop_getters: bool
+        :type use_all_stop_setters: bool or None
+        :type checkpoint: str or CrawlCheckpoint or None
+        :type refresh_age: int or float or None
+        :type resume: bool
+        :type adaptive: bool or AdaptiveDiscovery
+        :type sync: str or StopsSync or None
+        :return: handle of the crawl, already started (and finished if threads=0)
+        :rtype: StopsCrawl
+        :raise: MissingGetters or MissingSetters
+        """
+        getters, checkpoint, sync, stopids = self._prepare_crawl(end, start, checkpoint, adaptive, sync)
+
+        def _probe(stopid: int) -> Tuple[str, Optional[Stop], Optional[bool]]:
+            return self._run_steps(self._find_stop_and_save_steps(
+                getters, stopid, update, use_all_stop_getters, use_all_stop_setters, sync, _on_commit
+            ))
+
+        def _on_commit(saved: List[int], failed: List[int]):
+            crawl.record_commit(saved, failed)
+
+        def _on_end():
+            if sync is not None:
+                self._run_steps(self._save_sync_batch_steps(
+                    sync, sync.drain(), update, use_all_stop_setters, _on_commit
+                ))
+                sync.save()
+
+        crawl = StopsCrawl(
+            probe=_probe,
+            stopids=stopids,
+            threads=threads,
+            checkpoint=checkpoint,
+            refresh_age=refresh_age,
+            resume=resume,
+            on_end=_on_end
+        )
+        crawl.sync = sync
+        return crawl.start()
+
+    def get_buses(
+            self,
+            stopid: int,
+            sort_by: Optional[int] = BusSortMethods.TIME,
+            reverse: bool = False,
+            hedge: Optional[bool] = None,
+            max_age: Optional[Union[int, float]] = None,
+            use_cache: bool = True
+    ) -> List[Bus]:
+        """Get a live list of all the Buses coming to a certain Stop and the remaining until arrival.
+        If no Getters are defined, MissingGetters exception is raised.
+        If a Bus hedge policy is defined on this PyBuses instance, the getters are raced (hedged mode):
+        when a getter does not answer within the hedge delay, the next one is started in parallel,
+        and the first list of buses successfully returned wins.
+        If a Buses cache is defined on this PyBuses instance, fresh cached lists of buses are returned
+        without calling the getters, and concurrent calls for the same Stop share a single fetch.
+        :param stopid: ID of the Stop to search buses on
+        :param sort_by: method used to sort buses (use constants available in PyBuses (default=TIME: sort by Time)
+        :param reverse: if True, reverse sort the buses (default=False)
+        :param hedge: if False, do not use hedged mode even if a hedge policy is defined (default=None)
+        :param max_age: max age, in seconds, of cached buses to return (default=None: use the cache TTL)
+        :param use_cache: if False, ignore the cached buses and fetch them again;
+                          the fetched buses are still saved on the cache (default=True)
+        :type stopid: int
+        :type sort_by: int or None
+        :type reverse: bool
+        :type hedge: bool or None
+        :type max_age: int or float or None
+        :type use_cache: bool
+        :return: List of Buses
+        :rtype: List[Bus]
+        :raise: MissingGetters or StopNotFound or BusGetterUnavailable
+        """
+        getters: List[BusGetter] = self.get_bus_getters()
+        if not getters:
+            raise MissingGetters("No Bus getters defined on this PyBuses instance")
+
+        def _fetch(_stopid: int) -> List[Bus]:
+            return self._fetch_buses(getters, _stopid, hedge)
+
+        if self.buses_cache is not None:
+            buses = self.buses_cache.fetch(stopid, _fetch, max_age=max_age, bypass=not use_cache)
+        else:
+            buses = _fetch(stopid)
+        sort_buses(buses, sort_by, reverse)
+        return buses
+
+    def _fetch_buses(self, getters: List[BusGetter], stopid: int, hedge: Optional[bool] = None) -> List[Bus]:
+        """Fetch the list of Buses of a Stop from the given Bus getters, without using the cache nor sorting them.
+        The getters are raced if a Bus hedge policy is defined and hedge is not False.
+        Otherwise, the next getter is only used when the current one raises BusGetterUnavailable.
+        :param getters: Bus getters to use, in order of preference
+        :param stopid: ID of the Stop to search buses on
+        :param hedge: if False, do not use hedged mode even if a hedge policy is defined (default=None)
+        :type getters: list of BusGetter
+        :type stopid: int
+        :type hedge: bool or None
+        :return: List of Buses (unsorted)
+        :rtype: List[Bus]
+        :raise: StopNotFound or BusGetterUnavailable
+        """
+        if self.bus_hedge_policy is not None and hedge is not False:
+            return self._get_buses_hedged(getters, stopid)
+        return self._run_steps(self._fetch_buses_steps(getters, stopid))
+
+    def _get_buses_hedged(self, getters: List[BusGetter], stopid: int) -> List[Bus]:
+        """Race the given Bus getters using the Bus hedge policy of this PyBuses instance.
+        The first getter is started, and the next getter is started when the current one fails,
+        or when it did not answer within the hedge delay.
+        The first successful list of buses is returned, and the losing getters are cancelled or ignored.
+        :param getters: Bus getters to use, in order of preference
+        :param stopid: ID of the Stop to search buses on
+        :type getters: list of BusGetter
+        :type stopid: int
+        :return: List of Buses (unsorted)
+        :rtype: List[Bus]
+        :raise: StopNotFound or BusGetterUnavailable
+        """
+        policy: HedgePolicy = self.bus_hedge_policy
+        executor = policy.get_executor()
+        remaining: List[BusGetter] = list(getters)
+        pending: Dict[Future, BusGetter] = dict()
+
+        def _call(getter: BusGetter) -> List[Bus]:
+            if self.metrics is None:
+                return policy.call(getter, stopid)
+            with self.metrics.timed(CallableKinds.BUS_GETTER, self.get_callable_label(getter)):
+                return policy.call(getter, stopid)
+
+        def _launch() -> BusGetter:
+            getter = remaining.pop(0)
+            pending[executor.submit(_call, getter)] = getter
+            return getter
+
+        last_launched = _launch()
+        try:
+            while pending:
+                delay = policy.hedge_delay(last_launched) if remaining else None
+                done, _ = wait(pending.keys(), timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Current getter is too slow: start the next one in parallel
+                    last_launched = _launch()
+                    continue
+                for future in done:
+                    getter = pending.pop(future)
+                    try:
+                        buses = future.result()
+                    except BusGetterUnavailable:
+                        if remaining:
+                            last_launched = _launch()
+                    else:
+                        self._record_fallback("get_buses", getters.index(getter))
+                        return buses
+        finally:
+            for future in pending.keys():
+                future.cancel()
+        self._record_fallback("get_buses", None)
+        raise BusGetterUnavailable("Bus list could not be retrieved with any of the Bus getters defined")
+
+    def save_buses(self):
+        pass
+
+    def delete_buses(self):
+        pass
+
+    def _write_behind_saver(self) -> Callable[[List[Stop], bool, Optional[bool]], List[Stop]]:
+        """Get the function used by the write-behind flusher to save batches of Stops."""
+        return self.save_stops
+
+    def disable_write_behind(self, timeout: Optional[float] = None) -> bool:
+        """Flush the pending Stops of the write-behind queue and disable it.
+        :param timeout: max time to wait for the pending Stops, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if all the pending Stops were processed (or the queue was not enabled),
+                 False if timeout expired
+        :rtype: bool
+        """
+        write_behind, self.write_behind = self.write_behind, None
+        if write_behind is None:
+            return True
+        return write_behind.close(timeout)
+
 # class PyBusesOld(object):
 #     """A PyBuses object that will help organizing bus stops and lookup incoming buses.
 #     Object must be initialized with a list of Stop and Bus getter functions,
@@ -0,0 +1,632 @@
+
+# Native modules
+import asyncio
+import math
+import time
+from collections import namedtuple
+from threading import Thread, Lock, Event, Condition
+from typing import Optional, List, Dict, Set, Iterable, Iterator, Generator, Callable, Awaitable, Tuple, Union
+# Own modules
+from .assets import Stop
+
+__all__ = ["StopsCrawl", "AsyncStopsCrawl", "CrawlProgress", "CrawlOutcomes", "AdaptiveDiscovery"]
+
+"""Crawl Outcomes are the possible results of searching a single Stop ID on a crawl.
+They can be used with alias from the CrawlOutcomes named tuple.
+FOUND = "found": the Stop was found
+NOT_EXIST = "not_exist": a getter reported that the Stop does not exist
+NOT_FOUND = "not_found": the Stop was not found on the getters, but it might exist
+ERROR = "error": the Stop could not be searched because all the getters were unavailable
+"""
+_crawl_outcomes_namedtuple = namedtuple("CrawlOutcomes", ["FOUND", "NOT_EXIST", "NOT_FOUND", "ERROR"])
+CrawlOutcomes = _crawl_outcomes_namedtuple("found", "not_exist", "not_found", "error")
+
+"""A Crawl Probe is a function that searches (and saves) a single Stop ID, and returns a tuple with
+the Crawl Outcome, the found Stop (or None if the Stop was not found),
+and a bool that is False when the Stop was found but could not be saved.
+The bool is None when the save of the Stop was deferred (e.g. queued on a batch of an incremental sync):
+the result of the save must then be registered on the crawl with record_commit().
+"""
+CrawlProbe = Callable[[int], Tuple[str, Optional[Stop], bool]]
+AsyncCrawlProbe = Callable[[int], Awaitable[Tuple[str, Optional[Stop], bool]]]
+
+_OUTCOME_COUNTERS = {
+    CrawlOutcomes.FOUND: "found",
+    CrawlOutcomes.NOT_EXIST: "not_exist",
+    CrawlOutcomes.NOT_FOUND: "not_found",
+    CrawlOutcomes.ERROR: "errors"
+}
+
+"""A Crawl Chunk is a generator that yields the Stop IDs to search, one by one,
+and receives (through send()) the Crawl Outcome of each yielded ID.
+A crawl assigns whole chunks to its workers, so the IDs of a chunk are searched sequentially.
+"""
+CrawlChunk = Generator[int, str, None]
+
+DEFAULT_ADAPTIVE_BLOCK_SIZE = 500
+DEFAULT_ADAPTIVE_BLOCKS_PER_WORKER = 4
+DEFAULT_ADAPTIVE_MISS_RUN = 30
+DEFAULT_ADAPTIVE_MAX_STRIDE = 16
+
+
+class AdaptiveDiscovery(object):
+    """Adaptive strategy to discover Stop IDs on sparse ranges, where the existing IDs are clustered
+    and separated by large gaps of non-existing IDs.
+
+    The range is split in blocks, which are searched independently (in parallel by the workers of the crawl).
+    If no block size is given, it is calculated from the number of workers of the crawl, so every worker
+    gets several blocks, between 4 times the miss run and 500 IDs.
+    Each block is searched sequentially, until a run of consecutive not found/non-existing IDs is reached.
+    Then, the IDs are sampled with a stride that doubles with each new miss run, up to a max stride.
+    When a sampled ID is found, the skipped IDs before it are searched backwards (densify around the hit),
+    until a new miss run is reached, and the block continues being searched sequentially after the hit.
+
+    With fallback=True, once a block was sampled, the IDs of the block that were skipped are searched too,
+    so the crawl finds the same Stops as the exhaustive strategy: the Stops around hits are found earlier,
+    but the number of searched IDs is not reduced.
+    IDs that could not be searched (all the getters unavailable) are not considered as misses.
+    """
+    def __init__(
+            self,
+            start: int,
+            end: int,
+            block_size: Optional[int] = None,
+            miss_run: int = DEFAULT_ADAPTIVE_MISS_RUN,
+            max_stride: int = DEFAULT_ADAPTIVE_MAX_STRIDE,
+            fallback: bool = False
+    ):
+        """
+        :param start: first Stop ID to search
+        :param end: last Stop ID to search
+        :param block_size: number of IDs of each block (default=None: calculated from the number of workers)
+        :param miss_run: number of consecutive misses that increase the sampling stride (default=30)
+        :param max_stride: max distance between sampled IDs (default=16)
+        :param fallback: if True, search the IDs skipped on each block after sampling it (default=False)
+        :type start: int
+        :type end: int
+        :type block_size: int or None
+        :type miss_run: int
+        :type max_stride: int
+        :type fallback: bool
+        """
+        self.start: int = start
+        self.end: int = end
+        self.block_size: Optional[int] = None if block_size is None else max(block_size, 1)
+        self.miss_run: int = max(miss_run, 1)
+        self.max_stride: int = max(max_stride, 1)
+        self.fallback: bool = fallback
+
+    def get_block_size(self, workers: int = 1) -> int:
+        """Get the size of the blocks used for a crawl with the given number of workers.
+        :param workers: number of threads or tasks of the crawl (default=1)
+        :type workers: int
+        :rtype: int
+        """
+        if self.block_size is not None:
+            return self.block_size
+        per_worker = math.ceil((self.end - self.start + 1) / (max(workers, 1) * DEFAULT_ADAPTIVE_BLOCKS_PER_WORKER))
+        return max(min(per_worker, DEFAULT_ADAPTIVE_BLOCK_SIZE), self.miss_run * 4)
+
+    def chunks(self, workers: int = 1) -> Iterator[CrawlChunk]:
+        """Get the Crawl Chunks (one per block) of this strategy.
+        :param workers: number of threads or tasks of the crawl, used to calculate the block size (default=1)
+        :type workers: int
+        """
+        block_size = self.get_block_size(workers)
+        for first in range(self.start, self.end+1, block_size):
+            yield self._scan_block(first, min(first + block_size - 1, self.end))
+
+    def _scan_block(self, first: int, last: int) -> CrawlChunk:
+        probed: Set[int] = set()
+        yield from self._sample_block(first, last, probed)
+        if self.fallback:
+            for stopid in range(first, last+1):
+                if stopid not in probed:
+                    yield stopid
+
+    def _sample_block(self, first: int, last: int, probed: Set[int]) -> CrawlChunk:
+        """Search a block with the adaptive strategy, adding the searched IDs to the probed set."""
+        stride = 1
+        misses = 0
+        last_probed = first - 1
+        stopid = first
+        while stopid <= last:
+            outcome = yield stopid
+            probed.add(stopid)
+            if outcome == CrawlOutcomes.FOUND:
+                if stopid - last_probed > 1:
+                    # Densify: search the skipped IDs before the hit, backwards
+                    gap_misses = 0
+                    for back_stopid in range(stopid-1, last_probed, -1):
+                        back_outcome = yield back_stopid
+                        probed.add(back_stopid)
+                        if back_outcome == CrawlOutcomes.FOUND:
+                            gap_misses = 0
+                        elif back_outcome != CrawlOutcomes.ERROR:
+                            gap_misses += 1
+                            if gap_misses >= self.miss_run:
+                                break
+                stride = 1
+                misses = 0
+            elif outcome != CrawlOutcomes.ERROR:
+                misses += 1
+                if misses >= self.miss_run:
+                    stride = min(stride * 2, self.max_stride)
+                    misses = 0
+            last_probed = stopid
+            stopid += stride
+
+
+def _linear_chunks(stopids: Iterable[int]) -> Iterator[CrawlChunk]:
+    """Get Crawl Chunks of a single ID for each one of the given Stop IDs."""
+    def _chunk(stopid: int) -> CrawlChunk:
+        yield stopid
+    for _stopid in stopids:
+        yield _chunk(_stopid)
+
+
+class CrawlProgress(object):
+    """A snapshot of the progress of a Stops crawl."""
+    def __init__(
+            self,
+            scanned: int,
+            found: int,
+            not_exist: int,
+            not_found: int,
+            errors: int,
+            save_errors: int,
+            skipped: int,
+            elapsed: float
+    ):
+        """
+        :param scanned: number of Stop IDs searched
+        :param found: number of Stops found
+        :param not_exist: number of Stop IDs reported as non-existing
+        :param not_found: number of Stop IDs not found
+        :param errors: number of Stop IDs that could not be searched because all the getters were unavailable
+        :param save_errors: number of found Stops that could not be saved on any Stop setter
+        :param skipped: number of Stop IDs not searched because their outcome was known from a checkpoint
+        :param elapsed: seconds elapsed since the crawl started
+        """
+        self.scanned: int = scanned
+        self.found: int = found
+        self.not_exist: int = not_exist
+        self.not_found: int = not_found
+        self.errors: int = errors
+        self.save_errors: int = save_errors
+        self.skipped: int = skipped
+        self.elapsed: float = elapsed
+
+    @property
+    def stops_per_second(self) -> float:
+        """Number of Stop IDs searched per second (skipped IDs are not counted)."""
+        return self.scanned / self.elapsed if self.elapsed > 0 else 0.0
+
+    def asdict(self) -> Dict:
+        """Return the progress counters as a dict.
+        :rtype: dict
+        """
+        d = dict(self.__dict__)
+        d["stops_per_second"] = self.stops_per_second
+        return d
+
+    def __repr__(self):
+        return "CrawlProgress(" + ", ".join(f"{k}={v}" for k, v in self.asdict().items()) + ")"
+
+
+class _BaseCrawl(object):
+    """Common counters and results of the threaded and asyncio crawls."""
+    def __init__(
+            self,
+            stopids: Union[Iterable[int], AdaptiveDiscovery],
+            checkpoint: Optional["CrawlCheckpoint"] = None,
+            refresh_age: Optional[Union[int, float]] = None,
+            resume: bool = True,
+            on_end: Optional[Callable] = None,
+            workers: int = 1
+    ):
+        self.found_stops: List[Stop] = list()
+        self.exception: Optional[BaseException] = None
+        self.sync: Optional["StopsSync"] = None
+        self.on_end: Optional[Callable] = on_end
+        self.checkpoint: Optional["CrawlCheckpoint"] = checkpoint
+        self.refresh_age: Optional[Union[int, float]] = refresh_age
+        self.resume: bool = resume
+        if isinstance(stopids, AdaptiveDiscovery):
+            self._chunks: Iterator[CrawlChunk] = stopids.chunks(workers)
+        else:
+            self._chunks: Iterator[CrawlChunk] = _linear_chunks(stopids)
+        self._counters: Dict[str, int] = {
+            "scanned": 0, "found": 0, "not_exist": 0, "not_found": 0, "errors": 0, "save_errors": 0, "skipped": 0
+        }
+        self._counters_lock = Lock()
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._cancelled: bool = False
+
+    def _record(self, stopid: int, outcome: str, stop: Optional[Stop], saved: bool = True):
+        """Register the outcome of searching a Stop ID.
+        :param stopid: Stop ID searched
+        :param outcome: one of the CrawlOutcomes
+        :param stop: Stop found, or None if not found
+        :param saved: False if the Stop was found but could not be saved, None if its save was deferred
+        """
+        if self.checkpoint is not None and saved:
+            self.checkpoint.record(stopid, outcome)
+        with self._counters_lock:
+            self._counters["scanned"] += 1
+            self._counters[_OUTCOME_COUNTERS[outcome]] += 1
+            if saved is False:
+                self._counters["save_errors"] += 1
+            if stop is not None:
+                self.found_stops.append(stop)
+
+    def record_commit(self, saved: Iterable[int], failed: Iterable[int] = ()):
+        """Register the result of saving a batch of found Stops whose save was deferred by the probe.
+        Saved Stops are recorded on the checkpoint; Stops that could not be saved are counted as save errors,
+        and are not recorded, so they are searched again when the crawl is resumed.
+        :param saved: IDs of the Stops saved
+        :param failed: IDs of the Stops that could not be saved (default=none)
+        :type saved: iterable of int
+        :type failed: iterable of int
+        """
+        if self.checkpoint is not None:
+            for stopid in saved:  # type: int
+                self.checkpoint.record(stopid, CrawlOutcomes.FOUND)
+        failed = list(failed)
+        if failed:
+            with self._counters_lock:
+                self._counters["save_errors"] += len(failed)
+
+    def _known_outcome(self, stopid: int) -> Optional[str]:
+        """Get the outcome of a Stop ID from the checkpoint, if the ID does not need to be searched again.
+        Skipped IDs are counted on the progress.
+        :return: the known outcome, or None if the ID must be searched
+        """
+        if self.checkpoint is None:
+            return None
+        outcome = self.checkpoint.known_outcome(stopid, self.refresh_age)
+        if outcome is not None:
+            with self._counters_lock:
+                self._counters["skipped"] += 1
+        return outcome
+
+    def _begin(self):
+        """Mark the crawl as started."""
+        self._started = time.monotonic()
+        if self.checkpoint is not None:
+            self.checkpoint.begin(self.resume)
+
+    def _end(self):
+        """Mark the crawl as finished. The checkpoint run is only finished if the crawl was not cancelled."""
+        self._finished = time.monotonic()
+        if self.checkpoint is not None:
+            if self._cancelled:
+                self.checkpoint.save()
+            else:
+                self.checkpoint.finish()
+
+    def progress(self) -> CrawlProgress:
+        """Get the current progress of the crawl.
+        :rtype: CrawlProgress
+        """
+        if self._started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished or time.monotonic()) - self._started
+        with self._counters_lock:
+            return CrawlProgress(elapsed=elapsed, **self._counters)
+
+    def _fail(self, exception: BaseException):
+        """Register an exception raised by a worker, and cancel the crawl, so its checkpoint run is not finished.
+        Only the first exception is kept.
+        """
+        if self.exception is None:
+            self.exception = exception
+        self.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+
+class StopsCrawl(_BaseCrawl):
+    """Handle of a Stops crawl that searches a range of Stop IDs using a pool of threads.
+    Found Stops are available on the found_stops list, and can be consumed while the crawl runs
+    by iterating over this object.
+    If a worker fails with an exception, the crawl is cancelled, and the exception is available on the
+    exception attribute, and raised by join().
+    If the crawl runs on incremental sync mode, the StopsSync used is available on the sync attribute.
+    """
+    def __init__(
+            self,
+            probe: CrawlProbe,
+            stopids: Union[Iterable[int], AdaptiveDiscovery],
+            threads: int = 0,
+            checkpoint: Optional["CrawlCheckpoint"] = None,
+            refresh_age: Optional[Union[int, float]] = None,
+            resume: bool = True,
+            on_end: Optional[Callable] = None
+    ):
+        """
+        :param probe: function that searches (and saves) a single Stop ID (see CrawlProbe)
+        :param stopids: Stop IDs to search, or AdaptiveDiscovery strategy
+        :param threads: number of worker threads; 0 to run the crawl on the thread that calls start() (default=0)
+        :param checkpoint: if set, persist the outcomes on this checkpoint, and skip the IDs known from it
+                           (default=None)
+        :param refresh_age: skip the IDs known to be non-existing from previous runs of the checkpoint,
+                            if they were searched less than these seconds ago (default=None: do not skip them)
+        :param resume: if True, resume the checkpoint run if it was not finished (default=True)
+        :param on_end: function called when the crawl finishes or is cancelled, before it is marked as done.
+                       If it raises, the crawl is marked as done anyway, and the exception is raised by join()
+                       (default=None)
+        :type stopids: iterable of int or AdaptiveDiscovery
+        :type threads: int
+        :type checkpoint: CrawlCheckpoint or None
+        :type refresh_age: int or float or None
+        :type resume: bool
+        :type on_end: callable or None
+        """
+        super().__init__(stopids, checkpoint, refresh_age, resume, on_end, workers=max(threads, 1))
+        self.probe: CrawlProbe = probe
+        self.threads: int = threads
+        self._chunks_lock = Lock()
+        self._progressed = Condition()
+        self._workers: List[Thread] = list()
+        self._running_workers: int = 0
+        self._done = Event()
+
+    def start(self) -> "StopsCrawl":
+        """Start the crawl. If threads=0, this method blocks until the crawl finishes.
+        :return: this same StopsCrawl object
+        :rtype: StopsCrawl
+        """
+        self._begin()
+        if self.threads <= 0:
+            self._running_workers = 1
+            self._worker()
+        else:
+            self._running_workers = self.threads
+            for i in range(self.threads):
+                th = Thread(target=self._worker, name=f"StopsCrawl-{i}")
+                self._workers.append(th)
+                th.start()
+        return self
+
+    def _next_chunk(self) -> Optional[CrawlChunk]:
+        with self._chunks_lock:
+            if self._cancelled:
+                return None
+            return next(self._chunks, None)
+
+    def _worker(self):
+        try:
+            while True:
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                try:
+                    stopid = next(chunk)
+                    while not self._cancelled:
+                        stopid = chunk.send(self._process(stopid))
+                except StopIteration:
+                    pass
+        except BaseException as ex:
+            self._fail(ex)
+            if self.threads <= 0:
+                raise
+        finally:
+            with self._counters_lock:
+                self._running_workers -= 1
+                last = self._running_workers == 0
+            if last:
+                try:
+                    if self.on_end is not None:
+                        self.on_end()
+                except BaseException as ex:
+                    self._fail(ex)
+                    if self.threads <= 0:
+                        raise
+                finally:
+                    try:
+                        self._end()
+                    finally:
+                        with self._progressed:
+                            self._done.set()
+                            self._progressed.notify_all()
+
+    def _process(self, stopid: int) -> str:
+        """Search a single Stop ID with the probe, and register the outcome.
+        The probe is not used if the outcome of the ID is known from the checkpoint.
+        :return: the Crawl Outcome of the ID
+        """
+        outcome = self._known_outcome(stopid)
+        if outcome is not None:
+            return outcome
+        outcome, stop, saved = self.probe(stopid)
+        self._record(stopid, outcome, stop, saved)
+        if stop is not None:
+            with self._progressed:
+                self._progressed.notify_all()
+        return outcome
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the crawl finishes.
+        :param timeout: max time to wait, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if the crawl finished, False if timeout expired
+        :rtype: bool
+        :raise: the exception raised by a worker, if the crawl was stopped by one
+        """
+        finished = self._done.wait(timeout)
+        if finished and self.exception is not None:
+            raise self.exception
+        return finished
+
+    def cancel(self):
+        """Stop the crawl. Stop IDs currently being searched will finish, but no more IDs will be searched."""
+        self._cancelled = True
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def __iter__(self) -> Iterator[Stop]:
+        """Iterate over the found Stops as they are found, until the crawl finishes.
+        Iteration starts from the first Stop of found_stops, so Stops found before iterating are not missed.
+        Several consumers can iterate over the crawl at the same time.
+        """
+        index = 0
+        while True:
+            with self._progressed:
+                while index >= len(self.found_stops) and not self._done.is_set():
+                    self._progressed.wait()
+                stops = self.found_stops[index:]
+            if not stops:
+                return
+            index += len(stops)
+            yield from stops
+
+
+class AsyncStopsCrawl(_BaseCrawl):
+    """Handle of a Stops crawl that searches a range of Stop IDs using asyncio tasks.
+    Same as StopsCrawl, but join() is a coroutine and found Stops are consumed with "async for".
+    If a task fails with an exception, the crawl is cancelled, and the exception is raised by join().
+    Must be started from a running event loop.
+    """
+    def __init__(
+            self,
+            probe: AsyncCrawlProbe,
+            stopids: Union[Iterable[int], AdaptiveDiscovery],
+            concurrency: int = 1,
+            checkpoint: Optional["CrawlCheckpoint"] = None,
+            refresh_age: Optional[Union[int, float]] = None,
+            resume: bool = True,
+            on_end: Optional[Callable] = None
+    ):
+        """
+        :param probe: coroutine function that searches (and saves) a single Stop ID (see CrawlProbe)
+        :param stopids: Stop IDs to search, or AdaptiveDiscovery strategy
+        :param concurrency: number of Stop IDs searched at the same time (default=1)
+        :param checkpoint: if set, persist the outcomes on this checkpoint, and skip the IDs known from it
+                           (default=None)
+        :param refresh_age: skip the IDs known to be non-existing from previous runs of the checkpoint,
+                            if they were searched less than these seconds ago (default=None: do not skip them)
+        :param resume: if True, resume the checkpoint run if it was not finished (default=True)
+        :param on_end: coroutine function called when the crawl finishes or is cancelled,
+                       before it is marked as done. If it raises, the crawl is marked as done anyway,
+                       and the exception is raised by join() (default=None)
+        :type stopids: iterable of int or AdaptiveDiscovery
+        :type concurrency: int
+        :type checkpoint: CrawlCheckpoint or None
+        :type refresh_age: int or float or None
+        :type resume: bool
+        :type on_end: callable or None
+        """
+        super().__init__(stopids, checkpoint, refresh_age, resume, on_end, workers=max(concurrency, 1))
+        self.probe: AsyncCrawlProbe = probe
+        self.concurrency: int = max(concurrency, 1)
+        self._progressed: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = list()
+        self._done: Optional[asyncio.Event] = None
+
+    def start(self) -> "AsyncStopsCrawl":
+        """Start the crawl on the running event loop.
+        :return: this same AsyncStopsCrawl object
+        :rtype: AsyncStopsCrawl
+        """
+        self._begin()
+        self._progressed = asyncio.Event()
+        self._done = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        asyncio.ensure_future(self._supervise())
+        return self
+
+    async def _worker(self):
+        try:
+            while not self._cancelled:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                try:
+                    stopid = next(chunk)
+                    while not self._cancelled:
+                        stopid = chunk.send(await self._process(stopid))
+                except StopIteration:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except BaseException as ex:
+            self._fail(ex)
+            raise
+
+    async def _process(self, stopid: int) -> str:
+        """Search a single Stop ID with the probe, and register the outcome.
+        The probe is not used if the outcome of the ID is known from the checkpoint.
+        :return: the Crawl Outcome of the ID
+        """
+        outcome = self._known_outcome(stopid)
+        if outcome is not None:
+            return outcome
+        outcome, stop, saved = await self.probe(stopid)
+        self._record(stopid, outcome, stop, saved)
+        if stop is not None:
+            self._progressed.set()
+        return outcome
+
+    async def _supervise(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            if self.on_end is not None:
+                await self.on_end()
+        except BaseException as ex:
+            self._fail(ex)
+        finally:
+            try:
+                self._end()
+            finally:
+                self._done.set()
+                self._progressed.set()
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the crawl finishes.
+        :param timeout: max time to wait, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if the crawl finished, False if timeout expired
+        :rtype: bool
+        :raise: the exception raised by a task, if the crawl was stopped by one
+        """
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        if self.exception is not None:
+            raise self.exception
+        return True
+
+    def cancel(self):
+        """Stop the crawl. Stop IDs currently being searched are cancelled."""
+        self._cancelled = True
+        for task in self._tasks:
+            task.cancel()
+
+    @property
+    def done(self) -> bool:
+        return self._done is not None and self._done.is_set()
+
+    async def __aiter__(self):
+        """Iterate over the found Stops as they are found, until the crawl finishes.
+        Iteration starts from the first Stop of found_stops, so Stops found before iterating are not missed.
+        Several consumers can iterate over the crawl at the same time.
+        """
+        index = 0
+        while True:
+            if index < len(self.found_stops):
+                index += 1
+                yield self.found_stops[index - 1]
+            elif self.done:
+                return
+            else:
+                self._progressed.clear()
+                await self._progressed.wait()
+
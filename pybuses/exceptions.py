@@ -124,3 +124,12 @@ class BusGetterUnavailable(ResourceUnavailable, BusException):
 
 class MongoDBUnavailable(ResourceUnavailable, PyMongoError):
     pass
+
+# # #
+# SNAPSHOT EXCEPTIONS
+# # #
+
+
+class InvalidSnapshot(PyBusesException, ValueError):
+    """Raised when a Stops snapshot file is not valid, or was written with an unsupported version."""
+    pass
@@ -0,0 +1,271 @@
+
+# Native modules
+from bisect import bisect_right
+from math import sin, cos, asin, sqrt, radians, degrees
+from typing import Optional, List, Tuple, Sequence, Iterable, Iterator, Union, Any
+# Installed libraries (optional)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# Own modules
+from .assets import Stop
+
+__all__ = [
+    "haversine", "haversine_many", "haversine_matrix", "haversine_matrix_blocks", "pairs_within",
+    "stops_columns", "bbox_around", "EARTH_RADIUS", "BoundingBox", "HAS_NUMPY", "DEFAULT_BLOCK_SIZE"
+]
+
+"""Bounding boxes are given as tuples of (min lat, min lon, max lat, max lon)"""
+BoundingBox = Tuple[float, float, float, float]
+
+# mean radius of earth in meters
+EARTH_RADIUS = 6371008.8
+# max number of rows of the distance matrix blocks calculated at once by pairs_within
+DEFAULT_BLOCK_SIZE = 1024
+
+HAS_NUMPY = numpy is not None
+
+"""Sequences of coordinates can be lists/tuples of floats or, when NumPy is available, NumPy arrays.
+Functions that return many distances return NumPy arrays when NumPy is available, or lists otherwise."""
+Coordinates = Union[Sequence[float], Any]
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Calculate the great circle distance between two points on the earth.
+    :param lat1: latitude of the first point, in decimal degrees
+    :param lon1: longitude of the first point, in decimal degrees
+    :param lat2: latitude of the second point, in decimal degrees
+    :param lon2: longitude of the second point, in decimal degrees
+    :return: distance between the points, in meters
+    :rtype: float
+    """
+    lat1, lon1, lat2, lon2 = radians(lat1), radians(lon1), radians(lat2), radians(lon2)
+    a = sin((lat2 - lat1) / 2)**2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * asin(min(1.0, sqrt(a)))
+
+
+def bbox_around(lat: float, lon: float, radius_m: float) -> BoundingBox:
+    """Calculate a bounding box that contains the circle of the given radius around a point.
+    The box might be larger than the circle, so points inside it must be checked with haversine().
+    :param lat: latitude of the center, in decimal degrees
+    :param lon: longitude of the center, in decimal degrees
+    :param radius_m: radius of the circle, in meters
+    :return: bounding box, as (min lat, min lon, max lat, max lon)
+    :rtype: (float, float, float, float)
+    """
+    dlat = degrees(radius_m / EARTH_RADIUS)
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        # circle contains a pole: all the longitudes are inside
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = degrees(asin(min(1.0, sin(radius_m / EARTH_RADIUS) / cos(radians(lat)))))
+    return min_lat, max(lon - dlon, -180.0), max_lat, min(lon + dlon, 180.0)
+
+
+def haversine_many(lat: float, lon: float, lats: Coordinates, lons: Coordinates) -> Coordinates:
+    """Calculate the distances from one point to many points (e.g. the lat/lon columns of a Stops catalogue).
+    :param lat: latitude of the origin point, in decimal degrees
+    :param lon: longitude of the origin point, in decimal degrees
+    :param lats: latitudes of the destination points, in decimal degrees
+    :param lons: longitudes of the destination points, in decimal degrees
+    :return: distances to each destination point, in meters (NumPy array if NumPy is available, list if not)
+    """
+    if numpy is None:
+        return [haversine(lat, lon, lat2, lon2) for lat2, lon2 in zip(lats, lons)]
+    return _np_haversine(
+        numpy.radians(lat), numpy.radians(lon),
+        numpy.radians(numpy.asarray(lats, dtype=float)), numpy.radians(numpy.asarray(lons, dtype=float))
+    )
+
+
+def haversine_matrix(
+        lats1: Coordinates,
+        lons1: Coordinates,
+        lats2: Optional[Coordinates] = None,
+        lons2: Optional[Coordinates] = None
+) -> Coordinates:
+    """Calculate the distances between many points, as a matrix where the cell [i][j] is the distance between
+    the i-th origin point and the j-th destination point.
+    The whole matrix is kept in memory: use pairs_within for large sets of points.
+    :param lats1: latitudes of the origin points, in decimal degrees
+    :param lons1: longitudes of the origin points, in decimal degrees
+    :param lats2: latitudes of the destination points (default=None: same as the origin points)
+    :param lons2: longitudes of the destination points (default=None: same as the origin points)
+    :return: distances matrix, in meters (2D NumPy array if NumPy is available, list of lists if not)
+    """
+    if lats2 is None or lons2 is None:
+        lats2, lons2 = lats1, lons1
+    if numpy is None:
+        lats2, lons2 = list(lats2), list(lons2)
+        return [haversine_many(lat, lon, lats2, lons2) for lat, lon in zip(lats1, lons1)]
+    lats1 = numpy.radians(numpy.asarray(lats1, dtype=float))[:, numpy.newaxis]
+    lons1 = numpy.radians(numpy.asarray(lons1, dtype=float))[:, numpy.newaxis]
+    lats2 = numpy.radians(numpy.asarray(lats2, dtype=float))[numpy.newaxis, :]
+    lons2 = numpy.radians(numpy.asarray(lons2, dtype=float))[numpy.newaxis, :]
+    return _np_haversine(lats1, lons1, lats2, lons2)
+
+
+def haversine_matrix_blocks(
+        lats1: Coordinates,
+        lons1: Coordinates,
+        lats2: Optional[Coordinates] = None,
+        lons2: Optional[Coordinates] = None,
+        block_size: int = DEFAULT_BLOCK_SIZE
+) -> Iterator[Tuple[int, Coordinates]]:
+    """Calculate the distances matrix between many points (like haversine_matrix), in blocks of rows,
+    so only block_size rows of the matrix are kept in memory at once.
+    :param lats1: latitudes of the origin points, in decimal degrees
+    :param lons1: longitudes of the origin points, in decimal degrees
+    :param lats2: latitudes of the destination points (default=None: same as the origin points)
+    :param lons2: longitudes of the destination points (default=None: same as the origin points)
+    :param block_size: max number of rows of each block (default=1024)
+    :type block_size: int
+    :return: generator of tuples (index of the first row of the block, block of the distances matrix)
+    """
+    if lats2 is None or lons2 is None:
+        lats2, lons2 = lats1, lons1
+    if numpy is None:
+        lats1, lons1 = list(lats1), list(lons1)
+    else:
+        lats1, lons1 = numpy.asarray(lats1, dtype=float), numpy.asarray(lons1, dtype=float)
+        lats2, lons2 = numpy.asarray(lats2, dtype=float), numpy.asarray(lons2, dtype=float)
+    for start in range(0, len(lats1), block_size):
+        end = start + block_size
+        yield start, haversine_matrix(lats1[start:end], lons1[start:end], lats2, lons2)
+
+
+def pairs_within(
+        lats: Coordinates,
+        lons: Coordinates,
+        radius_m: Union[int, float],
+        block_size: int = DEFAULT_BLOCK_SIZE
+) -> List[Tuple[int, int, float]]:
+    """Find all the pairs of points that are at a max distance between them
+    (e.g. "every Stop within 300 m of another Stop").
+    Points are split on latitude strips as high as the radius, and sorted by longitude inside each strip,
+    so each point is only compared with the points of its strip and the next one, inside its longitude range.
+    With NumPy, the candidate pairs are generated and measured on blocks of block_size points, to bound the
+    memory used. Pairs across the antimeridian (longitude +-180) are not detected.
+    :param lats: latitudes of the points, in decimal degrees
+    :param lons: longitudes of the points, in decimal degrees
+    :param radius_m: max distance between the points of a pair, in meters
+    :param block_size: number of points compared at once when using NumPy (default=1024)
+    :type radius_m: int or float
+    :type block_size: int
+    :return: list of tuples (index of first point, index of second point, distance in meters),
+             where the first index is lower than the second; sorted by the indexes
+    :rtype: list of (int, int, float)
+    """
+    if numpy is None:
+        return _pairs_within_python(list(lats), list(lons), radius_m)
+    lats = numpy.asarray(lats, dtype=float)
+    lons = numpy.asarray(lons, dtype=float)
+    if not len(lats):
+        return []
+    dlat = max(degrees(radius_m / EARTH_RADIUS), 1e-9)
+    strips = numpy.floor((lats - lats.min()) / dlat).astype(numpy.int64)
+    order = numpy.lexsort((lons, strips))
+    sorted_strips, sorted_lats, sorted_lons = strips[order], lats[order], lons[order]
+    rad_lats, rad_lons = numpy.radians(sorted_lats), numpy.radians(sorted_lons)
+    strip_ids, strip_starts = numpy.unique(sorted_strips, return_index=True)
+    strip_ends = numpy.append(strip_starts[1:], len(order))
+    strip_positions = {strip: position for position, strip in enumerate(strip_ids.tolist())}
+
+    pairs: List[Tuple[int, int, float]] = list()
+    for position, strip in enumerate(strip_ids.tolist()):
+        a_start, a_end = int(strip_starts[position]), int(strip_ends[position])
+        for other_strip in (strip, strip + 1):
+            other_position = strip_positions.get(other_strip)
+            if other_position is None:
+                continue
+            b_start, b_end = int(strip_starts[other_position]), int(strip_ends[other_position])
+            b_lons = sorted_lons[b_start:b_end]
+            max_lat = max(abs(sorted_lats[a_start:a_end]).max(), abs(sorted_lats[b_start:b_end]).max())
+            dlon = _lon_delta(max_lat, radius_m)
+            for start in range(a_start, a_end, block_size):
+                end = min(start + block_size, a_end)
+                # Candidates of each point: points of the other strip inside its longitude range
+                first = numpy.searchsorted(b_lons, sorted_lons[start:end] - dlon, side="left") + b_start
+                last = numpy.searchsorted(b_lons, sorted_lons[start:end] + dlon, side="right") + b_start
+                if other_strip == strip:
+                    # Same strip: compare each point with the points after it only
+                    first = numpy.maximum(first, numpy.arange(start + 1, end + 1))
+                counts = numpy.maximum(last - first, 0)
+                total = int(counts.sum())
+                if not total:
+                    continue
+                rows = numpy.repeat(numpy.arange(start, end), counts)
+                columns = numpy.repeat(first - numpy.cumsum(counts) + counts, counts) + numpy.arange(total)
+                distances = _np_haversine(rad_lats[rows], rad_lons[rows], rad_lats[columns], rad_lons[columns])
+                inside = distances <= radius_m
+                i, j = order[rows[inside]], order[columns[inside]]
+                pairs.extend(zip(
+                    numpy.minimum(i, j).tolist(), numpy.maximum(i, j).tolist(), distances[inside].tolist()
+                ))
+    pairs.sort()
+    return pairs
+
+
+def _pairs_within_python(
+        lats: List[float],
+        lons: List[float],
+        radius_m: Union[int, float]
+) -> List[Tuple[int, int, float]]:
+    """Pure Python version of pairs_within: points sorted by latitude are swept inside their latitude band."""
+    if not lats:
+        return []
+    dlat = degrees(radius_m / EARTH_RADIUS)
+    dlon = _lon_delta(max(abs(lat) for lat in lats), radius_m)
+    order = sorted(range(len(lats)), key=lambda i: lats[i])
+    sorted_lats = [lats[i] for i in order]
+    pairs: List[Tuple[int, int, float]] = list()
+    for position, i in enumerate(order):
+        lat, lon = lats[i], lons[i]
+        for j in order[position+1:bisect_right(sorted_lats, lat + dlat)]:
+            if abs(lons[j] - lon) > dlon:
+                continue
+            distance = haversine(lat, lon, lats[j], lons[j])
+            if distance <= radius_m:
+                pairs.append((min(i, j), max(i, j), distance))
+    pairs.sort()
+    return pairs
+
+
+def _lon_delta(max_abs_lat: float, radius_m: Union[int, float]) -> float:
+    """Get the max difference of longitude, in degrees, between two points at a max distance,
+    when both are below the given absolute latitude.
+    """
+    max_abs_lat = min(max_abs_lat + degrees(radius_m / EARTH_RADIUS), 90.0)
+    if max_abs_lat >= 90.0:
+        return 360.0
+    ratio = sin(radius_m / EARTH_RADIUS) / cos(radians(max_abs_lat))
+    return 360.0 if ratio >= 1 else degrees(asin(ratio))
+
+
+def stops_columns(stops: Iterable[Stop]) -> Tuple[List[int], Coordinates, Coordinates]:
+    """Get the Stop IDs, latitudes and longitudes of the Stops with location, as columns,
+    to be used with the vectorized distance functions.
+    :param stops: Stop objects (Stops without location are ignored)
+    :type stops: iterable of Stop
+    :return: tuple of (Stop IDs, latitudes, longitudes); latitudes and longitudes are NumPy arrays
+             if NumPy is available, lists if not
+    :rtype: (list of int, list of float, list of float)
+    """
+    stopids, lats, lons = list(), list(), list()
+    for stop in stops:  # type: Stop
+        if stop.has_location():
+            stopids.append(stop.stopid)
+            lats.append(stop.lat)
+            lons.append(stop.lon)
+    if numpy is not None:
+        return stopids, numpy.array(lats, dtype=float), numpy.array(lons, dtype=float)
+    return stopids, lats, lons
+
+
+def _np_haversine(lat1: Any, lon1: Any, lat2: Any, lon2: Any) -> Any:
+    """Haversine formula over NumPy arrays (or scalars) of coordinates in radians, with broadcasting.
+    :return: distances, in meters
+    """
+    a = numpy.sin((lat2 - lat1) / 2)**2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
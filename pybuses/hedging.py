@@ -0,0 +1,142 @@
+
+# Native modules
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Optional, Callable, Dict, Deque, Any, Union
+
+__all__ = ["HedgePolicy", "LatencyTracker", "DEFAULT_HEDGE_MIN_SAMPLES", "DEFAULT_HEDGE_WINDOW"]
+
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_WINDOW = 200
+DEFAULT_HEDGE_MAX_WORKERS = 16
+
+
+class LatencyTracker(object):
+    """Keep a sliding window with the latest latencies (in seconds) of each tracked function,
+    and calculate percentiles over them.
+    """
+    def __init__(self, window: int = DEFAULT_HEDGE_WINDOW):
+        """
+        :param window: max number of latencies remembered for each function (default=200)
+        :type window: int
+        """
+        self.window: int = window
+        self._latencies: Dict[Callable, Deque[float]] = dict()
+        self._lock = Lock()
+
+    def record(self, f: Callable, latency: float):
+        """Register a new latency measure for the given function.
+        :param f: measured function
+        :param latency: time elapsed, in seconds
+        :type latency: float
+        """
+        with self._lock:
+            try:
+                self._latencies[f].append(latency)
+            except KeyError:
+                self._latencies[f] = deque((latency,), maxlen=self.window)
+
+    def samples(self, f: Callable) -> int:
+        """Get how many latencies are currently remembered for the given function.
+        :rtype: int
+        """
+        with self._lock:
+            return len(self._latencies.get(f, ()))
+
+    def percentile(self, f: Callable, percentile: Union[int, float], min_samples: int = 1) -> Optional[float]:
+        """Calculate a percentile of the latencies remembered for the given function.
+        :param f: measured function
+        :param percentile: percentile to calculate, between 0 and 100
+        :param min_samples: if less latencies than this are remembered, return None (default=1)
+        :type percentile: int or float
+        :type min_samples: int
+        :return: latency in seconds, or None if not enough samples are available
+        :rtype: float or None
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(f, ()))
+        if not latencies or len(latencies) < min_samples:
+            return None
+        index = int(round(percentile / 100 * (len(latencies) - 1)))
+        return latencies[max(0, min(index, len(latencies) - 1))]
+
+
+class HedgePolicy(object):
+    """Settings for the hedged (racing) mode of PyBuses getters.
+    When a getter does not answer within the hedge delay, the next getter is started in parallel,
+    and the first successful result wins.
+
+    The hedge delay is the given latency percentile of the getter being waited for, once enough latency
+    samples of it are available; until then (or if no percentile is set), the fixed delay is used.
+    If neither of them is available, the next getter is only started when the current one fails.
+    """
+    def __init__(
+            self,
+            delay: Optional[Union[int, float]] = None,
+            percentile: Optional[Union[int, float]] = None,
+            min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+            window: int = DEFAULT_HEDGE_WINDOW,
+            max_workers: int = DEFAULT_HEDGE_MAX_WORKERS
+    ):
+        """
+        :param delay: fixed time, in seconds, to wait for a getter before starting the next one (default=None)
+        :param percentile: latency percentile (0-100) of each getter to use as its hedge delay (default=None)
+        :param min_samples: min number of latency samples of a getter to use the percentile delay (default=20)
+        :param window: number of latency samples remembered for each getter (default=200)
+        :param max_workers: max number of threads used to run getters in hedged mode (default=16)
+        :type delay: int or float or None
+        :type percentile: int or float or None
+        :type min_samples: int
+        :type window: int
+        :type max_workers: int
+        """
+        self.delay: Optional[Union[int, float]] = delay
+        self.percentile: Optional[Union[int, float]] = percentile
+        self.min_samples: int = min_samples
+        self.max_workers: int = max_workers
+        self.tracker: LatencyTracker = LatencyTracker(window)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = Lock()
+
+    def hedge_delay(self, f: Callable) -> Optional[float]:
+        """Get the time to wait for the given getter before starting the next one.
+        :param f: getter being waited for
+        :return: delay in seconds, or None if the next getter must not be started in parallel
+        :rtype: float or None
+        """
+        if self.percentile is not None:
+            delay = self.tracker.percentile(f, self.percentile, self.min_samples)
+            if delay is not None:
+                return delay
+        return self.delay
+
+    def call(self, f: Callable, *args, **kwargs) -> Any:
+        """Call the given getter, and record its latency if it returned successfully.
+        :param f: getter to call
+        :return: value returned by the getter
+        """
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        self.tracker.record(f, time.perf_counter() - start)
+        return result
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        """Get the thread pool executor used to run getters in parallel, creating it on first use.
+        :rtype: ThreadPoolExecutor
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="PyBusesHedge")
+            return self._executor
+
+    def close(self, wait: bool = False):
+        """Shutdown the thread pool executor, if it was created.
+        :param wait: if True, wait until running getters finish (default=False)
+        :type wait: bool
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,310 @@
+
+# Native modules
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from typing import Optional, List, Dict, Tuple, Sequence, Callable, Union, Any
+# Own modules
+from .exceptions import *
+
+__all__ = [
+    "PyBusesMetrics", "CallOutcomes", "CallableKinds", "classify", "callable_name",
+    "DEFAULT_LATENCY_BUCKETS", "DEFAULT_METRICS_PORT"
+]
+
+"""Call Outcomes are the classes of results of a call to a Getter/Setter/Deleter.
+They can be used with alias from the CallOutcomes named tuple.
+SUCCESS = "success": the call returned
+UNAVAILABLE = "unavailable": the call raised a *Unavailable exception (PyBuses falls through to the next callable)
+NOT_FOUND = "not_found": the call raised StopNotFound
+NOT_EXIST = "not_exist": the call raised StopNotExist
+ERROR = "error": the call raised any other exception
+"""
+_call_outcomes_namedtuple = namedtuple("CallOutcomes", ["SUCCESS", "UNAVAILABLE", "NOT_FOUND", "NOT_EXIST", "ERROR"])
+CallOutcomes = _call_outcomes_namedtuple("success", "unavailable", "not_found", "not_exist", "error")
+
+"""Callable Kinds are the roles of the callables registered on PyBuses, used to label the metrics.
+They can be used with alias from the CallableKinds named tuple.
+"""
+_callable_kinds_namedtuple = namedtuple(
+    "CallableKinds", ["STOP_GETTER", "STOPS_GETTER", "STOP_SETTER", "STOPS_SETTER", "STOP_DELETER", "BUS_GETTER"]
+)
+CallableKinds = _callable_kinds_namedtuple(
+    "stop_getter", "stops_getter", "stop_setter", "stops_setter", "stop_deleter", "bus_getter"
+)
+
+# upper bounds of the latency histogram buckets, in seconds
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_METRICS_PORT = 9464
+
+
+class _CallableMetrics(object):
+    """Counters and latency histogram of a single callable."""
+    __slots__ = ("kind", "name", "outcomes", "buckets", "latency_sum", "count")
+
+    def __init__(self, kind: str, name: str, buckets: int):
+        self.kind: str = kind
+        self.name: str = name
+        self.outcomes: Dict[str, int] = dict.fromkeys(CallOutcomes, 0)
+        self.buckets: List[int] = [0] * (buckets + 1)  # last bucket is +Inf
+        self.latency_sum: float = 0.0
+        self.count: int = 0
+
+
+class PyBusesMetrics(object):
+    """Instrumentation of the Getters, Setters and Deleters used by PyBuses.
+
+    For each callable, the number of calls by outcome (see CallOutcomes) and a histogram of their latency
+    are recorded. Callables are identified by their kind and a name (label): PyBuses uses the label given when
+    the callable was registered, or the name of the callable (Class.method or function name) if none was given.
+    Callables with the same name and kind (e.g. the find_stop of two MongoDB objects) are aggregated on the same
+    metrics, unless they are registered with different labels. No references to the callables are kept.
+    Each name creates (number of outcomes + number of buckets + 3) Prometheus series,
+    so the labels should be a small, fixed set (never per-request values).
+    For each PyBuses operation (find_stop, get_buses...), the fallback depth is recorded: the position of the
+    callable that served the request (0 = the first one), or "exhausted" when no callable could serve it.
+    Metrics can be exported as a dict (snapshot) or in the Prometheus text format, which can be served over HTTP
+    with serve().
+    Recording a call takes a lock and a few dict operations, so metrics can be kept enabled in production.
+    """
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, namespace: str = "pybuses"):
+        """
+        :param buckets: upper bounds of the latency histogram buckets, in seconds (default=0.5ms~10s)
+        :param namespace: prefix of the metric names on the Prometheus export (default="pybuses")
+        :type buckets: sequence of float
+        :type namespace: str
+        """
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.namespace: str = namespace
+        self._callables: Dict[Tuple[str, str], _CallableMetrics] = dict()
+        self._fallbacks: Dict[str, Dict[Union[int, str], int]] = dict()
+        self._lock = Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _get_callable(self, kind: str, name: str) -> _CallableMetrics:
+        """Get the metrics of a callable, creating them on first use. Must be called with the lock acquired."""
+        metrics = self._callables.get((kind, name))
+        if metrics is None:
+            metrics = self._callables[(kind, name)] = _CallableMetrics(kind, name, len(self.buckets))
+        return metrics
+
+    def record(self, kind: str, name: str, outcome: str, elapsed: float):
+        """Record a call to a callable.
+        :param kind: role of the callable (one of CallableKinds)
+        :param name: label of the callable called
+        :param outcome: result of the call (one of CallOutcomes)
+        :param elapsed: duration of the call, in seconds
+        :type kind: str
+        :type name: str
+        :type outcome: str
+        :type elapsed: float
+        """
+        bucket = bisect_left(self.buckets, elapsed)
+        with self._lock:
+            metrics = self._get_callable(kind, name)
+            metrics.outcomes[outcome] += 1
+            metrics.buckets[bucket] += 1
+            metrics.latency_sum += elapsed
+            metrics.count += 1
+
+    def call(self, kind: str, name: str, f: Callable, *args, **kwargs) -> Any:
+        """Call a callable, recording its outcome and latency. Exceptions raised by the callable are re-raised.
+        :param kind: role of the callable (one of CallableKinds)
+        :param name: label of the callable
+        :param f: callable to call, with the given args and kwargs
+        :return: value returned by the callable
+        """
+        start = time.perf_counter()
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            self.record(kind, name, classify(e), time.perf_counter() - start)
+            raise
+        self.record(kind, name, CallOutcomes.SUCCESS, time.perf_counter() - start)
+        return result
+
+    @contextmanager
+    def timed(self, kind: str, name: str):
+        """Context manager that records the outcome and latency of a call to a callable made inside it
+        (e.g. when the callable is run through an executor, or awaited).
+        :param kind: role of the callable (one of CallableKinds)
+        :param name: label of the callable called inside the context
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(kind, name, classify(e), time.perf_counter() - start)
+            raise
+        self.record(kind, name, CallOutcomes.SUCCESS, time.perf_counter() - start)
+
+    def record_fallback(self, operation: str, depth: Optional[int], count: int = 1):
+        """Record the fallback depth of requests served by a PyBuses operation.
+        :param operation: name of the PyBuses operation (e.g. "find_stop")
+        :param depth: position of the callable that served the requests, or None if no callable could serve them
+        :param count: number of requests (default=1)
+        :type operation: str
+        :type depth: int or None
+        :type count: int
+        """
+        key = "exhausted" if depth is None else depth
+        with self._lock:
+            depths = self._fallbacks.get(operation)
+            if depths is None:
+                depths = self._fallbacks[operation] = dict()
+            depths[key] = depths.get(key, 0) + count
+
+    def reset(self):
+        """Remove all the recorded metrics."""
+        with self._lock:
+            self._callables.clear()
+            self._fallbacks.clear()
+
+    def snapshot(self) -> Dict:
+        """Get the recorded metrics as a dict.
+        The "callables" key has a list of dicts with the kind, name, calls (by outcome), count, latency sum,
+        histogram (cumulative count of calls by bucket upper bound, in seconds) and hit rate (successful calls of
+        getters over the calls that did not fail as unavailable/error) of each callable.
+        The "fallbacks" key has a dict with the number of requests served at each depth, by operation.
+        :rtype: dict
+        """
+        with self._lock:
+            callables = list()
+            for metrics in self._callables.values():  # type: _CallableMetrics
+                outcomes = dict(metrics.outcomes)
+                answered = outcomes[CallOutcomes.SUCCESS] + outcomes[CallOutcomes.NOT_FOUND] + \
+                    outcomes[CallOutcomes.NOT_EXIST]
+                callables.append({
+                    "kind": metrics.kind,
+                    "name": metrics.name,
+                    "calls": outcomes,
+                    "count": metrics.count,
+                    "latency_sum": metrics.latency_sum,
+                    "histogram": dict(zip(self.buckets + (float("inf"),), _cumulative(metrics.buckets))),
+                    "hit_rate": outcomes[CallOutcomes.SUCCESS] / answered if answered else None
+                })
+            fallbacks = {operation: dict(depths) for operation, depths in self._fallbacks.items()}
+        return {"callables": callables, "fallbacks": fallbacks}
+
+    def prometheus(self) -> str:
+        """Export the recorded metrics in the Prometheus text exposition format.
+        :rtype: str
+        """
+        ns = self.namespace
+        lines = [
+            f"# HELP {ns}_calls_total Calls to the PyBuses getters, setters and deleters, by outcome.",
+            f"# TYPE {ns}_calls_total counter"
+        ]
+        histogram_lines = [
+            f"# HELP {ns}_call_duration_seconds Latency of the calls to the PyBuses getters, setters and deleters.",
+            f"# TYPE {ns}_call_duration_seconds histogram"
+        ]
+        fallback_lines = [
+            f"# HELP {ns}_fallback_depth_total Requests served by the callable at each position (depth) of "
+            f"the fallback chain of an operation, or exhausted when none could serve them.",
+            f"# TYPE {ns}_fallback_depth_total counter"
+        ]
+        with self._lock:
+            for metrics in self._callables.values():  # type: _CallableMetrics
+                labels = f'kind="{_escape(metrics.kind)}",callable="{_escape(metrics.name)}"'
+                for outcome, count in metrics.outcomes.items():
+                    lines.append(f'{ns}_calls_total{{{labels},outcome="{outcome}"}} {count}')
+                bounds = [_format_float(bound) for bound in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, _cumulative(metrics.buckets)):
+                    histogram_lines.append(f'{ns}_call_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                histogram_lines.append(f"{ns}_call_duration_seconds_sum{{{labels}}} {metrics.latency_sum!r}")
+                histogram_lines.append(f"{ns}_call_duration_seconds_count{{{labels}}} {metrics.count}")
+            for operation, depths in self._fallbacks.items():
+                for depth, count in depths.items():
+                    fallback_lines.append(
+                        f'{ns}_fallback_depth_total{{operation="{_escape(operation)}",depth="{depth}"}} {count}'
+                    )
+        return "\n".join(lines + histogram_lines + fallback_lines) + "\n"
+
+    def serve(self, port: int = DEFAULT_METRICS_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the metrics in the Prometheus text format over HTTP (on any path, e.g. /metrics),
+        on a background (daemon) thread.
+        :param port: TCP port (default=9464)
+        :param host: address to listen on (default=127.0.0.1)
+        :type port: int
+        :type host: str
+        :return: HTTP server (its server_address has the port used, if port 0 was given)
+        :rtype: ThreadingHTTPServer
+        """
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        Thread(target=self._server.serve_forever, name="PyBusesMetrics", daemon=True).start()
+        return self._server
+
+    def stop_serving(self):
+        """Stop the HTTP server started with serve(), if any."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def classify(exception: Exception) -> str:
+    """Get the Call Outcome of a call that raised the given exception.
+    :param exception: exception raised by a Getter/Setter/Deleter
+    :return: one of CallOutcomes
+    :rtype: str
+    """
+    if isinstance(exception, StopNotExist):
+        return CallOutcomes.NOT_EXIST
+    if isinstance(exception, StopNotFound):
+        return CallOutcomes.NOT_FOUND
+    if isinstance(exception, ResourceUnavailable):
+        return CallOutcomes.UNAVAILABLE
+    return CallOutcomes.ERROR
+
+
+def callable_name(f: Callable) -> str:
+    """Get a readable name of a callable: Class.method for bound methods, the qualified name for functions.
+    This is the default label of the callables on the metrics.
+    :param f: callable
+    :rtype: str
+    """
+    owner = getattr(f, "__self__", None)
+    function = getattr(f, "__func__", f)
+    name = getattr(function, "__qualname__", None) or getattr(function, "__name__", None)
+    if name is None:
+        return type(f).__name__
+    if owner is not None and not isinstance(owner, type) and "." not in name:
+        return f"{type(owner).__name__}.{name}"
+    return name
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    total = 0
+    result = list()
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _format_float(value: float) -> str:
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,228 @@
+
+# Native modules
+import inspect
+import os
+import time
+from itertools import islice
+from typing import Union, Optional, List, Dict, Set, Iterable, Iterator, Callable, Any
+# Own modules
+from .assets import Stop, StopsGetter
+from .snapshot import StopSnapshot, write_snapshot
+from .sync import stop_fingerprint
+
+__all__ = ["migrate_stops", "MigrationProgress", "DEFAULT_MIGRATION_CHUNK_SIZE"]
+
+DEFAULT_MIGRATION_CHUNK_SIZE = 1000
+
+
+class MigrationProgress(object):
+    """Progress (and final summary) of a migration of Stops between backends."""
+    def __init__(self, dry_run: bool = False):
+        """
+        :param dry_run: True if the migration does not write the Stops on the destination
+        """
+        self.dry_run: bool = dry_run
+        self.read: int = 0
+        self.skipped: int = 0
+        self.written: int = 0
+        self.chunks: int = 0
+        self.added: List[int] = list()
+        self.changed: List[int] = list()
+        self.removed: List[int] = list()
+        self.unchanged: int = 0
+        self.elapsed: float = 0.0
+        self.finished: bool = False
+
+    @property
+    def stops_per_second(self) -> float:
+        """Number of Stops read from the source per second."""
+        return self.read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def asdict(self) -> Dict:
+        """Return the progress counters as a dict, with the number of Stops of each kind of change.
+        :rtype: dict
+        """
+        return {
+            "dry_run": self.dry_run,
+            "read": self.read,
+            "skipped": self.skipped,
+            "written": self.written,
+            "chunks": self.chunks,
+            "added": len(self.added),
+            "changed": len(self.changed),
+            "removed": len(self.removed),
+            "unchanged": self.unchanged,
+            "elapsed": self.elapsed,
+            "stops_per_second": self.stops_per_second,
+            "finished": self.finished
+        }
+
+    def __repr__(self):
+        return "MigrationProgress(" + ", ".join(f"{k}={v}" for k, v in self.asdict().items()) + ")"
+
+
+def migrate_stops(
+        source: Union[str, Any, Iterable[Stop]],
+        destination: Union[str, Any],
+        chunk_size: int = DEFAULT_MIGRATION_CHUNK_SIZE,
+        transform: Optional[Callable[[Stop], Optional[Stop]]] = None,
+        update: bool = True,
+        dry_run: bool = False,
+        diff: bool = False,
+        progress: Optional[Callable[[MigrationProgress], None]] = None
+) -> MigrationProgress:
+    """Copy all the Stops of a source backend to a destination backend, streaming them in chunks,
+    so memory usage is bounded by the chunk size (except when writing a snapshot, which is written at once).
+
+    The source can be a backend with an iter_stops() method (MongoDB, SQLite, StopSnapshot, StopTable),
+    the path of a snapshot file, or any iterable of Stops. The Stops are read with the cursor batching of the
+    backend, using the chunk size as batch size.
+    The destination can be a backend with a save_stops() bulk setter (MongoDB, SQLite, PyBuses...),
+    which is called once for each chunk, a backend with a save_stop() setter only, or the path of a snapshot file.
+    Stops already saved on the destination are overwritten with the same behaviour as save_stops(update=...).
+    A snapshot destination is rewritten with the migrated Stops; with update=False, the Stops of the current
+    snapshot are kept too, replacing the migrated ones with the same ID.
+
+    On a dry run nothing is written, and the Stops of each chunk are compared with the ones saved on the
+    destination (using its find_stops() bulk getter), counting the Stops that would be added, changed or
+    left unchanged. The comparison can also be done on a real migration with diff=True.
+    When comparing, the Stops saved on the destination but not migrated from the source are reported as removed,
+    with a final pass over the iter_stops() of the destination (skipped if the destination does not have it).
+    The migration does not delete them from the destination. The IDs of all the migrated Stops are kept in memory
+    until this pass is done.
+
+    The backends of the asyncio API (such as AsyncPyBuses) are not supported as destination.
+    :param source: backend, snapshot path or iterable of Stops to read the Stops from
+    :param destination: backend or snapshot path to write the Stops to
+    :param chunk_size: number of Stops read, transformed and written together (default=1000)
+    :param transform: function applied to each Stop read, returning the Stop to write,
+                      or None to skip the Stop (default=None)
+    :param update: if True, overwrite the Stops already saved on the destination (default=True)
+    :param dry_run: if True, compare the Stops with the destination, but do not write them (default=False)
+    :param diff: if True, compare the Stops with the destination also when not on dry run (default=False)
+    :param progress: function called with the MigrationProgress after each chunk (default=None)
+    :type source: str or object or iterable of Stop
+    :type destination: str or object
+    :type chunk_size: int
+    :type transform: function or None
+    :type update: bool
+    :type dry_run: bool
+    :type diff: bool
+    :type progress: function or None
+    :return: summary of the migration
+    :rtype: MigrationProgress
+    :raise: StopGetterUnavailable (reading from the source) or StopSetterUnavailable (writing to the destination).
+            The chunks written before the error are kept on the destination; the migration can be repeated.
+            TypeError if the destination methods are coroutine functions
+    """
+    if not isinstance(destination, str):
+        for name in ("save_stops", "save_stop", "find_stops", "iter_stops"):
+            if inspect.iscoroutinefunction(getattr(destination, name, None)):
+                raise TypeError(f"Destination {name}() is a coroutine function; asyncio backends are not supported")
+    chunk_size = max(chunk_size, 1)
+    summary = MigrationProgress(dry_run=dry_run)
+    started = time.monotonic()
+    snapshot_path: Optional[str] = destination if isinstance(destination, str) else None
+    snapshot_stops: List[Stop] = list()
+    getter: Optional[StopsGetter] = None
+    opened_snapshot: Optional[StopSnapshot] = None
+    migrated: Set[int] = set()
+    if dry_run or diff:
+        if snapshot_path is not None:
+            if os.path.exists(snapshot_path):
+                opened_snapshot = StopSnapshot(snapshot_path)
+                getter = opened_snapshot.find_stops
+        else:
+            getter = getattr(destination, "find_stops", None)
+
+    try:
+        for chunk in _chunks(_iter_source(source, chunk_size), chunk_size):  # type: List[Stop]
+            summary.read += len(chunk)
+            if transform is not None:
+                transformed = [transform(stop) for stop in chunk]
+                chunk = [stop for stop in transformed if stop is not None]
+                summary.skipped += len(transformed) - len(chunk)
+            if dry_run or diff:
+                _compare(chunk, getter, summary)
+                migrated.update(stop.stopid for stop in chunk)
+            if not dry_run and chunk:
+                if snapshot_path is not None:
+                    snapshot_stops.extend(chunk)
+                else:
+                    _write(destination, chunk, update)
+                    summary.written += len(chunk)
+            summary.chunks += 1
+            summary.elapsed = time.monotonic() - started
+            if progress is not None:
+                progress(summary)
+
+        if dry_run or diff:
+            saved = opened_snapshot if snapshot_path is not None else destination
+            if saved is not None and getattr(saved, "iter_stops", None) is not None:
+                summary.removed.extend(
+                    stop.stopid for stop in _iter_source(saved, chunk_size) if stop.stopid not in migrated
+                )
+    finally:
+        if opened_snapshot is not None:
+            opened_snapshot.close()
+
+    if not dry_run and snapshot_path is not None:
+        if not update and os.path.exists(snapshot_path):
+            # Stops of the current snapshot go last, so they replace the ones with the same ID
+            with StopSnapshot(snapshot_path) as snapshot:
+                snapshot_stops.extend(snapshot.iter_stops())
+        summary.written = write_snapshot(snapshot_path, snapshot_stops)
+    summary.elapsed = time.monotonic() - started
+    summary.finished = True
+    return summary
+
+
+def _iter_source(source: Union[str, Any, Iterable[Stop]], batch_size: int) -> Iterator[Stop]:
+    """Iterate the Stops of a migration source."""
+    if isinstance(source, str):
+        with StopSnapshot(source) as snapshot:
+            yield from snapshot.iter_stops()
+        return
+    iter_stops = getattr(source, "iter_stops", None)
+    if iter_stops is None:
+        yield from source
+    elif "batch_size" in inspect.signature(iter_stops).parameters:
+        yield from iter_stops(batch_size=batch_size)
+    else:
+        yield from iter_stops()
+
+
+def _chunks(stops: Iterator[Stop], chunk_size: int) -> Iterator[List[Stop]]:
+    """Split the Stops in lists of chunk_size Stops."""
+    while True:
+        chunk = list(islice(stops, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write(destination: Any, stops: List[Stop], update: bool):
+    """Write a chunk of Stops on a destination backend, using its bulk setter if available."""
+    save_stops = getattr(destination, "save_stops", None)
+    if save_stops is not None:
+        save_stops(stops, update=update)
+        return
+    for stop in stops:
+        destination.save_stop(stop, update=update)
+
+
+def _compare(stops: List[Stop], getter: Optional[StopsGetter], summary: MigrationProgress):
+    """Compare a chunk of Stops with the ones saved on the destination, and count the changes on the summary.
+    If the destination can not be searched, all the Stops are counted as added.
+    """
+    saved: Dict[int, Stop] = dict()
+    if getter is not None and stops:
+        saved, _ = getter([stop.stopid for stop in stops])
+    for stop in stops:
+        current = saved.get(stop.stopid)
+        if current is None:
+            summary.added.append(stop.stopid)
+        elif stop_fingerprint(current) != stop_fingerprint(stop):
+            summary.changed.append(stop.stopid)
+        else:
+            summary.unchanged += 1
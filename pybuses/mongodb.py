@@ -2,14 +2,16 @@
 # Native libraries
 import atexit
 import time
-import traceback
-from typing import Union, Optional
+from math import tan, atan, cos, radians, degrees
+from threading import Thread, Lock, Event
+from typing import Union, Optional, List, Dict, Set, Tuple, Iterable, Iterator
 # Installed libraries
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, GEOSPHERE
 from pymongo.database import Database
 from pymongo.collection import Collection
+from pymongo.errors import ConnectionFailure
 # Own modules
-from .assets import Stop, StopGetter, StopSetter, StopDeleter
+from .assets import Stop, StopGetter, StopsGetter, StopSetter, StopsSetter, StopDeleter
 from .exceptions import *
 
 """STRUCTURE OF MongoDB DATABASE used by PyBuses
@@ -26,13 +28,16 @@ Structure of documents (fields with * are optional, so they can be missing on ce
     "updated": <dt>,
     "other" : {dict}
     "lat": 1.23456, *
-    "lon": -1.23456 *
+    "lon": -1.23456, *
+    "location": {"type": "Point", "coordinates": [-1.23456, 1.23456]} *
 }
 ```
 Stop ID is used as the Document ID of MongoDB.
 <dt> are ints with the timestamp when Stop was saved for first time and updated for last time.
 Other is a dict with optional extra data declared on PyBuses Stop objects. Is always present although is empty.
 * these fields are optional, so some entries might not have them.
+Location is a GeoJSON Point ([lon, lat]) with the same coordinates as lat/lon, present when the Stop has a location.
+It is indexed with a 2dsphere index (see MongoDB.ensure_indexes), used by the geospatial queries.
 Timestamps are saved on Unix/Epoch format, and UTC timezone.
 """
 # TODO add GoogleMaps & StreetView data to stop documents
@@ -40,13 +45,111 @@ Timestamps are saved on Unix/Epoch format, and UTC timezone.
 # http://api.mongodb.com/python/current/tutorial.html
 
 __all__ = [
-    "MongoDB", "DEFAULT_TIMEOUT", "DEFAULT_DATABASE_NAME", "DEFAULT_DATABASE_COLLECTION",
-    "PyMongoError", "MongoDBUnavailable"
+    "MongoDB", "MongoHealth", "DEFAULT_TIMEOUT", "DEFAULT_DATABASE_NAME", "DEFAULT_DATABASE_COLLECTION",
+    "DEFAULT_MAX_POOL_SIZE", "DEFAULT_MIN_POOL_SIZE", "DEFAULT_RECONNECT_BACKOFF", "DEFAULT_RECONNECT_MAX_BACKOFF",
+    "DEFAULT_BULK_CHUNK_SIZE", "DEFAULT_NEAR_LIMIT", "LOCATION_FIELD", "PyMongoError", "MongoDBUnavailable"
 ]
 
 DEFAULT_TIMEOUT = 1
 DEFAULT_DATABASE_NAME = "pybuses"
 DEFAULT_DATABASE_COLLECTION = "stops"
+DEFAULT_MAX_POOL_SIZE = 100
+DEFAULT_MIN_POOL_SIZE = 0
+DEFAULT_RECONNECT_BACKOFF = 1
+DEFAULT_RECONNECT_MAX_BACKOFF = 30
+DEFAULT_BULK_CHUNK_SIZE = 1000
+DEFAULT_NEAR_LIMIT = 20
+_BBOX_EDGE_MARGIN = 1e-7
+LOCATION_FIELD = "location"
+
+
+class MongoHealth(object):
+    """Health supervisor of a MongoDB server, shared by all the MongoDB instances that use the same client.
+    When an operation fails because the server is unreachable, the server is marked as down and a background
+    thread probes it, with exponential backoff, until it answers again.
+    While the server is down, operations fail immediately instead of waiting for the server selection timeout.
+    """
+    def __init__(
+            self,
+            client: MongoClient,
+            backoff: Union[int, float] = DEFAULT_RECONNECT_BACKOFF,
+            max_backoff: Union[int, float] = DEFAULT_RECONNECT_MAX_BACKOFF
+    ):
+        """
+        :param client: MongoClient of the server supervised
+        :param backoff: time, in seconds, to wait before the first probe after the server went down (default=1)
+        :param max_backoff: max time, in seconds, between probes; the time is doubled after each failure (default=30)
+        :type client: MongoClient
+        :type backoff: int or float
+        :type max_backoff: int or float
+        """
+        self.client: MongoClient = client
+        self.backoff: Union[int, float] = backoff
+        self.max_backoff: Union[int, float] = max_backoff
+        self.available: bool = True
+        self.down_since: Optional[int] = None
+        self.probes: int = 0
+        self._lock = Lock()
+        self._closed = Event()
+        self._thread: Optional[Thread] = None
+
+    def check(self):
+        """Check if the server is known to be available.
+        :raise: MongoDBUnavailable if the server is down
+        """
+        if not self.available:
+            raise MongoDBUnavailable(f"MongoDB server is down since {self.down_since}, waiting for it to recover")
+
+    def report_failure(self, exception: Exception):
+        """Report an error of an operation. If the error was caused by the server being unreachable,
+        the server is marked as down and the background probing is started.
+        :param exception: exception raised by the operation
+        :type exception: Exception
+        """
+        if not isinstance(exception, ConnectionFailure):
+            return
+        with self._lock:
+            if not self.available or self._closed.is_set():
+                return
+            self.available = False
+            self.down_since = current_datetime()
+            self._thread = Thread(target=self._supervise, name="MongoHealth", daemon=True)
+            self._thread.start()
+
+    def _supervise(self):
+        delay = self.backoff
+        while not self._closed.wait(delay):
+            self.probes += 1
+            try:
+                self.client.admin.command("ping")
+            except PyMongoError:
+                delay = min(delay * 2, self.max_backoff)
+            else:
+                with self._lock:
+                    self.available = True
+                    self.down_since = None
+                    self._thread = None
+                return
+
+    def close(self):
+        """Stop the background probing, if running."""
+        self._closed.set()
+
+
+class _SharedClient(object):
+    """A MongoClient with its health supervisor, and the number of MongoDB instances using it."""
+    def __init__(self, client: MongoClient, health: MongoHealth):
+        self.client: MongoClient = client
+        self.health: MongoHealth = health
+        self.refs: int = 0
+
+    def close(self):
+        self.health.close()
+        self.client.close()
+
+
+_shared_clients: Dict[Tuple, _SharedClient] = dict()
+_shared_clients_lock = Lock()
 
 
 class MongoDB(object):
@@ -57,24 +160,41 @@ class MongoDB(object):
             uri: Optional[str] = None,
             timeout: Union[int, float] = DEFAULT_TIMEOUT,
             db_name: str = DEFAULT_DATABASE_NAME,
-            stops_collection_name: str = DEFAULT_DATABASE_COLLECTION
+            stops_collection_name: str = DEFAULT_DATABASE_COLLECTION,
+            max_pool_size: int = DEFAULT_MAX_POOL_SIZE,
+            min_pool_size: int = DEFAULT_MIN_POOL_SIZE,
+            shared_client: bool = True,
+            reconnect_backoff: Union[int, float] = DEFAULT_RECONNECT_BACKOFF,
+            reconnect_max_backoff: Union[int, float] = DEFAULT_RECONNECT_MAX_BACKOFF
     ):
         """Location of the server must be given using host and port parameters, or uri.
         If URI is provided, host and port parameters will be ignored.
-        A connection with the database will be performed automatically, if possible.
-        Otherwise, connect method must be called after declaring correct server info (host+port/URI).
+        The connection with the database is performed lazily, on the first operation (or calling connect).
+        By default, the MongoClient is shared by all the MongoDB instances of the process that use
+        the same server, timeout and pool settings.
         :param host: Host where MongoDB server is hosted (default="localhost")
         :param port: Port of the MongoDB server (default=27017)
         :param uri: URI of the server, instead of host and port (default=None)
-        :param timeout: Timeout for MongoDB operations in seconds (default=10)
+        :param timeout: Timeout for MongoDB operations in seconds (default=1)
         :param db_name: Name of the database used by PyBuses (default="pybuses")
         :param stops_collection_name: Name of the db collection used for the stops
+        :param max_pool_size: max number of connections to the server of the client (default=100)
+        :param min_pool_size: min number of connections to the server kept open by the client (default=0)
+        :param shared_client: if True, share the client with other instances using the same server and settings,
+                              including the reconnect backoffs (default=True)
+        :param reconnect_backoff: time, in seconds, before probing the server after it went down (default=1)
+        :param reconnect_max_backoff: max time, in seconds, between probes while the server is down (default=30)
         :type host: str
         :type port: int
         :type uri: str or None
         :type timeout: int or float
         :type db_name: str
         :type stops_collection_name: str
+        :type max_pool_size: int
+        :type min_pool_size: int
+        :type shared_client: bool
+        :type reconnect_backoff: int or float
+        :type reconnect_max_backoff: int or float
         """
         self.timeout: Union[int, float] = timeout
         self.host: str = host
@@ -82,53 +202,103 @@ class MongoDB(object):
         self.uri: Optional[str] = uri
         self.db_name: str = db_name
         self.stops_collection_name: str = stops_collection_name
+        self.max_pool_size: int = max_pool_size
+        self.min_pool_size: int = min_pool_size
+        self.shared_client: bool = shared_client
+        self.reconnect_backoff: Union[int, float] = reconnect_backoff
+        self.reconnect_max_backoff: Union[int, float] = reconnect_max_backoff
         self.client: MongoClient = None
+        self.health: Optional[MongoHealth] = None
         self.db: Database = None
         self.collection: Collection = None
         self.documents: Collection = None
+        self.indexes_ensured: bool = False
+        self._client_key: Optional[Tuple] = None
+        self._shared: Optional[_SharedClient] = None
+        self._connect_lock = Lock()
         self.find_stop: StopGetter = self.find_stop  # Set StopGetter data type on this embedded getter
+        self.find_stops: StopsGetter = self.find_stops  # Set StopsGetter data type on this embedded bulk getter
         self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.save_stops: StopsSetter = self.save_stops  # Set StopsSetter data type on this embedded bulk setter
         self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
 
-        try:
-            self.connect()
-        except PyMongoError:
-            self.close()
-
         @atexit.register
         def atexit_f():
             self.close()
 
     def connect(self, timeout: Optional[Union[int, float]] = None):
         """Connect to the MongoDB database. MongoClient instance is saved on self.client.
+        If the client is shared, an existing client for the same server and settings is reused.
+        This method is called automatically on the first operation.
         :param timeout: Timeout for the connect operation. If not set, timeout declared on MongoDB instance will be used
         :type timeout: int or float or None
         :raise: PyMongoError
         """
         if timeout is None:
             timeout = self.timeout
-        if self.uri is None:
-            self.client = MongoClient(
-                host=self.host,
-                port=self.port,
-                serverSelectionTimeoutMS=int(timeout * 1000)
+        with self._connect_lock:
+            self._release_client()
+            key = (
+                self.uri if self.uri is not None else (self.host, self.port),
+                timeout, self.max_pool_size, self.min_pool_size,
+                self.reconnect_backoff, self.reconnect_max_backoff
             )
-        else:
-            self.client = MongoClient(
-                uri=self.uri,
-                serverSelectionTimeoutMS=int(timeout * 1000)
-            )
-        self.db = self.client[self.db_name]
-        self.collection = self.db[self.stops_collection_name]
-        self.documents = self.collection
+            shared = None
+            if self.shared_client:
+                with _shared_clients_lock:
+                    shared = _shared_clients.get(key)
+                    if shared is None:
+                        shared = self._create_client(timeout)
+                        _shared_clients[key] = shared
+                    shared.refs += 1
+            else:
+                shared = self._create_client(timeout)
+                shared.refs += 1
+            self._shared = shared
+            self._client_key = key
+            self.client = shared.client
+            self.health = shared.health
+            self.db = self.client[self.db_name]
+            self.collection = self.db[self.stops_collection_name]
+            self.documents = self.collection
+            self.indexes_ensured = False
+
+    def _create_client(self, timeout: Union[int, float]) -> _SharedClient:
+        """Create a new MongoClient, with its health supervisor, using the settings of this instance."""
+        client = MongoClient(
+            host=self.uri if self.uri is not None else self.host,
+            port=None if self.uri is not None else self.port,
+            serverSelectionTimeoutMS=int(timeout * 1000),
+            maxPoolSize=self.max_pool_size,
+            minPoolSize=self.min_pool_size,
+            connect=False
+        )
+        health = MongoHealth(client, backoff=self.reconnect_backoff, max_backoff=self.reconnect_max_backoff)
+        return _SharedClient(client, health)
+
+    def _release_client(self):
+        """Stop using the current client. If no other instances use it, it is closed."""
+        shared, self._shared = self._shared, None
+        if shared is None:
+            return
+        close = False
+        with _shared_clients_lock:
+            shared.refs -= 1
+            if shared.refs <= 0:
+                close = True
+                if _shared_clients.get(self._client_key) is shared:
+                    _shared_clients.pop(self._client_key)
+        if close:
+            shared.close()
 
     def close(self):
-        """Disconnect the MongoDB database.
+        """Disconnect the MongoDB database. A shared client is only closed when no other instances use it.
         If database was already closed, nothing will happen.
         """
-        if self.check_client():
-            self.client.close()
+        with self._connect_lock:
+            self._release_client()
             self.client = None
+            self.health = None
             self.db = None
             self.collection = None
             self.documents = None
@@ -146,6 +316,21 @@ class MongoDB(object):
             raise MongoDBUnavailable("Client of MongoDB on this instance has not been initialized yet")
         return b
 
+    def check_available(self):
+        """Connect to the database if not connected yet, and check that the server is not known to be down,
+        so operations fail immediately while the server is down.
+        :raise: PyMongoError or MongoDBUnavailable
+        """
+        if self.client is None:
+            self.connect()
+        self.health.check()
+
+    def _report_failure(self, exception: Exception):
+        """Report an error of an operation to the health supervisor of the client."""
+        health = self.health
+        if health is not None:
+            health.report_failure(exception)
+
     def check_connection(self, raise_exception: bool = False) -> bool:
         """Tries to perform a operation on the database, and returns True if it was successful.
         Otherwise, if raise_exception=False, returns True.
@@ -157,7 +342,11 @@ class MongoDB(object):
         :raise: PyMongoError if raise_exception=True
         """
         def _f():
-            self.client.admin.command("ismaster")
+            try:
+                self.client.admin.command("ismaster")
+            except PyMongoError as e:
+                self._report_failure(e)
+                raise
         if not self.check_client():
             return False
         if raise_exception:
@@ -180,19 +369,149 @@ class MongoDB(object):
         :raise: StopNotFound or StopGetterUnavailable
         """
         try:
-            self.check_client(True)
+            self.check_available()
             # result = self.documents.find_one({"_id": stopid})
             result = self.documents.find_one({"_id": str(stopid)})
-        except PyMongoError:
-            raise StopGetterUnavailable(
-                f"Error while searching for Stop {stopid} on MongoDB:\n{traceback.format_exc()}"
-            )
-            # QUESTION keep traceback?
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopGetterUnavailable(f"Error while searching for Stop {stopid} on MongoDB: {e}") from e
         if isinstance(result, dict):
             return dict_to_stop(result)
         else:
             raise StopNotFound(f"Stop {stopid} not found on MongoDB database")
 
+    def find_stops(
+            self,
+            stopids: Iterable[int],
+            fields: Optional[Iterable[str]] = None,
+            chunk_size: int = DEFAULT_BULK_CHUNK_SIZE
+    ) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Search many Stops on MongoDB database by their StopIDs, using one $in query for each chunk of IDs.
+        This method is used as a Bulk Getter (StopsGetter) function of PyBuses.
+        :param stopids: IDs of the Stops to search
+        :param fields: if set, only fetch these fields of the Stop documents (e.g. ["lat", "lon"]);
+                       the name is always fetched, and lat/lon are fetched together
+                       (default=None: fetch all the fields)
+        :param chunk_size: max number of Stop IDs queried on each $in query (default=1000)
+        :type stopids: iterable of int
+        :type fields: iterable of str or None
+        :type chunk_size: int
+        :return: dict of the found Stops by their Stop ID, and set of IDs not found on database
+        :rtype: (dict of int: Stop, set of int)
+        :raise: StopGetterUnavailable
+        """
+        projection = None
+        if fields is not None:
+            projection = dict.fromkeys(fields, True)
+            projection["name"] = True
+            if "lat" in projection or "lon" in projection:
+                # A Stop is only located with both coordinates
+                projection["lat"] = projection["lon"] = True
+        stopids = list(dict.fromkeys(int(stopid) for stopid in stopids))
+        found: Dict[int, Stop] = dict()
+        try:
+            self.check_available()
+            for i in range(0, len(stopids), chunk_size):
+                chunk = [str(stopid) for stopid in stopids[i:i+chunk_size]]
+                for result in self.documents.find({"_id": {"$in": chunk}}, projection):
+                    stop = dict_to_stop(result)
+                    found[stop.stopid] = stop
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopGetterUnavailable(f"Error while searching for Stops on MongoDB: {e}") from e
+        return found, set(stopids) - found.keys()
+
+    def ensure_indexes(self):
+        """Create the indexes used by PyBuses on the stops collection, if they do not exist:
+        a 2dsphere index on the location field, required by the geospatial queries.
+        This method is called automatically before the first geospatial query.
+        :raise: PyMongoError or MongoDBUnavailable
+        """
+        self.check_available()
+        self.documents.create_index([(LOCATION_FIELD, GEOSPHERE)])
+        self.indexes_ensured = True
+
+    def update_locations(self) -> int:
+        """Set the GeoJSON location field on the saved Stops that have lat and lon but no location
+        (i.e. Stops saved by previous versions of PyBuses), so they can be found by the geospatial queries.
+        :return: number of Stops updated
+        :rtype: int
+        :raise: PyMongoError or MongoDBUnavailable
+        """
+        self.check_available()
+        result = self.documents.update_many(
+            filter={"lat": {"$exists": True}, "lon": {"$exists": True}, LOCATION_FIELD: {"$exists": False}},
+            update=[{"$set": {LOCATION_FIELD: {"type": "Point", "coordinates": ["$lon", "$lat"]}}}]
+        )
+        return result.modified_count
+
+    def find_stops_near(
+            self,
+            lat: float,
+            lon: float,
+            radius_m: Optional[Union[int, float]] = None,
+            limit: int = DEFAULT_NEAR_LIMIT
+    ) -> List[Tuple[Stop, float]]:
+        """Search the Stops nearest to a location, sorted by distance, using a $geoNear query.
+        Only Stops with location are considered.
+        :param lat: latitude of the location
+        :param lon: longitude of the location
+        :param radius_m: if set, max distance to the location, in meters (default=None)
+        :param limit: max number of Stops returned (default=20)
+        :type lat: float
+        :type lon: float
+        :type radius_m: int or float or None
+        :type limit: int
+        :return: list of tuples (Stop, distance to the location in meters), nearest first
+        :rtype: list of (Stop, float)
+        :raise: StopGetterUnavailable
+        """
+        if limit <= 0:
+            return []
+        try:
+            if not self.indexes_ensured:
+                self.ensure_indexes()
+            results = self.documents.aggregate(geo_near_pipeline(lat, lon, radius_m, limit))
+            return [(dict_to_stop(result), result["distance"]) for result in results]
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopGetterUnavailable(f"Error while searching for Stops near ({lat}, {lon}) on MongoDB: {e}") from e
+
+    def find_stops_within(self, bbox: Tuple[float, float, float, float]) -> List[Stop]:
+        """Search the Stops located inside a bounding box, using a $geoWithin query (see bbox_query()).
+        Only Stops with location are considered.
+        :param bbox: bounding box, as (min lat, min lon, max lat, max lon)
+        :type bbox: (float, float, float, float)
+        :return: list of Stops inside the bounding box
+        :rtype: list of Stop
+        :raise: StopGetterUnavailable, or ValueError if the bounding box is not valid
+        """
+        query = bbox_query(bbox)
+        try:
+            if not self.indexes_ensured:
+                self.ensure_indexes()
+            results = self.documents.find(query)
+            return [dict_to_stop(result) for result in results]
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopGetterUnavailable(f"Error while searching for Stops within {bbox} on MongoDB: {e}") from e
+
+    def iter_stops(self, batch_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Iterator[Stop]:
+        """Iterate all the Stops saved on the database, fetching the documents in batches.
+        :param batch_size: number of documents fetched on each batch of the cursor (default=1000)
+        :type batch_size: int
+        :return: iterator of the saved Stops
+        :rtype: iterator of Stop
+        :raise: StopGetterUnavailable
+        """
+        try:
+            self.check_available()
+            for document in self.documents.find({}, batch_size=batch_size):
+                yield dict_to_stop(document)
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopGetterUnavailable(f"Error while reading the Stops from MongoDB: {e}") from e
+
     def is_stop_saved(self, stopid: int) -> bool:
         """Check if the given Stop is saved on the database.
         :param stopid: ID of the Stop to search
@@ -201,13 +520,14 @@ class MongoDB(object):
         :rtype: bool
         :raise: PyMongoError or MongoDBNotAvailable
         """
-        self.check_client(True)
+        self.check_available()
         # return bool(self.documents.find_one({"_id": stopid}))
         return bool(self.documents.find_one({"_id": str(stopid)}))
 
     def save_stop(self, stop: Stop, update: bool = True):
         """Save or update a Stop on this MongoDB.
         If update=True and the stop is currently saved, it will be updated with the Stop provided.
+        The Stop is saved with a single upsert operation, so only one round-trip to the database is performed.
         This method is used as a StopSetter function of PyBuses.
         :param stop:
         :param update: if True, when the Stop to save exists in database, update it with the Stop provided
@@ -216,42 +536,37 @@ class MongoDB(object):
         :raise: StopSetterUnavailable
         """
         try:
-            self.check_client(True)
-            exists = self.is_stop_saved(stop.stopid)
-            if not exists:
-                # Add new Stop
-                # d = dict()
-                d = dict(stop)
-                stopid = d.pop("stopid")
-                # d["_id"] = stopid
-                d["_id"] = str(stopid)
-                # d["name"] = stop.name
-                curtime = current_datetime()
-                d["saved"] = curtime
-                d["updated"] = curtime
-                # if stop.has_location():
-                #     d["lat"] = stop.lat
-                #     d["lon"] = stop.lon
-                self.documents.insert_one(d)
-            else:
-                # Update existing Stop if param update=True
-                if not update:
-                    return
-                # d = dict()
-                d = dict(stop)
-                d.pop("stopid")
-                d["updated"] = current_datetime()
-                # d["name"] = stop.name
-                # if stop.has_location():
-                #     d["lat"] = stop.lat
-                #     d["lon"] = stop.lon
-                self.documents.update_one(
-                    filter={"_id": stop.stopid},
-                    update={"$set": d}
-                )
-        except PyMongoError:
-            raise StopSetterUnavailable(f"Error while saving Stop to MongoDB:\n{traceback.format_exc()}")
-            # QUESTION keep traceback?
+            self.check_available()
+            self.documents.update_one(**stop_upsert(stop, update))
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopSetterUnavailable(f"Error while saving Stop {stop.stopid} to MongoDB: {e}") from e
+
+    def save_stops(self, stops: Iterable[Stop], update: bool = True, chunk_size: int = DEFAULT_BULK_CHUNK_SIZE):
+        """Save or update many Stops on this MongoDB, with the same behaviour as save_stop() for each Stop.
+        Stops are saved with unordered bulk writes of upsert operations, sending chunk_size Stops on each write.
+        This method is used as a Bulk Setter (StopsSetter) function of PyBuses.
+        :param stops: Stop objects to save
+        :param update: if True, when a Stop to save exists in database, update it with the Stop provided
+        :param chunk_size: max number of Stops sent on each bulk write (default=1000)
+        :type stops: iterable of Stop
+        :type update: bool
+        :type chunk_size: int
+        :raise: StopSetterUnavailable
+        """
+        try:
+            self.check_available()
+            chunk: List[UpdateOne] = list()
+            for stop in stops:  # type: Stop
+                chunk.append(UpdateOne(**stop_upsert(stop, update)))
+                if len(chunk) >= chunk_size:
+                    self.documents.bulk_write(chunk, ordered=False)
+                    chunk = list()
+            if chunk:
+                self.documents.bulk_write(chunk, ordered=False)
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopSetterUnavailable(f"Error while saving Stops to MongoDB: {e}") from e
 
     def delete_stop(self, stopid: int) -> bool:
         """Delete a saved stop from MongoDB, and return if the stop was deleted or it did not exist in database.
@@ -262,12 +577,12 @@ class MongoDB(object):
         :raise: StopDeleterUnavailable
         """
         try:
-            self.check_client(True)
+            self.check_available()
             # return bool(self.collection.delete_one({"_id": stopid}).deleted_count)
             return bool(self.collection.delete_one({"_id": str(stopid)}).deleted_count)
-        except PyMongoError:
-            raise StopSetterUnavailable(f"Error while deleting Stop from MongoDB:\n{traceback.format_exc()}")
-            # QUESTION keep traceback?
+        except PyMongoError as e:
+            self._report_failure(e)
+            raise StopDeleterUnavailable(f"Error while deleting Stop {stopid} from MongoDB: {e}") from e
 
 
 def dict_to_stop(dictionary: dict) -> Stop:
@@ -286,9 +601,111 @@ def dict_to_stop(dictionary: dict) -> Stop:
         ret.lat = dictionary["lat"]
     if "lon" in dictionary.keys():
         ret.lon = dictionary["lon"]
+    if "other" in dictionary.keys():
+        ret.other = dictionary["other"]
     return ret
 
 
+def stop_upsert(stop: Stop, update: bool = True) -> Dict:
+    """Get the parameters of the upsert operation that saves a Stop on MongoDB.
+    The "saved" timestamp is only set when the Stop is inserted. If update=True, the existing Stop is overwritten
+    with the data of the Stop provided and the "updated" timestamp is refreshed; otherwise, it is kept untouched.
+    When updating a Stop without location, the location fields of the existing Stop are removed.
+    :param stop: Stop to save
+    :param update: if True, update the Stop if it exists in database
+    :type stop: Stop
+    :type update: bool
+    :return: dict with the filter, update and upsert parameters for update_one/UpdateOne
+    :rtype: dict
+    """
+    d = dict(stop)
+    stopid = d.pop("stopid")
+    if stop.has_location():
+        d[LOCATION_FIELD] = {"type": "Point", "coordinates": [stop.lon, stop.lat]}
+    curtime = current_datetime()
+    if update:
+        d["updated"] = curtime
+        operation = {"$set": d, "$setOnInsert": {"saved": curtime}}
+        unset = {field: "" for field in ("lat", "lon") if field not in d}
+        if not stop.has_location():
+            unset[LOCATION_FIELD] = ""
+        if unset:
+            operation["$unset"] = unset
+    else:
+        d["saved"] = curtime
+        d["updated"] = curtime
+        operation = {"$setOnInsert": d}
+    return {"filter": {"_id": str(stopid)}, "update": operation, "upsert": True}
+
+
+def geo_near_pipeline(
+        lat: float,
+        lon: float,
+        radius_m: Optional[Union[int, float]] = None,
+        limit: int = DEFAULT_NEAR_LIMIT
+) -> List[Dict]:
+    """Get the aggregation pipeline that searches the Stops nearest to a location, using $geoNear.
+    The distance (in meters) to the location is added to each document as the "distance" field.
+    :param lat: latitude of the location
+    :param lon: longitude of the location
+    :param radius_m: if set, max distance to the location, in meters (default=None)
+    :param limit: max number of Stops returned, must be positive (default=20)
+    :type lat: float
+    :type lon: float
+    :type radius_m: int or float or None
+    :type limit: int
+    :rtype: list of dict
+    """
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+        "key": LOCATION_FIELD,
+        "distanceField": "distance",
+        "spherical": True
+    }
+    if radius_m is not None:
+        geo_near["maxDistance"] = radius_m
+    return [{"$geoNear": geo_near}, {"$limit": limit}]
+
+
+def bbox_query(bbox: Tuple[float, float, float, float]) -> Dict:
+    """Get the filter that finds the Stops located inside a bounding box.
+    The edges of a GeoJSON polygon are geodesics (great circle arcs) instead of parallels, and an arc between two
+    points of the same latitude bulges towards the pole. So the $geoWithin polygon (that uses the 2dsphere index)
+    has its edge nearest to the equator moved away from the bounding box, enough for its arc not to cut the box,
+    and the Stops are filtered by their exact lat/lon too.
+    :param bbox: bounding box, as (min lat, min lon, max lat, max lon); it must be less than 180 degrees wide
+                 and not cross the antimeridian
+    :type bbox: (float, float, float, float)
+    :rtype: dict
+    :raise: ValueError if the bounding box is not valid
+    """
+    min_lat, min_lon, max_lat, max_lon = (float(c) for c in bbox)
+    if not min_lat <= max_lat or not 0 <= max_lon - min_lon < 180:
+        raise ValueError(f"Invalid bounding box {bbox}: it must be less than 180 degrees wide, "
+                         "and not cross the antimeridian")
+    half_width = radians(max_lon - min_lon) / 2
+
+    def _arc_edge(lat: float) -> float:
+        # Latitude of the vertices of an arc whose furthest point from the equator is at the given latitude,
+        # with a small margin for rounding errors
+        edge = degrees(atan(tan(radians(lat)) * cos(half_width)))
+        return edge - _BBOX_EDGE_MARGIN if lat > 0 else edge + _BBOX_EDGE_MARGIN
+
+    south = _arc_edge(min_lat) if min_lat > 0 else min_lat
+    north = _arc_edge(max_lat) if max_lat < 0 else max_lat
+    polygon = {
+        "type": "Polygon",
+        "coordinates": [[
+            [min_lon, south], [max_lon, south], [max_lon, north], [min_lon, north], [min_lon, south]
+        ]]
+    }
+    return {
+        LOCATION_FIELD: {"$geoWithin": {"$geometry": polygon}},
+        "lat": {"$gte": min_lat, "$lte": max_lat},
+        "lon": {"$gte": min_lon, "$lte": max_lon}
+    }
+
+
 def current_datetime() -> int:
     """Return current datetime in Unix/Epoch format and UTC timezone.
     :return: current Unix/Epoch timestamp in UTC timezone, parsed to int
@@ -0,0 +1,303 @@
+
+# Native modules
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from threading import Lock
+from typing import List, Dict, Set, FrozenSet, Tuple, Iterable
+# Own modules
+from .assets import Stop, StopSetter, StopDeleter
+
+__all__ = ["StopNameIndex", "normalize_name", "DEFAULT_SEARCH_LIMIT", "DEFAULT_MIN_SIMILARITY"]
+
+DEFAULT_SEARCH_LIMIT = 10
+DEFAULT_MIN_SIMILARITY = 0.3
+
+# Weights of the scores of a result
+_PREFIX_WEIGHT = 1.0
+_EXACT_TOKEN_BONUS = 0.25
+_COVERAGE_WEIGHT = 0.25
+_TRIGRAM_WEIGHT = 1.0
+
+# max number of query words whose prefix and fuzzy matches are cached
+_MATCHES_CACHE_SIZE = 256
+
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a Stop name (or a query) for searching: accents and other diacritics are removed,
+    letters are casefolded, and any symbol is replaced by a single space (e.g. "Rúa Urzáiz, 12" => "rua urzaiz 12").
+    :param name: text to normalize
+    :type name: str
+    :return: normalized text
+    :rtype: str
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALPHANUMERIC.sub(" ", stripped).strip()
+
+
+def _trigrams(tokens: Iterable[str]) -> Set[str]:
+    """Get the trigrams of the given normalized words, each padded with two spaces before and one after."""
+    trigrams = set()
+    for token in tokens:
+        padded = f"  {token} "
+        trigrams.update(padded[i:i+3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class _Entry(object):
+    """A Stop indexed by name, with its normalized words."""
+    __slots__ = ("stop", "tokens", "length")
+
+    def __init__(self, stop: Stop, tokens: List[str]):
+        self.stop: Stop = stop
+        self.tokens: List[str] = tokens
+        self.length: int = max(sum(len(token) for token in tokens), 1)
+
+
+class StopNameIndex(object):
+    """Search index of Stops by name, for search-as-you-type.
+
+    Names and queries are normalized (see normalize_name). A Stop matches a query when its name contains words
+    starting with each of the query words (prefix matching), or when its words are similar enough to the query
+    words, comparing their trigrams (fuzzy matching, tolerant to typos). Results are ranked by a score combining both.
+    The trigrams are indexed by word, not by Stop, so the fuzzy matching works on the vocabulary of the names,
+    which is much smaller than the catalogue. The Stops matching each prefix are cached, ranked by name length,
+    so short prefixes typed by the user only score the best candidates.
+    The index can be kept up to date registering it on PyBuses with add_stops_index(): it is then updated with
+    every Stop found, saved or deleted through PyBuses. Registering save_stop and delete_stop as Stop setter and
+    deleter is not enough, since PyBuses only uses the first setter that works, unless use_all_stop_setters=True.
+    """
+    def __init__(self, stops: Iterable[Stop] = (), min_similarity: float = DEFAULT_MIN_SIMILARITY):
+        """
+        :param stops: Stops to index initially (default=none)
+        :param min_similarity: min trigram similarity (0~1) of a Stop that does not match the query words
+                               by prefix to be returned (default=0.3)
+        :type stops: iterable of Stop
+        :type min_similarity: float
+        """
+        self.min_similarity: float = min_similarity
+        self._entries: Dict[int, _Entry] = dict()
+        self._words: Dict[str, Set[int]] = dict()
+        self._sorted_words: List[str] = list()
+        self._trigrams: Dict[str, Set[str]] = dict()
+        self._word_trigrams: Dict[str, int] = dict()
+        self._prefix_cache: "OrderedDict[str, Tuple[List[int], FrozenSet[int]]]" = OrderedDict()
+        self._fuzzy_cache: "OrderedDict[Tuple[str, float], Dict[int, float]]" = OrderedDict()
+        self._lock = Lock()
+        self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
+        for stop in stops:  # type: Stop
+            self.insert(stop)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, stopid: int):
+        return stopid in self._entries
+
+    def insert(self, stop: Stop):
+        """Add a Stop to the index, or replace it if already indexed.
+        :param stop: Stop object
+        :type stop: Stop
+        """
+        tokens = normalize_name(stop.name).split()
+        with self._lock:
+            self._remove(stop.stopid)
+            self._entries[stop.stopid] = _Entry(stop, tokens)
+            for word in set(tokens):
+                stopids = self._words.get(word)
+                if stopids is None:
+                    stopids = self._words[word] = set()
+                    insort(self._sorted_words, word)
+                    trigrams = _trigrams([word])
+                    self._word_trigrams[word] = len(trigrams)
+                    for trigram in trigrams:
+                        self._trigrams.setdefault(trigram, set()).add(word)
+                stopids.add(stop.stopid)
+            self._clear_caches()
+
+    def remove(self, stopid: int) -> bool:
+        """Remove a Stop from the index.
+        :param stopid: ID of the Stop to remove
+        :type stopid: int
+        :return: True if the Stop was indexed, False if not
+        :rtype: bool
+        """
+        with self._lock:
+            return self._remove(stopid)
+
+    def _remove(self, stopid: int) -> bool:
+        """Remove a Stop from the index. Must be called with the lock acquired."""
+        entry = self._entries.pop(stopid, None)
+        if entry is None:
+            return False
+        for word in set(entry.tokens):
+            stopids = self._words[word]
+            stopids.discard(stopid)
+            if not stopids:
+                self._words.pop(word)
+                self._sorted_words.pop(bisect_left(self._sorted_words, word))
+                self._word_trigrams.pop(word)
+                for trigram in _trigrams([word]):
+                    words = self._trigrams[trigram]
+                    words.discard(word)
+                    if not words:
+                        self._trigrams.pop(trigram)
+        self._clear_caches()
+        return True
+
+    def _clear_caches(self):
+        """Remove the cached matches of the query words. Must be called with the lock acquired."""
+        self._prefix_cache.clear()
+        self._fuzzy_cache.clear()
+
+    def save_stop(self, stop: Stop, update: bool = True):
+        """Add a Stop to the index.
+        This method can be used as a StopSetter function of PyBuses.
+        :param stop: Stop object
+        :param update: if True, replace the Stop if currently indexed (default=True)
+        :type stop: Stop
+        :type update: bool
+        """
+        if not update and stop.stopid in self._entries:
+            return
+        self.insert(stop)
+
+    def delete_stop(self, stopid: int) -> bool:
+        """Remove a Stop from the index.
+        This method can be used as a StopDeleter function of PyBuses.
+        :param stopid: ID of the Stop to remove
+        :type stopid: int
+        :return: True if the Stop was indexed, False if not
+        :rtype: bool
+        """
+        return self.remove(stopid)
+
+    def _prefix_matches(self, prefix: str) -> Tuple[List[int], FrozenSet[int]]:
+        """Get the IDs of the Stops with a word starting with the given prefix, as a list ranked by name length
+        (shortest names first), and as a set. Results are cached until the index changes.
+        Must be called with the lock acquired.
+        """
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            self._prefix_cache.move_to_end(prefix)
+            return cached
+        stopids = set()
+        words = self._sorted_words
+        for i in range(bisect_left(words, prefix), len(words)):
+            if not words[i].startswith(prefix):
+                break
+            stopids.update(self._words[words[i]])
+        entries = self._entries
+        ranked = sorted(stopids, key=lambda stopid: (entries[stopid].length, stopid))
+        cached = self._prefix_cache[prefix] = (ranked, frozenset(stopids))
+        if len(self._prefix_cache) > _MATCHES_CACHE_SIZE:
+            self._prefix_cache.popitem(last=False)
+        return cached
+
+    def _similar_words_matches(self, token: str) -> Dict[int, float]:
+        """Get the similarity (Jaccard index of the trigrams) of the most similar word of each Stop to a query word.
+        Words less similar than min_similarity are ignored. Results are cached until the index changes.
+        Must be called with the lock acquired.
+        :return: similarity of the Stops by Stop ID
+        """
+        key = (token, self.min_similarity)
+        cached = self._fuzzy_cache.get(key)
+        if cached is not None:
+            self._fuzzy_cache.move_to_end(key)
+            return cached
+        token_trigrams = _trigrams([token])
+        shared: Counter = Counter()
+        for trigram in token_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        best: Dict[int, float] = dict()
+        for word, count in shared.items():
+            similarity = count / (len(token_trigrams) + self._word_trigrams[word] - count)
+            if similarity < self.min_similarity:
+                continue
+            for stopid in self._words[word]:
+                if similarity > best.get(stopid, 0.0):
+                    best[stopid] = similarity
+        self._fuzzy_cache[key] = best
+        if len(self._fuzzy_cache) > _MATCHES_CACHE_SIZE:
+            self._fuzzy_cache.popitem(last=False)
+        return best
+
+    def _fuzzy_matches(self, tokens: List[str], exclude: Set[int]) -> Dict[int, float]:
+        """Get the trigram similarity of the Stops whose words are similar to the query words.
+        Each query word is compared with the words of the index, and takes the similarity (Jaccard index of
+        the trigrams) of the most similar word of each Stop; words less similar than min_similarity are ignored.
+        The similarity of a Stop is the mean of the similarities of all the query words.
+        Must be called with the lock acquired.
+        :param tokens: normalized query words
+        :param exclude: IDs of the Stops to ignore
+        :return: similarity of the Stops at least as similar as min_similarity, by Stop ID
+        """
+        totals: Dict[int, float] = dict()
+        for token in tokens:
+            for stopid, similarity in self._similar_words_matches(token).items():
+                totals[stopid] = totals.get(stopid, 0.0) + similarity
+        return {
+            stopid: total / len(tokens) for stopid, total in totals.items()
+            if stopid not in exclude and total / len(tokens) >= self.min_similarity
+        }
+
+    def search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Tuple[Stop, float]]:
+        """Search Stops by name.
+        Stops with words starting with all the query words rank first (the last query word might be incomplete,
+        as typed by the user); words matching completely, and names covered most by the query, rank higher.
+        When not enough Stops match by prefix, Stops with words similar to the query words by trigrams are also
+        returned, so names with typos are found.
+        :param query: text to search
+        :param limit: max number of results (default=10)
+        :type query: str
+        :type limit: int
+        :return: list of tuples (Stop, score), best results first
+        :rtype: list of (Stop, float)
+        """
+        tokens = normalize_name(query).split()
+        if not tokens or limit <= 0:
+            return []
+        query_length = sum(len(token) for token in tokens)
+        with self._lock:
+            # Prefix matching: Stops with words starting with all the query words.
+            # The candidates of the most selective word are walked from the shortest name, and the walk stops
+            # when not even a Stop matching all the words exactly could beat the current top results
+            matches = sorted((self._prefix_matches(token) for token in set(tokens)), key=lambda m: len(m[1]))
+            ranked = matches[0][0]
+            candidates = matches[0][1].intersection(*(stopids for _, stopids in matches[1:]))
+            # Only the query words that are complete words of the index can match exactly
+            max_exact = sum(1 for token in tokens if token in self._words)
+            max_score = _PREFIX_WEIGHT + _EXACT_TOKEN_BONUS * max_exact / len(tokens)
+            top: List[Tuple[float, int]] = list()  # min-heap of (score, -stopid)
+            for stopid in (ranked if len(candidates) == len(ranked) else filter(candidates.__contains__, ranked)):
+                entry = self._entries[stopid]
+                if len(top) >= limit and max_score + _COVERAGE_WEIGHT * query_length / entry.length < top[0][0]:
+                    break
+                exact = sum(1 for token in tokens if token in entry.tokens)
+                score = (
+                    _PREFIX_WEIGHT + _EXACT_TOKEN_BONUS * exact / len(tokens)
+                    + _COVERAGE_WEIGHT * query_length / entry.length
+                )
+                if len(top) < limit:
+                    heapq.heappush(top, (score, -stopid))
+                else:
+                    heapq.heappushpop(top, (score, -stopid))
+            scores: Dict[int, float] = {-negative_stopid: score for score, negative_stopid in top}
+
+            # Fuzzy matching, when not enough Stops matched by prefix (so all of them are on the scores):
+            # scored by their trigram similarity, that is always lower than the score of prefix matches
+            if len(scores) < limit:
+                for stopid, similarity in self._fuzzy_matches(tokens, exclude=set(scores)).items():
+                    scores[stopid] = _TRIGRAM_WEIGHT * similarity
+
+            # Ties (e.g. Stops equally similar to a typo) are broken by the shortest name
+            best = heapq.nsmallest(
+                limit, scores.items(), key=lambda item: (-item[1], self._entries[item[0]].length, item[0])
+            )
+            return [(self._entries[stopid].stop, score) for stopid, score in best]
@@ -0,0 +1,521 @@
+
+# Native modules
+import errno
+import os
+import json
+import socket
+import socketserver
+import struct
+import time
+from collections import OrderedDict
+from threading import Thread, Lock, local
+from typing import Union, Optional, List, Dict, Set, Tuple, Iterable, Any
+# Own modules
+from .assets import Stop, StopGetter, StopsGetter, StopSetter, StopsSetter, StopDeleter
+from .cache import StopsCache
+from .exceptions import *
+
+"""PROTOCOL OF THE SHARED STOPS CACHE
+Clients talk to the server through a Unix socket, with frames of a 4-byte big-endian length followed by
+a UTF-8 JSON document. Each request is a list [operation, arguments...], answered by {"result": ...}
+or {"error": "message"}. Stops are sent as the dicts returned by Stop.asdict().
+
+Operations
+    ["find_stop", stopid] => ["found", stop] or ["not_exist"] or ["not_found"]
+    ["lookup", stopid] => same as find_stop, or ["negative"] if the Stop is cached as not found
+                          (check_negative and find_stop on a single request)
+    ["find_stops", [stopids]] => [[stops], [misses]]
+    ["check_negative", stopid] => "not_exist" or "not_found" or null
+    ["save_stops", [stops], update] => null
+    ["save_negative", stopid, not_exist] => null
+    ["delete_stop", stopid] => bool
+    ["clear"] => null
+    ["stats"] => dict (see StopsCache.stats)
+"""
+
+__all__ = [
+    "SharedStopsCache", "SharedStopsCacheServer", "DEFAULT_SOCKET_PATH", "DEFAULT_SOCKET_TIMEOUT",
+    "DEFAULT_FAILURE_THRESHOLD", "DEFAULT_RETRY_AFTER"
+]
+
+DEFAULT_SOCKET_PATH = "/tmp/pybuses-stops-cache.sock"
+DEFAULT_SOCKET_TIMEOUT = 1
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RETRY_AFTER = 5
+# max time, in seconds, that the result of a lookup done by check_negative() is kept for the next find_stop()
+_PREFETCH_MAX_AGE = 1
+_PREFETCH_MAX_SIZE = 1024
+
+_LENGTH = struct.Struct("!I")
+
+
+def _send(sock: socket.socket, message: Any):
+    """Send a JSON message through a socket, as a frame."""
+    data = json.dumps(message, default=str).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _receive(file) -> Optional[Any]:
+    """Read a JSON message, sent as a frame, from a socket file. Return None if the socket was closed."""
+    header = file.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        return None
+    length, = _LENGTH.unpack(header)
+    data = file.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serve the requests of a client connection, until the client closes it."""
+    def setup(self):
+        super().setup()
+        with self.server.connections_lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self.request)
+        super().finish()
+
+    def handle(self):
+        cache: StopsCache = self.server.cache
+        while True:
+            try:
+                request = _receive(self.rfile)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            try:
+                response = {"result": _execute(cache, request[0], request[1:])}
+            except Exception as e:
+                response = {"error": f"{e.__class__.__name__}: {e}"}
+            try:
+                _send(self.request, response)
+            except OSError:
+                return
+
+
+def _execute(cache: StopsCache, operation: str, arguments: List) -> Any:
+    """Run an operation requested by a client on the cache, and return its JSON-serializable result."""
+    if operation == "find_stop":
+        try:
+            return ["found", cache.find_stop(arguments[0]).asdict()]
+        except StopNotExist:
+            return ["not_exist"]
+        except StopNotFound:
+            return ["not_found"]
+    if operation == "lookup":
+        try:
+            cache.check_negative(arguments[0])
+        except StopNotExist:
+            return ["not_exist"]
+        except StopNotFound:
+            return ["negative"]
+        return _execute(cache, "find_stop", arguments)
+    if operation == "find_stops":
+        found, misses = cache.find_stops(arguments[0])
+        return [[stop.asdict() for stop in found.values()], list(misses)]
+    if operation == "check_negative":
+        try:
+            cache.check_negative(arguments[0])
+        except StopNotExist:
+            return "not_exist"
+        except StopNotFound:
+            return "not_found"
+        return None
+    if operation == "save_stops":
+        stops, update = arguments
+        for stop in stops:
+            cache.save_stop(Stop(**stop), update=update)
+        return None
+    if operation == "save_negative":
+        cache.save_negative(arguments[0], not_exist=arguments[1])
+        return None
+    if operation == "delete_stop":
+        return cache.delete_stop(arguments[0])
+    if operation == "clear":
+        cache.clear()
+        return None
+    if operation == "stats":
+        return cache.stats()
+    raise ValueError(f"Unknown operation {operation}")
+
+
+class SharedStopsCacheServer(object):
+    """Server of a Stops cache shared by many processes (e.g. the workers of a pre-fork server),
+    through a Unix socket. The Stops are kept once, on the process that runs the server, on a StopsCache.
+    Processes use it with SharedStopsCache clients.
+    """
+    def __init__(self, path: str = DEFAULT_SOCKET_PATH, cache: Optional[StopsCache] = None):
+        """
+        :param path: location of the Unix socket; if a stale socket file exists on it, it is replaced
+                     (default=/tmp/pybuses-stops-cache.sock)
+        :param cache: StopsCache where the Stops are kept (default=new StopsCache with the default settings)
+        :type path: str
+        :type cache: StopsCache or None
+        """
+        self.path: str = path
+        self.cache: StopsCache = cache if cache is not None else StopsCache()
+        self._server: Optional[socketserver.ThreadingUnixStreamServer] = None
+        self._thread: Optional[Thread] = None
+
+    def _bind(self):
+        """Create the socket server, replacing any stale socket file.
+        :raise: OSError (EADDRINUSE) if another server is listening on the socket
+        """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # Nobody listening: stale socket file of a server that died
+                os.remove(self.path)
+            else:
+                raise OSError(errno.EADDRINUSE, f"A server is already listening on {self.path}")
+            finally:
+                probe.close()
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, _RequestHandler)
+        self._server.daemon_threads = True
+        self._server.cache = self.cache
+        self._server.connections = set()
+        self._server.connections_lock = Lock()
+
+    def serve_forever(self):
+        """Run the server on the current thread, until stop() is called.
+        :raise: OSError (EADDRINUSE) if another server is listening on the socket
+        """
+        self._bind()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._close()
+
+    def start(self):
+        """Run the server on a background (daemon) thread.
+        :raise: OSError (EADDRINUSE) if another server is listening on the socket
+        """
+        self._bind()
+        self._thread = Thread(target=self._server.serve_forever, name="PyBusesSharedCache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the server, and remove the socket file."""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _close(self):
+        """Close the socket server and the connections of the clients, and remove the socket file."""
+        if self._server is None:
+            return
+        self._server.server_close()
+        # Close the connections of the clients, so they notice the server is gone
+        with self._server.connections_lock:
+            connections = list(self._server.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._server = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SharedStopsCache(object):
+    """Client of a Stops cache shared by many processes, served by a SharedStopsCacheServer.
+    It has the same interface as StopsCache, so it can be registered with PyBuses.add_stops_cache().
+    Since all the processes use the same cache, a Stop saved or deleted (or a negative result cached)
+    by any process is seen immediately by the others, and memory does not grow with the number of processes.
+
+    Each thread uses its own connection to the server; connections are opened again after forking.
+    The cache is best-effort: when the server can not be reached, find_stop/find_stops raise
+    StopGetterUnavailable (so PyBuses uses the next getters), while the cache updates are skipped
+    and counted as errors. After failure_threshold consecutive failed requests, the server is considered down,
+    and the requests fail immediately (without waiting for the timeout) for retry_after seconds.
+
+    check_negative() looks up the Stop with a single request, and keeps the result for a find_stop()
+    of the same Stop that follows it, so a PyBuses.find_stop() costs a single round-trip to the server.
+    """
+    def __init__(
+            self,
+            path: str = DEFAULT_SOCKET_PATH,
+            timeout: Union[int, float] = DEFAULT_SOCKET_TIMEOUT,
+            failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+            retry_after: Union[int, float] = DEFAULT_RETRY_AFTER
+    ):
+        """
+        :param path: location of the Unix socket of the server (default=/tmp/pybuses-stops-cache.sock)
+        :param timeout: timeout of the operations on the server, in seconds (default=1)
+        :param failure_threshold: number of consecutive failed requests that mark the server as down (default=3)
+        :param retry_after: time, in seconds, that requests fail immediately after the server is marked as down,
+                            before trying it again (default=5)
+        :type path: str
+        :type timeout: int or float
+        :type failure_threshold: int
+        :type retry_after: int or float
+        """
+        self.path: str = path
+        self.timeout: Union[int, float] = timeout
+        self.failure_threshold: int = max(failure_threshold, 1)
+        self.retry_after: Union[int, float] = retry_after
+        self.errors: int = 0
+        self.consecutive_failures: int = 0
+        self._down_until: Optional[float] = None
+        self._prefetched: "OrderedDict[int, Tuple[float, List]]" = OrderedDict()
+        self._prefetched_lock = Lock()
+        self._local = local()
+        self._errors_lock = Lock()
+        self.find_stop: StopGetter = self.find_stop  # Set StopGetter data type on this embedded getter
+        self.find_stops: StopsGetter = self.find_stops  # Set StopsGetter data type on this embedded bulk getter
+        self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.save_stops: StopsSetter = self.save_stops  # Set StopsSetter data type on this embedded bulk setter
+        self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
+
+    def __len__(self):
+        try:
+            return self.stats()["size"]
+        except ResourceUnavailable:
+            return 0
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        """Get the connection to the server of the current thread (and process), opening it if not opened yet.
+        :return: tuple of (socket, file to read from the socket)
+        :raise: OSError
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and connection[0] == os.getpid():
+            return connection[1], connection[2]
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._local.connection = (os.getpid(), sock, sock.makefile("rb"))
+        return sock, self._local.connection[2]
+
+    def _disconnect(self):
+        """Close the connection to the server of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None and connection[0] == os.getpid():
+            connection[2].close()
+            connection[1].close()
+
+    @property
+    def available(self) -> bool:
+        """False while the server is considered down (requests fail immediately)."""
+        down_until = self._down_until
+        return down_until is None or time.monotonic() >= down_until
+
+    def _request(self, *request) -> Any:
+        """Send a request to the server and return its result.
+        A request that fails because the connection was closed (e.g. the server was restarted) is retried once;
+        a request that timed out is not retried.
+        :raise: ResourceUnavailable
+        """
+        if not self.available:
+            with self._errors_lock:
+                self.errors += 1
+            raise ResourceUnavailable(f"Shared Stops cache at {self.path} is down, waiting to retry it")
+        for attempt in range(2):
+            try:
+                sock, file = self._connect()
+                _send(sock, request)
+                response = _receive(file)
+            except socket.timeout as e:
+                self._disconnect()
+                error = e
+                break
+            except (OSError, ValueError) as e:
+                self._disconnect()
+                error = e
+                continue
+            if response is None:
+                self._disconnect()
+                error = ConnectionError("connection closed by the server")
+                continue
+            with self._errors_lock:
+                self.consecutive_failures = 0
+                self._down_until = None
+            if "error" in response:
+                raise ResourceUnavailable(f"Shared Stops cache error: {response['error']}")
+            return response["result"]
+        with self._errors_lock:
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self._down_until = time.monotonic() + self.retry_after
+        raise ResourceUnavailable(f"Shared Stops cache at {self.path} not available: {error}")
+
+    def _lookup(self, stopid: int) -> List:
+        """Look up a Stop on the server (see the "lookup" operation of the protocol).
+        The result prefetched by check_negative() for the Stop is used, if fresh.
+        :raise: ResourceUnavailable
+        """
+        with self._prefetched_lock:
+            prefetched = self._prefetched.pop(stopid, None)
+        if prefetched is not None and time.monotonic() - prefetched[0] <= _PREFETCH_MAX_AGE:
+            return prefetched[1]
+        return self._request("lookup", stopid)
+
+    def _discard_prefetched(self, stopids: Optional[Iterable[int]] = None):
+        """Discard the lookup results prefetched for the given Stops (default=all), since they changed."""
+        with self._prefetched_lock:
+            if stopids is None:
+                self._prefetched.clear()
+                return
+            for stopid in stopids:
+                self._prefetched.pop(stopid, None)
+
+    def find_stop(self, stopid: int) -> Stop:
+        """Search a Stop on the shared cache.
+        This method is used as a StopGetter function of PyBuses.
+        :param stopid: ID of the Stop to search
+        :type stopid: int
+        :return: found Stop object
+        :rtype: Stop
+        :raise: StopNotExist if the Stop is cached as non-existing, StopNotFound if the Stop is not cached,
+                or StopGetterUnavailable if the server is not available
+        """
+        try:
+            result = self._lookup(stopid)
+        except ResourceUnavailable as e:
+            raise StopGetterUnavailable(str(e)) from e
+        if result[0] == "found":
+            return Stop(**result[1])
+        if result[0] == "not_exist":
+            raise StopNotExist(f"Stop {stopid} is cached as non-existing")
+        raise StopNotFound(f"Stop {stopid} not found on shared cache")
+
+    def find_stops(self, stopids: Iterable[int]) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Search many Stops on the shared cache, with a single request.
+        This method is used as a Bulk Getter (StopsGetter) function of PyBuses.
+        :param stopids: IDs of the Stops to search
+        :type stopids: iterable of int
+        :return: dict of the cached Stops by their Stop ID, and set of IDs not cached
+        :rtype: (dict of int: Stop, set of int)
+        :raise: StopGetterUnavailable
+        """
+        stopids = list(stopids)
+        self._discard_prefetched(stopids)
+        try:
+            stops, misses = self._request("find_stops", stopids)
+        except ResourceUnavailable as e:
+            raise StopGetterUnavailable(str(e)) from e
+        found = {stop.stopid: stop for stop in (Stop(**d) for d in stops)}
+        return found, set(misses)
+
+    def check_negative(self, stopid: int):
+        """Raise the exception of the negative result cached for a Stop, if any.
+        The Stop is looked up on the server; when there is no negative result, the lookup result is kept
+        for the next find_stop() of the same Stop.
+        Nothing is raised if the server is not available.
+        :param stopid: ID of the Stop to check
+        :type stopid: int
+        :raise: StopNotExist or StopNotFound if a negative result is cached for the Stop
+        """
+        try:
+            result = self._request("lookup", stopid)
+        except ResourceUnavailable:
+            return
+        if result[0] == "not_exist":
+            raise StopNotExist(f"Stop {stopid} is cached as non-existing")
+        if result[0] == "negative":
+            raise StopNotFound(f"Stop {stopid} is cached as not found")
+        with self._prefetched_lock:
+            self._prefetched[stopid] = (time.monotonic(), result)
+            self._prefetched.move_to_end(stopid)
+            while len(self._prefetched) > _PREFETCH_MAX_SIZE:
+                self._prefetched.popitem(last=False)
+
+    def save_stop(self, stop: Stop, update: bool = True):
+        """Save or update a Stop on the shared cache. Any negative result cached for the Stop is removed.
+        Nothing is done if the server is not available.
+        This method is used as a StopSetter function of PyBuses.
+        :param stop: Stop object to save
+        :param update: if True, when the Stop is currently cached, replace it with the Stop provided (default=True)
+        :type stop: Stop
+        :type update: bool
+        """
+        self.save_stops([stop], update=update)
+
+    def save_stops(self, stops: Iterable[Stop], update: bool = True):
+        """Save or update many Stops on the shared cache, with a single request.
+        Nothing is done if the server is not available.
+        This method is used as a Bulk Setter (StopsSetter) function of PyBuses.
+        :param stops: Stop objects to save
+        :param update: if True, replace the Stops currently cached with the Stops provided (default=True)
+        :type stops: iterable of Stop
+        :type update: bool
+        """
+        stops = list(stops)
+        self._discard_prefetched(stop.stopid for stop in stops)
+        try:
+            self._request("save_stops", [stop.asdict() for stop in stops], update)
+        except ResourceUnavailable:
+            pass
+
+    def save_negative(self, stopid: int, not_exist: bool = True):
+        """Cache a negative result for a Stop. The Stop is removed from the cache, if cached.
+        Nothing is done if the server is not available.
+        :param stopid: ID of the Stop
+        :param not_exist: True if the Stop does not exist (StopNotExist),
+                          False if the Stop might exist but was not found (StopNotFound) (default=True)
+        :type stopid: int
+        :type not_exist: bool
+        """
+        self._discard_prefetched([stopid])
+        try:
+            self._request("save_negative", stopid, not_exist)
+        except ResourceUnavailable:
+            pass
+
+    def delete_stop(self, stopid: int) -> bool:
+        """Delete a Stop from the shared cache, including any negative result cached for it.
+        This method is used as a StopDeleter function of PyBuses.
+        :param stopid: ID of the Stop to delete
+        :type stopid: int
+        :return: True if the Stop was cached, False if not (or if the server is not available)
+        :rtype: bool
+        """
+        self._discard_prefetched([stopid])
+        try:
+            return self._request("delete_stop", stopid)
+        except ResourceUnavailable:
+            return False
+
+    def clear(self):
+        """Remove all the cached Stops and negative results from the shared cache, and reset its counters.
+        :raise: ResourceUnavailable
+        """
+        self._discard_prefetched()
+        self._request("clear")
+
+    def stats(self) -> Dict:
+        """Get the counters of the shared cache (see StopsCache.stats).
+        :return: dict with the keys "hits", "misses", "negative_hits", "size" and "negative_size"
+        :rtype: dict
+        :raise: ResourceUnavailable
+        """
+        return self._request("stats")
+
+    def close(self):
+        """Close the connection to the server of the current thread."""
+        self._disconnect()
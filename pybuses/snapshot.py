@@ -0,0 +1,257 @@
+
+# Native modules
+import os
+import sys
+import json
+import mmap
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from typing import Optional, Dict, Set, Tuple, Iterable, Iterator, Sequence
+# Own modules
+from .assets import Stop, StopGetter, StopsGetter
+from .exceptions import *
+
+"""STRUCTURE OF THE STOPS SNAPSHOT FILE
+Binary file with a Stops catalogue, to be read through mmap without parsing it.
+All the numbers are little-endian. All the sections start on 8-byte boundaries.
+
+Header (48 bytes)
+    magic 8 bytes (b"PYBSNAP\\0")
+    version uint16
+    reserved uint16 + uint32
+    count uint64 (number of Stops, n)
+    created int64 (timestamp when the snapshot was written, Unix/Epoch format and UTC timezone)
+    heap_offset uint64 (position of the string heap on the file)
+    heap_size uint64
+Sections
+    stopids int64[n] (sorted ascending: the ID index, searched with binary search)
+    lats float64[n] (NaN for Stops without location)
+    lons float64[n] (NaN for Stops without location)
+    string offsets uint64[2n+1] (relative to the heap: the name of the Stop i is heap[o[2i]:o[2i+1]],
+                                 and its other data heap[o[2i+1]:o[2i+2]])
+    heap (names as UTF-8; other data as UTF-8 JSON objects, empty when the Stop has no other data)
+
+The file is written to a temporary file and then renamed, so readers never see a partial snapshot.
+"""
+
+__all__ = ["StopSnapshot", "write_snapshot", "SNAPSHOT_VERSION", "SNAPSHOT_MAGIC"]
+
+SNAPSHOT_MAGIC = b"PYBSNAP\0"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct("<8sHHIQqQQ")
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def write_snapshot(path: str, stops: Iterable[Stop]) -> int:
+    """Write a Stops catalogue to a snapshot file, replacing it atomically if it exists.
+    The Stops can be read from any source, e.g. MongoDB.iter_stops() or SQLite.iter_stops().
+    If a Stop ID is repeated, the last Stop with it is kept.
+    :param path: location of the snapshot file
+    :param stops: Stops of the catalogue
+    :type path: str
+    :type stops: iterable of Stop
+    :return: number of Stops written
+    :rtype: int
+    """
+    catalogue: Dict[int, Stop] = {stop.stopid: stop for stop in stops}
+    stopids = array("q", sorted(catalogue))
+    lats, lons, offsets = array("d"), array("d"), array("Q", [0])
+    heap = bytearray()
+    for stopid in stopids:
+        stop = catalogue[stopid]
+        located = stop.has_location()
+        lats.append(stop.lat if located else float("nan"))
+        lons.append(stop.lon if located else float("nan"))
+        heap += stop.name.encode("utf-8")
+        offsets.append(len(heap))
+        if stop.other:
+            heap += json.dumps(stop.other, default=str).encode("utf-8")
+        offsets.append(len(heap))
+
+    sections = [stopids, lats, lons, offsets]
+    if not _LITTLE_ENDIAN:
+        for section in sections:
+            section.byteswap()
+    heap_offset = _HEADER.size + sum(len(section) * section.itemsize for section in sections)
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, 0, len(stopids), int(time.time()), heap_offset, len(heap)
+    )
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(header)
+            for section in sections:
+                section.tofile(file)
+            file.write(heap)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return len(stopids)
+
+
+class StopSnapshot(object):
+    """Read-only Stops catalogue served from a snapshot file (see write_snapshot), mapped on memory.
+
+    Opening a snapshot does not read nor parse the catalogue: Stops are looked up with a binary search on
+    the ID index of the file, and only the pages used are loaded by the OS. The pages are shared through the
+    page cache by all the processes that open the same file.
+    find_stop and find_stops can be used as Stop getter and bulk getter of PyBuses.
+    """
+    def __init__(self, path: str):
+        """Open a snapshot file.
+        :param path: location of the snapshot file
+        :type path: str
+        :raise: InvalidSnapshot or OSError
+        """
+        self.path: str = path
+        with open(path, "rb") as file:
+            try:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:  # empty file
+                raise InvalidSnapshot(f"Invalid Stops snapshot {path}: {e}") from e
+        try:
+            self._open()
+        except InvalidSnapshot:
+            self._mmap.close()
+            raise
+        self.find_stop: StopGetter = self.find_stop  # Set StopGetter data type on this embedded getter
+        self.find_stops: StopsGetter = self.find_stops  # Set StopsGetter data type on this embedded bulk getter
+
+    def _open(self):
+        """Read the header of the snapshot and map its sections.
+        :raise: InvalidSnapshot
+        """
+        if len(self._mmap) < _HEADER.size:
+            raise InvalidSnapshot(f"Invalid Stops snapshot {self.path}: file too short")
+        magic, version, _, _, count, created, heap_offset, heap_size = _HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC:
+            raise InvalidSnapshot(f"Invalid Stops snapshot {self.path}: not a snapshot file")
+        if version != SNAPSHOT_VERSION:
+            raise InvalidSnapshot(f"Unsupported version {version} of Stops snapshot {self.path}")
+        if heap_offset != _HEADER.size + 8 * (5 * count + 1) or heap_offset + heap_size > len(self._mmap):
+            raise InvalidSnapshot(f"Invalid Stops snapshot {self.path}: truncated file")
+        self.count: int = count
+        self.created: int = created
+        self._heap_offset: int = heap_offset
+        self._view = memoryview(self._mmap)
+        position = _HEADER.size
+        self._stopids = self._section(position, count, "q")
+        self._lats = self._section(position + 8 * count, count, "d")
+        self._lons = self._section(position + 16 * count, count, "d")
+        self._offsets = self._section(position + 24 * count, 2 * count + 1, "Q")
+
+    def _section(self, position: int, length: int, typecode: str) -> Sequence:
+        """Map a section of the file as a sequence of numbers.
+        On little-endian systems the section is used directly from the mmap; otherwise it is copied and swapped.
+        """
+        view = self._view[position:position + 8 * length]
+        if _LITTLE_ENDIAN:
+            return view.cast(typecode)
+        section = array(typecode)
+        section.frombytes(view)
+        section.byteswap()
+        return section
+
+    def close(self):
+        """Close the snapshot file. The snapshot can not be used after closing it."""
+        if self._mmap.closed:
+            return
+        for section in (self._stopids, self._lats, self._lons, self._offsets, self._view):
+            if isinstance(section, memoryview):
+                section.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, stopid: int):
+        return self._index_of(stopid) is not None
+
+    def __iter__(self) -> Iterator[Stop]:
+        return self.iter_stops()
+
+    def _index_of(self, stopid: int) -> Optional[int]:
+        """Get the position of a Stop on the snapshot, or None if not on it."""
+        stopid = int(stopid)
+        i = bisect_left(self._stopids, stopid)
+        if i < self.count and self._stopids[i] == stopid:
+            return i
+        return None
+
+    def _stop_at(self, i: int) -> Stop:
+        """Read the Stop at the given position of the snapshot."""
+        name_start, other_start, other_end = self._offsets[2 * i], self._offsets[2 * i + 1], self._offsets[2 * i + 2]
+        heap = self._heap_offset
+        other = None
+        if other_end > other_start:
+            other = json.loads(self._mmap[heap + other_start:heap + other_end])
+        lat, lon = self._lats[i], self._lons[i]
+        if lat != lat or lon != lon:  # NaN
+            lat = lon = None
+        return Stop(
+            stopid=self._stopids[i],
+            name=self._mmap[heap + name_start:heap + other_start].decode("utf-8"),
+            lat=lat,
+            lon=lon,
+            other=other
+        )
+
+    def find_stop(self, stopid: int) -> Stop:
+        """Search a Stop on the snapshot by its Stop ID.
+        This method is used as a Stop Getter (StopGetter) function of PyBuses.
+        :param stopid: ID of the Stop to search
+        :type stopid: int
+        :return: found Stop object
+        :rtype: Stop
+        :raise: StopNotFound
+        """
+        i = self._index_of(stopid)
+        if i is None:
+            raise StopNotFound(f"Stop {stopid} not found on the Stops snapshot")
+        return self._stop_at(i)
+
+    def find_stops(self, stopids: Iterable[int]) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Search many Stops on the snapshot by their Stop IDs.
+        This method is used as a Bulk Getter (StopsGetter) function of PyBuses.
+        :param stopids: IDs of the Stops to search
+        :type stopids: iterable of int
+        :return: dict of the found Stops by their Stop ID, and set of IDs not found on the snapshot
+        :rtype: (dict of int: Stop, set of int)
+        """
+        found: Dict[int, Stop] = dict()
+        misses: Set[int] = set()
+        for stopid in stopids:
+            i = self._index_of(stopid)
+            if i is None:
+                misses.add(int(stopid))
+            else:
+                found[self._stopids[i]] = self._stop_at(i)
+        return found, misses
+
+    def iter_stops(self) -> Iterator[Stop]:
+        """Iterate all the Stops of the snapshot, sorted by Stop ID.
+        :rtype: iterator of Stop
+        """
+        for i in range(self.count):
+            yield self._stop_at(i)
+
+    @property
+    def stopids(self) -> Sequence[int]:
+        """Sorted Stop IDs of the snapshot (read-only view of the ID index).
+        :rtype: sequence of int
+        """
+        return self._stopids
@@ -0,0 +1,285 @@
+
+# Native modules
+from math import floor, cos, radians, degrees
+from threading import Lock
+from typing import Optional, List, Dict, Tuple, Iterable, Union
+# Own modules
+from .assets import Stop, StopSetter, StopDeleter
+from .geo import haversine, bbox_around, EARTH_RADIUS, BoundingBox
+
+__all__ = ["StopSpatialIndex", "DEFAULT_CELL_SIZE"]
+
+DEFAULT_CELL_SIZE = 250
+
+_Cell = Tuple[int, int]
+
+
+class StopSpatialIndex(object):
+    """In-memory spatial index of Stops, to answer nearest-Stops and within-radius queries
+    without scanning all the Stops.
+
+    Stops are bucketed on a grid of cells of approximately cell_size meters, so a query only checks the Stops
+    of the cells around the location. Distances are calculated with the haversine formula.
+    Stops without location are not indexed.
+    The index can be kept up to date registering it on PyBuses with add_stops_index(): it is then updated with
+    every Stop found, saved or deleted through PyBuses. Registering save_stop and delete_stop as Stop setter and
+    deleter is not enough, since PyBuses only uses the first setter that works, unless use_all_stop_setters=True.
+    """
+    def __init__(
+            self,
+            stops: Iterable[Stop] = (),
+            cell_size: Union[int, float] = DEFAULT_CELL_SIZE,
+            ref_lat: Optional[float] = None
+    ):
+        """
+        :param stops: Stops to index initially (default=none)
+        :param cell_size: approximate size of the grid cells, in meters (default=250)
+        :param ref_lat: latitude used to size the cells on the longitude axis
+                        (default=None: latitude of the first Stop indexed)
+        :type stops: iterable of Stop
+        :type cell_size: int or float
+        :type ref_lat: float or None
+        """
+        self.cell_size: Union[int, float] = cell_size
+        self.ref_lat: Optional[float] = None
+        self._cell_lat: float = degrees(cell_size / EARTH_RADIUS)
+        self._cell_lon: float = self._cell_lat
+        self._cells: Dict[_Cell, Dict[int, Stop]] = dict()
+        self._positions: Dict[int, _Cell] = dict()
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+        self._lock = Lock()
+        self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
+        if ref_lat is not None:
+            self._set_ref_lat(ref_lat)
+        for stop in stops:  # type: Stop
+            self.insert(stop)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, stopid: int):
+        return stopid in self._positions
+
+    def _set_ref_lat(self, ref_lat: float):
+        """Set the reference latitude, and the size of the cells on the longitude axis. Only before indexing Stops."""
+        self.ref_lat = ref_lat
+        self._cell_lon = self._cell_lat / max(cos(radians(ref_lat)), 0.01)
+
+    def _cell(self, lat: float, lon: float) -> _Cell:
+        return floor(lat / self._cell_lat), floor(lon / self._cell_lon)
+
+    def insert(self, stop: Stop):
+        """Add a Stop to the index, or replace it if already indexed. Stops without location are removed.
+        :param stop: Stop object
+        :type stop: Stop
+        """
+        with self._lock:
+            self._remove(stop.stopid)
+            if not stop.has_location():
+                return
+            if self.ref_lat is None:
+                self._set_ref_lat(stop.lat)
+            cell = self._cell(stop.lat, stop.lon)
+            self._cells.setdefault(cell, dict())[stop.stopid] = stop
+            self._positions[stop.stopid] = cell
+            if self._bounds is not None:
+                min_lat, min_lon, max_lat, max_lon = self._bounds
+                self._bounds = (
+                    min(min_lat, cell[0]), min(min_lon, cell[1]), max(max_lat, cell[0]), max(max_lon, cell[1])
+                )
+
+    def remove(self, stopid: int) -> bool:
+        """Remove a Stop from the index.
+        :param stopid: ID of the Stop to remove
+        :type stopid: int
+        :return: True if the Stop was indexed, False if not
+        :rtype: bool
+        """
+        with self._lock:
+            return self._remove(stopid)
+
+    def _remove(self, stopid: int) -> bool:
+        """Remove a Stop from the index. Must be called with the lock acquired."""
+        cell = self._positions.pop(stopid, None)
+        if cell is None:
+            return False
+        stops = self._cells[cell]
+        stops.pop(stopid)
+        if not stops:
+            self._cells.pop(cell)
+            self._bounds = None
+        return True
+
+    def save_stop(self, stop: Stop, update: bool = True):
+        """Add a Stop to the index.
+        This method can be used as a StopSetter function of PyBuses.
+        :param stop: Stop object
+        :param update: if True, replace the Stop if currently indexed (default=True)
+        :type stop: Stop
+        :type update: bool
+        """
+        if not update and stop.stopid in self._positions:
+            return
+        self.insert(stop)
+
+    def delete_stop(self, stopid: int) -> bool:
+        """Remove a Stop from the index.
+        This method can be used as a StopDeleter function of PyBuses.
+        :param stopid: ID of the Stop to remove
+        :type stopid: int
+        :return: True if the Stop was indexed, False if not
+        :rtype: bool
+        """
+        return self.remove(stopid)
+
+    def clear(self):
+        """Remove all the Stops from the index."""
+        with self._lock:
+            self._cells.clear()
+            self._positions.clear()
+            self._bounds = None
+
+    def within_bbox(self, bbox: BoundingBox) -> List[Stop]:
+        """Get the Stops located inside a bounding box.
+        :param bbox: bounding box, as (min lat, min lon, max lat, max lon)
+        :type bbox: (float, float, float, float)
+        :return: list of Stops inside the bounding box
+        :rtype: list of Stop
+        """
+        min_lat, min_lon, max_lat, max_lon = bbox
+        return [
+            stop for stop in self._candidates(bbox)
+            if min_lat <= stop.lat <= max_lat and min_lon <= stop.lon <= max_lon
+        ]
+
+    def within_radius(self, lat: float, lon: float, radius_m: Union[int, float]) -> List[Tuple[Stop, float]]:
+        """Get the Stops located at a max distance from a location, sorted by distance.
+        :param lat: latitude of the location
+        :param lon: longitude of the location
+        :param radius_m: max distance to the location, in meters
+        :type lat: float
+        :type lon: float
+        :type radius_m: int or float
+        :return: list of tuples (Stop, distance to the location in meters), nearest first
+        :rtype: list of (Stop, float)
+        """
+        results = list()
+        for stop in self._candidates(bbox_around(lat, lon, radius_m)):  # type: Stop
+            distance = haversine(lat, lon, stop.lat, stop.lon)
+            if distance <= radius_m:
+                results.append((stop, distance))
+        results.sort(key=lambda result: result[1])
+        return results
+
+    def knn(
+            self,
+            lat: float,
+            lon: float,
+            k: int = 1,
+            max_distance: Optional[Union[int, float]] = None
+    ) -> List[Tuple[Stop, float]]:
+        """Get the k Stops nearest to a location, sorted by distance.
+        The cells around the location are checked in rings of increasing size, until no unchecked cell
+        can contain a Stop nearer than the k-th nearest Stop found.
+        :param lat: latitude of the location
+        :param lon: longitude of the location
+        :param k: number of Stops to return (default=1)
+        :param max_distance: if set, max distance to the location, in meters (default=None)
+        :type lat: float
+        :type lon: float
+        :type k: int
+        :type max_distance: int or float or None
+        :return: list of up to k tuples (Stop, distance to the location in meters), nearest first
+        :rtype: list of (Stop, float)
+        """
+        if k <= 0:
+            return []
+        if max_distance is not None:
+            return self.within_radius(lat, lon, max_distance)[:k]
+        with self._lock:
+            if not self._cells:
+                return []
+            center_lat, center_lon = self._cell(lat, lon)
+            min_lat_cell, min_lon_cell, max_lat_cell, max_lon_cell = self._get_bounds()
+            max_ring = max(
+                abs(center_lat - min_lat_cell), abs(center_lat - max_lat_cell),
+                abs(center_lon - min_lon_cell), abs(center_lon - max_lon_cell)
+            )
+            # Rings nearer than the occupied cells are empty
+            min_ring = max(
+                0, min_lat_cell - center_lat, center_lat - max_lat_cell,
+                min_lon_cell - center_lon, center_lon - max_lon_cell
+            )
+            found: List[Tuple[float, Stop]] = list()
+            for ring in range(min_ring, max_ring + 1):
+                if 8 * ring > len(self._cells):
+                    # Rings larger than the occupied cells: check all the Stops not checked yet
+                    found.extend(
+                        (haversine(lat, lon, stop.lat, stop.lon), stop)
+                        for (cell_lat, cell_lon), stops in self._cells.items()
+                        if max(abs(cell_lat - center_lat), abs(cell_lon - center_lon)) >= ring
+                        for stop in stops.values()
+                    )
+                    break
+                for cell in _ring_cells(center_lat, center_lon, ring):
+                    for stop in self._cells.get(cell, {}).values():
+                        found.append((haversine(lat, lon, stop.lat, stop.lon), stop))
+                if len(found) >= k:
+                    found.sort(key=lambda result: result[0])
+                    del found[k:]
+                    if found[-1][0] <= ring * self._min_cell_width(lat, ring):
+                        break
+        found.sort(key=lambda result: result[0])
+        return [(stop, distance) for distance, stop in found[:k]]
+
+    def _get_bounds(self) -> Tuple[int, int, int, int]:
+        """Get the first and last occupied cells on each axis, as (min lat, min lon, max lat, max lon) cells.
+        Must be called with the lock acquired, and with Stops indexed.
+        """
+        if self._bounds is None:
+            self._bounds = (
+                min(cell[0] for cell in self._cells), min(cell[1] for cell in self._cells),
+                max(cell[0] for cell in self._cells), max(cell[1] for cell in self._cells)
+            )
+        return self._bounds
+
+    def _min_cell_width(self, lat: float, ring: int) -> float:
+        """Get the min width, in meters, of the cells up to the given ring around a latitude.
+        Cells are the narrowest on the longitude axis at the highest latitude.
+        """
+        highest_lat = min(abs(lat) + (ring + 1) * self._cell_lat, 90.0)
+        return min(self.cell_size, self._cell_lon / self._cell_lat * self.cell_size * cos(radians(highest_lat)))
+
+    def _candidates(self, bbox: BoundingBox) -> List[Stop]:
+        """Get the Stops of the cells that intersect a bounding box."""
+        min_lat, min_lon, max_lat, max_lon = bbox
+        first_lat, first_lon = self._cell(min_lat, min_lon)
+        last_lat, last_lon = self._cell(max_lat, max_lon)
+        candidates = list()
+        with self._lock:
+            if (last_lat - first_lat + 1) * (last_lon - first_lon + 1) > len(self._cells):
+                # Box larger than the indexed area: check the occupied cells only
+                for (cell_lat, cell_lon), stops in self._cells.items():
+                    if first_lat <= cell_lat <= last_lat and first_lon <= cell_lon <= last_lon:
+                        candidates.extend(stops.values())
+            else:
+                for cell_lat in range(first_lat, last_lat + 1):
+                    for cell_lon in range(first_lon, last_lon + 1):
+                        stops = self._cells.get((cell_lat, cell_lon))
+                        if stops:
+                            candidates.extend(stops.values())
+        return candidates
+
+
+def _ring_cells(center_lat: int, center_lon: int, ring: int) -> Iterable[_Cell]:
+    """Iterate the cells at the given ring (Chebyshev distance) around a center cell."""
+    if ring == 0:
+        yield center_lat, center_lon
+        return
+    for cell_lon in range(center_lon - ring, center_lon + ring + 1):
+        yield center_lat - ring, cell_lon
+        yield center_lat + ring, cell_lon
+    for cell_lat in range(center_lat - ring + 1, center_lat + ring):
+        yield cell_lat, center_lon - ring
+        yield cell_lat, center_lon + ring
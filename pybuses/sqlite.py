@@ -1,14 +1,458 @@
 
 # Native libraries
-# import sqlite3
-# import atexit
-#
-#
-# class SQLite3(object):
-#
-#     def __init__(self, db_location):
-#         self.db_location = db_location
-
-# # #
-# SQLITE3 NOT IMPLEMENTED YET
-# # #
+import atexit
+import json
+import sqlite3
+import time
+from math import pi
+from threading import local, Lock
+from typing import Union, Optional, List, Dict, Set, Tuple, Iterable, Iterator, Any
+# Own modules
+from .assets import Stop, StopGetter, StopsGetter, StopSetter, StopsSetter, StopDeleter
+from .exceptions import *
+from .geo import haversine, bbox_around, BoundingBox, EARTH_RADIUS
+
+"""STRUCTURE OF SQLite DATABASE used by PyBuses
+The database helds Stop data, and the tables used by Google Maps & StreetView modules (see read/write methods)
+
+Table: stops
+    stopid INTEGER PRIMARY KEY
+    name TEXT NOT NULL
+    lat REAL *
+    lon REAL *
+    other TEXT (JSON object, "{}" when empty)
+    saved INTEGER (<dt>)
+    updated INTEGER (<dt>)
+
+Table: stops_location (R*Tree virtual table, with an entry for each Stop with location)
+    stopid INTEGER
+    min_lat, max_lat REAL (both are the lat of the Stop)
+    min_lon, max_lon REAL (both are the lon of the Stop)
+
+<dt> are ints with the timestamp when Stop was saved for first time and updated for last time.
+* these fields are optional, so they are NULL when the Stop has no location.
+Timestamps are saved on Unix/Epoch format, and UTC timezone.
+If the SQLite library does not support R*Tree, the stops_location table is not created, and geospatial queries
+use an index on the lat/lon columns of the stops table.
+"""
+
+__all__ = ["SQLite", "DEFAULT_TIMEOUT", "DEFAULT_DATABASE_PATH", "DEFAULT_BULK_CHUNK_SIZE", "DEFAULT_NEAR_LIMIT"]
+
+DEFAULT_TIMEOUT = 5
+DEFAULT_DATABASE_PATH = "pybuses.sqlite"
+DEFAULT_BULK_CHUNK_SIZE = 500
+DEFAULT_NEAR_LIMIT = 20
+
+# radius (meters) of the first circle searched by find_stops_near() without radius, and max radius (half the globe)
+_NEAR_INITIAL_RADIUS = 1000
+_NEAR_MAX_RADIUS = pi * EARTH_RADIUS + 1
+
+_STOP_COLUMNS = "stopid, name, lat, lon, other"
+_CREATE_STOPS = """CREATE TABLE IF NOT EXISTS stops(
+    stopid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    other TEXT NOT NULL DEFAULT '{}',
+    saved INTEGER NOT NULL,
+    updated INTEGER NOT NULL
+)"""
+_CREATE_STOPS_LOCATION = "CREATE VIRTUAL TABLE IF NOT EXISTS stops_location USING rtree(" \
+                         "stopid, min_lat, max_lat, min_lon, max_lon)"
+_CREATE_STOPS_LATLON_INDEX = "CREATE INDEX IF NOT EXISTS stops_lat_lon ON stops(lat, lon)"
+_INSERT_STOP = f"INSERT OR IGNORE INTO stops ({_STOP_COLUMNS}, saved, updated) VALUES (?,?,?,?,?,?,?)"
+_UPSERT_STOP = f"INSERT INTO stops ({_STOP_COLUMNS}, saved, updated) VALUES (?,?,?,?,?,?,?) " \
+               "ON CONFLICT(stopid) DO UPDATE SET " \
+               "name=excluded.name, lat=excluded.lat, lon=excluded.lon, other=excluded.other, updated=excluded.updated"
+_SELECT_STOP = f"SELECT {_STOP_COLUMNS} FROM stops WHERE stopid=?"
+_DELETE_STOP = "DELETE FROM stops WHERE stopid=?"
+_DELETE_STOP_LOCATION = "DELETE FROM stops_location WHERE stopid=?"
+_SYNC_STOP_LOCATION = "INSERT INTO stops_location SELECT stopid, lat, lat, lon, lon FROM stops " \
+                      "WHERE stopid=? AND lat IS NOT NULL AND lon IS NOT NULL"
+_SELECT_STOPS_WITHIN_RTREE = f"SELECT {', '.join('s.' + c for c in _STOP_COLUMNS.split(', '))} " \
+                             "FROM stops_location l JOIN stops s ON s.stopid = l.stopid " \
+                             "WHERE l.max_lat >= ? AND l.min_lat <= ? AND l.max_lon >= ? AND l.min_lon <= ? " \
+                             "AND s.lat BETWEEN ? AND ? AND s.lon BETWEEN ? AND ?"
+_SELECT_STOPS_WITHIN_INDEX = f"SELECT {_STOP_COLUMNS} FROM stops " \
+                             "WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?"
+
+
+class SQLite(object):
+    def __init__(
+            self,
+            path: str = DEFAULT_DATABASE_PATH,
+            timeout: Union[int, float] = DEFAULT_TIMEOUT
+    ):
+        """Embedded SQLite database, that can be used as Stop getter/setter/deleter, like MongoDB.
+        Each thread uses its own connection to the database, and the database runs on WAL mode,
+        so reads are not blocked by writes. The tables are created when the first connection is opened.
+        :param path: location of the database file (default="pybuses.sqlite")
+        :param timeout: time to wait for a lock held by other connection, in seconds (default=5)
+        :type path: str
+        :type timeout: int or float
+        """
+        self.path: str = path
+        self.timeout: Union[int, float] = timeout
+        self.rtree: Optional[bool] = None
+        self._local = local()
+        self._connections: List[sqlite3.Connection] = list()
+        self._connections_lock = Lock()
+        self.find_stop: StopGetter = self.find_stop  # Set StopGetter data type on this embedded getter
+        self.find_stops: StopsGetter = self.find_stops  # Set StopsGetter data type on this embedded bulk getter
+        self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.save_stops: StopsSetter = self.save_stops  # Set StopsSetter data type on this embedded bulk setter
+        self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
+
+        @atexit.register
+        def atexit_f():
+            self.close()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database of the current thread. It is opened if not opened yet.
+        :rtype: sqlite3.Connection
+        :raise: sqlite3.Error
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self._connections_lock:
+                if self.rtree is None:
+                    self._create_tables(connection)
+                self._connections.append(connection)
+            self._local.connection = connection
+        return connection
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        """Create the Stop tables, if they do not exist, and detect if the R*Tree table is available."""
+        with connection:
+            connection.execute(_CREATE_STOPS)
+            try:
+                connection.execute(_CREATE_STOPS_LOCATION)
+            except sqlite3.OperationalError:
+                # SQLite compiled without R*Tree module
+                connection.execute(_CREATE_STOPS_LATLON_INDEX)
+                self.rtree = False
+            else:
+                self.rtree = True
+
+    def close(self):
+        """Close the connections to the database of all the threads.
+        New connections will be opened when the database is used again.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, list()
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+        self._local = local()
+
+    def read(
+            self,
+            query: str,
+            variables: Any = (),
+            fetchall: bool = True,
+            single_column: bool = False
+    ) -> Any:
+        """Execute a read query on the database (used by Google Maps & StreetView modules).
+        :param query: SQL query to execute
+        :param variables: value or tuple of values of the query placeholders (default=no values)
+        :param fetchall: if True, return all the rows; if False, return the first row only (default=True)
+        :param single_column: if True, return the value of the first column instead of the rows (default=False)
+        :type query: str
+        :type fetchall: bool
+        :type single_column: bool
+        :return: list of rows (or values) if fetchall=True; a single row (or value), or None if no results, if not
+        :raise: sqlite3.Error
+        """
+        cursor = self.connection.execute(query, _variables(variables))
+        if fetchall:
+            rows = cursor.fetchall()
+            return [row[0] for row in rows] if single_column else rows
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0] if single_column else row
+
+    def write(self, query: str, variables: Any = ()) -> int:
+        """Execute a write query on the database (used by Google Maps & StreetView modules), and commit it.
+        :param query: SQL query to execute
+        :param variables: value or tuple of values of the query placeholders (default=no values)
+        :type query: str
+        :return: number of rows modified
+        :rtype: int
+        :raise: sqlite3.Error
+        """
+        with self.connection as connection:
+            return connection.execute(query, _variables(variables)).rowcount
+
+    @staticmethod
+    def curdate() -> int:
+        """Return current datetime in Unix/Epoch format and UTC timezone (used by Google Maps & StreetView modules).
+        :rtype: int
+        """
+        return current_datetime()
+
+    def find_stop(self, stopid: int) -> Stop:
+        """Search a Stop on SQLite database by the StopID.
+        This method is used as a StopGetter function of PyBuses.
+        :param stopid: ID of the Stop to search
+        :type stopid: int
+        :return: found Stop object
+        :rtype: Stop
+        :raise: StopNotFound or StopGetterUnavailable
+        """
+        try:
+            row = self.connection.execute(_SELECT_STOP, (int(stopid),)).fetchone()
+        except sqlite3.Error as e:
+            raise StopGetterUnavailable(f"Error while searching for Stop {stopid} on SQLite: {e}") from e
+        if row is None:
+            raise StopNotFound(f"Stop {stopid} not found on SQLite database")
+        return row_to_stop(row)
+
+    def find_stops(
+            self,
+            stopids: Iterable[int],
+            chunk_size: int = DEFAULT_BULK_CHUNK_SIZE
+    ) -> Tuple[Dict[int, Stop], Set[int]]:
+        """Search many Stops on SQLite database by their StopIDs, using one IN query for each chunk of IDs.
+        This method is used as a Bulk Getter (StopsGetter) function of PyBuses.
+        :param stopids: IDs of the Stops to search
+        :param chunk_size: max number of Stop IDs queried on each query (default=500)
+        :type stopids: iterable of int
+        :type chunk_size: int
+        :return: dict of the found Stops by their Stop ID, and set of IDs not found on database
+        :rtype: (dict of int: Stop, set of int)
+        :raise: StopGetterUnavailable
+        """
+        stopids = list(dict.fromkeys(int(stopid) for stopid in stopids))
+        found: Dict[int, Stop] = dict()
+        try:
+            connection = self.connection
+            for i in range(0, len(stopids), chunk_size):
+                chunk = stopids[i:i+chunk_size]
+                query = f"SELECT {_STOP_COLUMNS} FROM stops WHERE stopid IN ({','.join('?' * len(chunk))})"
+                for row in connection.execute(query, chunk):
+                    stop = row_to_stop(row)
+                    found[stop.stopid] = stop
+        except sqlite3.Error as e:
+            raise StopGetterUnavailable(f"Error while searching for Stops on SQLite: {e}") from e
+        return found, set(stopids) - found.keys()
+
+    def find_stops_near(
+            self,
+            lat: float,
+            lon: float,
+            radius_m: Optional[Union[int, float]] = None,
+            limit: int = DEFAULT_NEAR_LIMIT
+    ) -> List[Tuple[Stop, float]]:
+        """Search the Stops nearest to a location, sorted by distance.
+        The candidates are selected using the R*Tree index. When no radius is given, bounding boxes of
+        increasing size are searched around the location, until enough Stops are found.
+        Only Stops with location are considered.
+        :param lat: latitude of the location
+        :param lon: longitude of the location
+        :param radius_m: if set, max distance to the location, in meters (default=None)
+        :param limit: max number of Stops returned (default=20)
+        :type lat: float
+        :type lon: float
+        :type radius_m: int or float or None
+        :type limit: int
+        :return: list of tuples (Stop, distance to the location in meters), nearest first
+        :rtype: list of (Stop, float)
+        :raise: StopGetterUnavailable
+        """
+        lat, lon = float(lat), float(lon)
+        if limit <= 0:
+            return list()
+        try:
+            if radius_m is not None:
+                results = self._select_near(lat, lon, radius_m)
+            else:
+                # Stops inside the circle are nearer than any Stop outside it, so the search can stop
+                # as soon as the circle has enough Stops
+                radius = _NEAR_INITIAL_RADIUS
+                while True:
+                    results = self._select_near(lat, lon, radius)
+                    if len(results) >= limit or radius >= _NEAR_MAX_RADIUS:
+                        break
+                    radius = min(radius * 4, _NEAR_MAX_RADIUS)
+        except sqlite3.Error as e:
+            raise StopGetterUnavailable(f"Error while searching for Stops near ({lat}, {lon}) on SQLite: {e}") from e
+        results.sort(key=lambda result: result[1])
+        return results[:limit]
+
+    def _select_near(self, lat: float, lon: float, radius_m: Union[int, float]) -> List[Tuple[Stop, float]]:
+        """Select the Stops inside a circle, with their distance to its center (unsorted).
+        :raise: sqlite3.Error
+        """
+        results: List[Tuple[Stop, float]] = list()
+        for row in self._select_within(bbox_around(lat, lon, radius_m)):
+            distance = haversine(lat, lon, row[2], row[3])
+            if distance <= radius_m:
+                results.append((row_to_stop(row), distance))
+        return results
+
+    def find_stops_within(self, bbox: BoundingBox) -> List[Stop]:
+        """Search the Stops located inside a bounding box, using the R*Tree index.
+        Only Stops with location are considered.
+        :param bbox: bounding box, as (min lat, min lon, max lat, max lon)
+        :type bbox: (float, float, float, float)
+        :return: list of Stops inside the bounding box
+        :rtype: list of Stop
+        :raise: StopGetterUnavailable
+        """
+        try:
+            return [row_to_stop(row) for row in self._select_within(bbox)]
+        except sqlite3.Error as e:
+            raise StopGetterUnavailable(f"Error while searching for Stops within {bbox} on SQLite: {e}") from e
+
+    def _select_within(self, bbox: BoundingBox) -> List[Tuple]:
+        """Select the rows of the Stops inside a bounding box.
+        :raise: sqlite3.Error
+        """
+        min_lat, min_lon, max_lat, max_lon = (float(c) for c in bbox)
+        connection = self.connection
+        if self.rtree:
+            # The R*Tree stores 32-bit floats, so its candidates are filtered with the exact coordinates
+            return connection.execute(
+                _SELECT_STOPS_WITHIN_RTREE, (min_lat, max_lat, min_lon, max_lon) * 2
+            ).fetchall()
+        return connection.execute(_SELECT_STOPS_WITHIN_INDEX, (min_lat, max_lat, min_lon, max_lon)).fetchall()
+
+    def iter_stops(self, batch_size: int = DEFAULT_BULK_CHUNK_SIZE) -> Iterator[Stop]:
+        """Iterate all the Stops saved on the database, sorted by Stop ID, fetching the rows in batches.
+        :param batch_size: number of rows fetched on each batch (default=500)
+        :type batch_size: int
+        :return: iterator of the saved Stops
+        :rtype: iterator of Stop
+        :raise: StopGetterUnavailable
+        """
+        try:
+            cursor = self.connection.execute(f"SELECT {_STOP_COLUMNS} FROM stops ORDER BY stopid")
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                for row in rows:
+                    yield row_to_stop(row)
+                rows = cursor.fetchmany(batch_size)
+        except sqlite3.Error as e:
+            raise StopGetterUnavailable(f"Error while reading the Stops from SQLite: {e}") from e
+
+    def is_stop_saved(self, stopid: int) -> bool:
+        """Check if the given Stop is saved on the database.
+        :param stopid: ID of the Stop to search
+        :type stopid: int
+        :return: True if Stop is saved, False if not found on database
+        :rtype: bool
+        :raise: sqlite3.Error
+        """
+        return self.connection.execute("SELECT 1 FROM stops WHERE stopid=?", (int(stopid),)).fetchone() is not None
+
+    def save_stop(self, stop: Stop, update: bool = True):
+        """Save or update a Stop on this SQLite database.
+        If update=True and the stop is currently saved, it will be updated with the Stop provided.
+        This method is used as a StopSetter function of PyBuses.
+        :param stop: Stop object to save
+        :param update: if True, when the Stop to save exists in database, update it with the Stop provided
+        :type stop: Stop
+        :type update: bool
+        :raise: StopSetterUnavailable
+        """
+        try:
+            self._save_stops_chunk([stop], update)
+        except sqlite3.Error as e:
+            raise StopSetterUnavailable(f"Error while saving Stop {stop.stopid} to SQLite: {e}") from e
+
+    def save_stops(self, stops: Iterable[Stop], update: bool = True, chunk_size: int = DEFAULT_BULK_CHUNK_SIZE):
+        """Save or update many Stops on this SQLite database, with the same behaviour as save_stop() for each Stop.
+        Stops are saved with executemany upserts, committing once for each chunk of Stops.
+        This method is used as a Bulk Setter (StopsSetter) function of PyBuses.
+        :param stops: Stop objects to save
+        :param update: if True, when a Stop to save exists in database, update it with the Stop provided
+        :param chunk_size: max number of Stops saved on each transaction (default=500)
+        :type stops: iterable of Stop
+        :type update: bool
+        :type chunk_size: int
+        :raise: StopSetterUnavailable
+        """
+        chunk: List[Stop] = list()
+        try:
+            for stop in stops:  # type: Stop
+                chunk.append(stop)
+                if len(chunk) >= chunk_size:
+                    self._save_stops_chunk(chunk, update)
+                    chunk = list()
+            if chunk:
+                self._save_stops_chunk(chunk, update)
+        except sqlite3.Error as e:
+            raise StopSetterUnavailable(f"Error while saving Stops to SQLite: {e}") from e
+
+    def _save_stops_chunk(self, stops: List[Stop], update: bool):
+        """Save a list of Stops on a single transaction, and update their entries on the R*Tree table.
+        :raise: sqlite3.Error
+        """
+        curtime = current_datetime()
+        rows = [stop_to_row(stop) + (curtime, curtime) for stop in stops]
+        stopids = [(row[0],) for row in rows]
+        with self.connection as connection:
+            connection.executemany(_UPSERT_STOP if update else _INSERT_STOP, rows)
+            if self.rtree:
+                # Location entries are copied from the stops table, so they match the saved data on both modes
+                connection.executemany(_DELETE_STOP_LOCATION, stopids)
+                connection.executemany(_SYNC_STOP_LOCATION, stopids)
+
+    def delete_stop(self, stopid: int) -> bool:
+        """Delete a saved stop from SQLite, and return if the stop was deleted or it did not exist in database.
+        :param stopid: ID of the Stop to delete
+        :type stopid: int
+        :return: True if stop was deleted, False if stop was not deleted (most probably because it was not saved)
+        :rtype: bool
+        :raise: StopDeleterUnavailable
+        """
+        try:
+            with self.connection as connection:
+                deleted = connection.execute(_DELETE_STOP, (int(stopid),)).rowcount
+                if self.rtree:
+                    connection.execute(_DELETE_STOP_LOCATION, (int(stopid),))
+            return bool(deleted)
+        except sqlite3.Error as e:
+            raise StopDeleterUnavailable(f"Error while deleting Stop {stopid} from SQLite: {e}") from e
+
+
+def stop_to_row(stop: Stop) -> Tuple:
+    """Convert a Stop object to a tuple with the values of the stopid, name, lat, lon and other columns.
+    :param stop: Stop object
+    :type stop: Stop
+    :rtype: tuple
+    """
+    return stop.stopid, stop.name, stop.lat, stop.lon, json.dumps(stop.other, default=str)
+
+
+def row_to_stop(row: Tuple) -> Stop:
+    """Convert a row of the stops table, with the stopid, name, lat, lon and other columns, to a Stop object.
+    :param row: tuple with the values of the columns
+    :type row: tuple
+    :return: Stop object
+    :rtype: Stop
+    """
+    stopid, name, lat, lon, other = row
+    return Stop(stopid=stopid, name=name, lat=lat, lon=lon, other=json.loads(other) if other else None)
+
+
+def _variables(variables: Any) -> Tuple:
+    """Get the values of the placeholders of a query as a tuple, given a single value or a tuple/list of values."""
+    if isinstance(variables, (tuple, list)):
+        return tuple(variables)
+    return (variables,)
+
+
+def current_datetime() -> int:
+    """Return current datetime in Unix/Epoch format and UTC timezone.
+    :return: current Unix/Epoch timestamp in UTC timezone, parsed to int
+    :rtype: int
+    """
+    return int(time.time())
@@ -0,0 +1,171 @@
+
+# Native modules
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Optional, List, Dict, Set, Iterable, Tuple
+# Own modules
+from .assets import Stop
+from .crawl import CrawlOutcomes
+
+__all__ = ["StopsSync", "SyncSummary", "stop_fingerprint", "DEFAULT_SYNC_BATCH_SIZE"]
+
+"""STRUCTURE OF THE FINGERPRINTS FILE used by StopsSync
+The fingerprints file is a JSON object, where keys are the Stop IDs (as str)
+and values are the fingerprints of the content of each Stop (see stop_fingerprint).
+"""
+
+DEFAULT_SYNC_BATCH_SIZE = 100
+
+
+def stop_fingerprint(stop: Stop) -> str:
+    """Calculate a fingerprint of the content of a Stop (name, lat, lon and other data).
+    Two Stops with the same content have the same fingerprint.
+    :param stop: Stop object
+    :type stop: Stop
+    :return: fingerprint, as an hex string
+    :rtype: str
+    """
+    content = json.dumps([stop.name, stop.lat, stop.lon, stop.other], sort_keys=True, default=str)
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+class SyncSummary(object):
+    """Summary of the changes detected by a StopsSync."""
+    def __init__(self):
+        self.added: List[int] = list()
+        self.changed: List[int] = list()
+        self.unchanged: int = 0
+        self.vanished: List[int] = list()
+        self.save_errors: List[int] = list()
+
+    def asdict(self) -> Dict:
+        """Return the summary as a dict, with the number of Stops of each kind of change.
+        :rtype: dict
+        """
+        return {
+            "added": len(self.added),
+            "changed": len(self.changed),
+            "unchanged": self.unchanged,
+            "vanished": len(self.vanished),
+            "save_errors": len(self.save_errors)
+        }
+
+    def __repr__(self):
+        return "SyncSummary(" + ", ".join(f"{k}={v}" for k, v in self.asdict().items()) + ")"
+
+
+class StopsSync(object):
+    """Incremental synchronization of the Stops found on a crawl.
+    A fingerprint of the content of each Stop is kept, so only Stops that are new or changed since
+    the last sync are saved, in batches. Stops previously known that are now reported as non-existing
+    are reported as vanished (they are not deleted).
+    Fingerprints can be persisted on a local file, to be used on the next sync.
+    """
+    def __init__(self, path: Optional[str] = None, batch_size: int = DEFAULT_SYNC_BATCH_SIZE):
+        """The fingerprints file is loaded if exists.
+        :param path: location of the fingerprints file (default=None: keep fingerprints on memory only)
+        :param batch_size: number of changed Stops saved together (default=100)
+        :type path: str or None
+        :type batch_size: int
+        """
+        self.path: Optional[str] = path
+        self.batch_size: int = max(batch_size, 1)
+        self.fingerprints: Dict[int, str] = dict()
+        self.summary: SyncSummary = SyncSummary()
+        self._pending: List[Stop] = list()
+        self._lock = Lock()
+        self.load()
+
+    def load(self):
+        """Load the fingerprints file, if exists."""
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.fingerprints = {int(k): v for k, v in data.items()}
+
+    def save(self):
+        """Save the fingerprints file, if a path was given. The file is replaced atomically."""
+        if self.path is None:
+            return
+        with self._lock:
+            data = {str(k): v for k, v in self.fingerprints.items()}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def reset_summary(self):
+        """Start a new summary of changes."""
+        with self._lock:
+            self.summary = SyncSummary()
+
+    def is_changed(self, stop: Stop) -> bool:
+        """Check if a Stop is new or changed since the last sync, so process() will queue it to be saved.
+        :param stop: Stop object
+        :type stop: Stop
+        :rtype: bool
+        """
+        fingerprint = stop_fingerprint(stop)
+        with self._lock:
+            return self.fingerprints.get(stop.stopid) != fingerprint
+
+    def process(self, stopid: int, outcome: str, stop: Optional[Stop]) -> List[Stop]:
+        """Register the outcome of searching a Stop ID on a crawl.
+        New or changed Stops are queued to be saved. When enough Stops are queued, the batch is returned,
+        and must be saved by the caller, who then must call commit().
+        :param stopid: Stop ID searched
+        :param outcome: one of the CrawlOutcomes
+        :param stop: Stop found, or None if not found
+        :type stopid: int
+        :type outcome: str
+        :type stop: Stop or None
+        :return: list of Stops to save now (empty list if nothing to save yet)
+        :rtype: list of Stop
+        """
+        with self._lock:
+            if outcome == CrawlOutcomes.FOUND:
+                if self.fingerprints.get(stopid) == stop_fingerprint(stop):
+                    self.summary.unchanged += 1
+                else:
+                    self._pending.append(stop)
+                    if len(self._pending) >= self.batch_size:
+                        batch, self._pending = self._pending, list()
+                        return batch
+            elif outcome == CrawlOutcomes.NOT_EXIST and stopid in self.fingerprints:
+                self.fingerprints.pop(stopid)
+                self.summary.vanished.append(stopid)
+        return []
+
+    def drain(self) -> List[Stop]:
+        """Get all the Stops queued to be saved. They must be saved by the caller, who then must call commit().
+        :rtype: list of Stop
+        """
+        with self._lock:
+            batch, self._pending = self._pending, list()
+        return batch
+
+    def commit(self, batch: Iterable[Stop], failed: Iterable[Stop] = ()):
+        """Register the result of saving a batch of Stops. Fingerprints of the saved Stops are updated.
+        :param batch: Stops that were tried to be saved
+        :param failed: Stops of the batch that could not be saved (default=none)
+        :type batch: iterable of Stop
+        :type failed: iterable of Stop
+        """
+        failed_ids: Set[int] = {stop.stopid for stop in failed}
+        with self._lock:
+            for stop in batch:  # type: Stop
+                if stop.stopid in failed_ids:
+                    self.summary.save_errors.append(stop.stopid)
+                    continue
+                if stop.stopid in self.fingerprints:
+                    self.summary.changed.append(stop.stopid)
+                else:
+                    self.summary.added.append(stop.stopid)
+                self.fingerprints[stop.stopid] = stop_fingerprint(stop)
@@ -0,0 +1,398 @@
+
+# Native modules
+import sys
+import sqlite3
+from array import array
+from typing import Optional, List, Dict, Tuple, Sequence, Iterable, Iterator, Union, Any
+# Installed libraries
+from pymongo.errors import PyMongoError
+# Installed libraries (optional)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# Own modules
+from .assets import Stop, StopGetter
+from .exceptions import *
+from .geo import haversine_many, BoundingBox
+
+__all__ = ["StopTable", "TABLE_COLUMNS", "DEFAULT_CURSOR_BATCH_SIZE"]
+
+"""Columns of a StopTable: Stop IDs (int64), names (interned str), latitudes and longitudes (float64).
+Stops without location have NaN latitude and longitude.
+Numeric columns are NumPy arrays when NumPy is available, or array.array objects if not;
+the name column is a NumPy object array, or a list.
+Masks (used by filter) and indices (used by take) can be NumPy arrays or sequences of bool/int."""
+TABLE_COLUMNS = ("stopid", "name", "lat", "lon")
+
+# number of documents/rows fetched on each batch when reading a table from a database cursor
+DEFAULT_CURSOR_BATCH_SIZE = 5000
+
+_NAN = float("nan")
+Column = Union[Sequence, Any]
+
+
+class StopTable(object):
+    """Columnar table of Stops, for catalogue-wide operations (exports, geo analytics, diffs) without
+    materializing a Stop object for each Stop.
+
+    The table holds the stopid, name, lat and lon columns (the "other" data of the Stops is not kept).
+    Operations return new tables, that share the name strings with the original one. When NumPy is available,
+    filtering, sorting and selection by ID run vectorized over the columns.
+    """
+    def __init__(
+            self,
+            stopids: Iterable[int] = (),
+            names: Iterable[str] = (),
+            lats: Iterable[Optional[float]] = (),
+            lons: Iterable[Optional[float]] = ()
+    ):
+        """Create a table from its columns, that must have the same length.
+        Null (None) latitudes/longitudes are stored as NaN. Names are interned, so repeated names are stored once.
+        :param stopids: column of Stop IDs
+        :param names: column of Stop names
+        :param lats: column of latitudes (None or NaN for Stops without location)
+        :param lons: column of longitudes (None or NaN for Stops without location)
+        :type stopids: iterable of int
+        :type names: iterable of str
+        :type lats: iterable of float or None
+        :type lons: iterable of float or None
+        :raise: ValueError if the columns have different lengths
+        """
+        self.stopids: Column = _int_column(stopids)
+        self.names: Column = _str_column(sys.intern(name) for name in names)
+        self.lats: Column = _float_column(_NAN if lat is None else lat for lat in lats)
+        self.lons: Column = _float_column(_NAN if lon is None else lon for lon in lons)
+        if not len(self.stopids) == len(self.names) == len(self.lats) == len(self.lons):
+            raise ValueError("All the columns of a StopTable must have the same length")
+        self._order: Optional[Column] = None
+        self.find_stop: StopGetter = self.find_stop  # Set StopGetter data type on this embedded getter
+
+    @classmethod
+    def _from_columns(cls, stopids: Column, names: Column, lats: Column, lons: Column) -> "StopTable":
+        """Create a table sharing the given columns, that must be valid columns of a StopTable."""
+        table = cls.__new__(cls)
+        table.stopids, table.names, table.lats, table.lons = stopids, names, lats, lons
+        table._order = None
+        table.find_stop = table.find_stop
+        return table
+
+    @classmethod
+    def from_stops(cls, stops: Iterable[Stop]) -> "StopTable":
+        """Create a table from Stop objects.
+        :param stops: Stop objects
+        :type stops: iterable of Stop
+        :rtype: StopTable
+        """
+        return cls.from_rows((stop.stopid, stop.name, stop.lat, stop.lon) for stop in stops)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence]) -> "StopTable":
+        """Create a table from rows (tuples) of (stopid, name, lat, lon), like the ones returned by a
+        cursor of the SQLite database. Additional items of the rows are ignored.
+        :param rows: rows of Stop data
+        :type rows: iterable of tuple
+        :rtype: StopTable
+        """
+        stopids, names, lats, lons = list(), list(), list(), list()
+        for row in rows:
+            stopids.append(int(row[0]))
+            names.append(row[1])
+            lats.append(row[2])
+            lons.append(row[3])
+        return cls(stopids, names, lats, lons)
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Dict]) -> "StopTable":
+        """Create a table from Stop documents, like the ones returned by a cursor of the MongoDB database
+        (with at least "_id" and "name" keys).
+        :param documents: Stop documents
+        :type documents: iterable of dict
+        :rtype: StopTable
+        """
+        return cls.from_rows(
+            (document["_id"], document["name"], document.get("lat"), document.get("lon")) for document in documents
+        )
+
+    @classmethod
+    def from_sqlite(cls, db) -> "StopTable":
+        """Read all the Stops saved on a SQLite database into a table.
+        :param db: SQLite database
+        :type db: pybuses.SQLite
+        :rtype: StopTable
+        :raise: StopGetterUnavailable
+        """
+        try:
+            return cls.from_rows(db.connection.execute("SELECT stopid, name, lat, lon FROM stops"))
+        except sqlite3.Error as e:
+            raise StopGetterUnavailable(f"Error while reading the Stops from SQLite: {e}") from e
+
+    @classmethod
+    def from_mongodb(cls, db, batch_size: int = DEFAULT_CURSOR_BATCH_SIZE) -> "StopTable":
+        """Read all the Stops saved on a MongoDB database into a table.
+        Only the fields of the table are fetched.
+        :param db: MongoDB database
+        :param batch_size: number of documents fetched on each batch of the cursor (default=5000)
+        :type db: pybuses.MongoDB
+        :type batch_size: int
+        :rtype: StopTable
+        :raise: StopGetterUnavailable
+        """
+        try:
+            db.check_available()
+            cursor = db.documents.find({}, {"name": True, "lat": True, "lon": True}, batch_size=batch_size)
+            return cls.from_documents(cursor)
+        except PyMongoError as e:
+            db._report_failure(e)
+            raise StopGetterUnavailable(f"Error while reading the Stops from MongoDB: {e}") from e
+
+    def __len__(self):
+        return len(self.stopids)
+
+    def __contains__(self, stopid: int):
+        return self._index_of(stopid) is not None
+
+    def __iter__(self) -> Iterator[Stop]:
+        return self.iter_stops()
+
+    def __repr__(self):
+        return f"StopTable({len(self)} Stops)"
+
+    def iter_stops(self) -> Iterator[Stop]:
+        """Iterate the Stops of the table, as Stop objects.
+        :rtype: iterator of Stop
+        """
+        for stopid, name, lat, lon in self.iter_rows():
+            yield Stop(stopid=stopid, name=name, lat=lat, lon=lon)
+
+    def to_stops(self) -> List[Stop]:
+        """Get the Stops of the table, as Stop objects.
+        :rtype: list of Stop
+        """
+        return list(self.iter_stops())
+
+    def iter_rows(self) -> Iterator[Tuple[int, str, Optional[float], Optional[float]]]:
+        """Iterate the rows of the table, as tuples of (stopid, name, lat, lon), with lat/lon None for Stops
+        without location.
+        :rtype: iterator of (int, str, float or None, float or None)
+        """
+        for stopid, name, lat, lon in zip(_tolist(self.stopids), _tolist(self.names),
+                                          _tolist(self.lats), _tolist(self.lons)):
+            if lat != lat or lon != lon:  # NaN
+                lat = lon = None
+            yield stopid, name, lat, lon
+
+    def to_dicts(self) -> List[Dict]:
+        """Get the Stops of the table as dicts, with the same format as Stop.asdict (without "other").
+        :rtype: list of dict
+        """
+        return [
+            {"stopid": stopid, "name": name, "lat": lat, "lon": lon} if lat is not None
+            else {"stopid": stopid, "name": name}
+            for stopid, name, lat, lon in self.iter_rows()
+        ]
+
+    def take(self, indices: Column) -> "StopTable":
+        """Get a table with the rows at the given positions, in the given order.
+        :param indices: positions of the rows
+        :type indices: sequence of int or NumPy array
+        :rtype: StopTable
+        """
+        if numpy is not None:
+            indices = numpy.asarray(indices, dtype=numpy.int64)
+            return self._from_columns(self.stopids[indices], self.names[indices],
+                                      self.lats[indices], self.lons[indices])
+        indices = list(indices)
+        return self._from_columns(
+            array("q", (self.stopids[i] for i in indices)), [self.names[i] for i in indices],
+            array("d", (self.lats[i] for i in indices)), array("d", (self.lons[i] for i in indices))
+        )
+
+    def filter(self, mask: Column) -> "StopTable":
+        """Get a table with the rows where the mask is True.
+        :param mask: a bool for each row of the table, e.g. table.lats > 42.2 (with NumPy)
+        :type mask: sequence of bool or NumPy array
+        :rtype: StopTable
+        """
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=bool)
+            if len(mask) != len(self):
+                raise ValueError("The mask must have the same length as the table")
+            return self.take(numpy.flatnonzero(mask))
+        mask = list(mask)
+        if len(mask) != len(self):
+            raise ValueError("The mask must have the same length as the table")
+        return self.take(i for i, selected in enumerate(mask) if selected)
+
+    def sort(self, by: str = "stopid", reverse: bool = False) -> "StopTable":
+        """Get a table with the rows sorted by one of the columns. The sort is stable; Stops without location
+        go last when sorting by lat/lon.
+        :param by: name of the column: "stopid", "name", "lat" or "lon" (default="stopid")
+        :param reverse: if True, sort in descending order (default=False)
+        :type by: str
+        :type reverse: bool
+        :rtype: StopTable
+        :raise: ValueError if the column does not exist
+        """
+        column = self._column(by)
+        if numpy is not None:
+            keys = column if by != "name" else column.astype(str)
+            if reverse:
+                # Reverse the rows before sorting and the result after, to keep the sort stable
+                order = len(self) - 1 - numpy.argsort(keys[::-1], kind="stable")[::-1]
+                if by in ("lat", "lon"):
+                    nan = numpy.isnan(column[order])
+                    order = numpy.concatenate((order[~nan], order[nan]))
+            else:
+                order = numpy.argsort(keys, kind="stable")
+            return self.take(order)
+        if by in ("lat", "lon"):
+            located = [i for i in range(len(self)) if column[i] == column[i]]
+            located.sort(key=column.__getitem__, reverse=reverse)
+            return self.take(located + [i for i in range(len(self)) if column[i] != column[i]])
+        return self.take(sorted(range(len(self)), key=column.__getitem__, reverse=reverse))
+
+    def select(self, stopids: Iterable[int]) -> "StopTable":
+        """Get a table with the Stops with the given IDs, in the given order. IDs not on the table are ignored.
+        :param stopids: IDs of the Stops to select
+        :type stopids: iterable of int
+        :rtype: StopTable
+        """
+        if numpy is not None:
+            stopids = numpy.fromiter((int(stopid) for stopid in stopids), dtype=numpy.int64)
+            if not len(self):
+                return self.take([])
+            order = self._get_order()
+            positions = numpy.minimum(numpy.searchsorted(self.stopids, stopids, sorter=order), len(order) - 1)
+            indices = order[positions]
+            return self.take(indices[self.stopids[indices] == stopids])
+        indices = (self._index_of(stopid) for stopid in stopids)
+        return self.take([i for i in indices if i is not None])
+
+    def find_stop(self, stopid: int) -> Stop:
+        """Get a Stop of the table by its ID.
+        This method can be used as a StopGetter function of PyBuses.
+        :param stopid: ID of the Stop
+        :type stopid: int
+        :return: Stop object
+        :rtype: Stop
+        :raise: StopNotFound
+        """
+        i = self._index_of(stopid)
+        if i is None:
+            raise StopNotFound(f"Stop {stopid} not found on the StopTable")
+        lat, lon = float(self.lats[i]), float(self.lons[i])
+        if lat != lat or lon != lon:  # NaN
+            lat = lon = None
+        return Stop(stopid=int(self.stopids[i]), name=self.names[i], lat=lat, lon=lon)
+
+    def has_location(self) -> Column:
+        """Get a mask of the Stops that have location, to be used with filter.
+        :return: a bool for each row of the table
+        :rtype: NumPy array or list of bool
+        """
+        if numpy is not None:
+            return ~(numpy.isnan(self.lats) | numpy.isnan(self.lons))
+        return [lat == lat and lon == lon for lat, lon in zip(self.lats, self.lons)]
+
+    def within_bbox(self, bbox: BoundingBox) -> "StopTable":
+        """Get a table with the Stops located inside a bounding box.
+        :param bbox: bounding box, as (min lat, min lon, max lat, max lon)
+        :type bbox: (float, float, float, float)
+        :rtype: StopTable
+        """
+        min_lat, min_lon, max_lat, max_lon = bbox
+        if numpy is not None:
+            return self.filter(
+                (self.lats >= min_lat) & (self.lats <= max_lat) & (self.lons >= min_lon) & (self.lons <= max_lon)
+            )
+        return self.filter(min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+                           for lat, lon in zip(self.lats, self.lons))
+
+    def distances(self, lat: float, lon: float) -> Column:
+        """Get the distance from a location to each Stop of the table (NaN for Stops without location).
+        :param lat: latitude of the location
+        :param lon: longitude of the location
+        :type lat: float
+        :type lon: float
+        :return: distance to each Stop, in meters
+        :rtype: NumPy array or list of float
+        """
+        return haversine_many(lat, lon, self.lats, self.lons)
+
+    def within_radius(self, lat: float, lon: float, radius_m: Union[int, float]) -> "StopTable":
+        """Get a table with the Stops located at a max distance from a location, sorted by distance.
+        :param lat: latitude of the location
+        :param lon: longitude of the location
+        :param radius_m: max distance to the location, in meters
+        :type lat: float
+        :type lon: float
+        :type radius_m: int or float
+        :rtype: StopTable
+        """
+        distances = self.distances(lat, lon)
+        if numpy is not None:
+            inside = numpy.flatnonzero(distances <= radius_m)
+            return self.take(inside[numpy.argsort(distances[inside], kind="stable")])
+        inside = [i for i, distance in enumerate(distances) if distance <= radius_m]
+        inside.sort(key=distances.__getitem__)
+        return self.take(inside)
+
+    def _column(self, name: str) -> Column:
+        """Get a column by its name.
+        :raise: ValueError if the column does not exist
+        """
+        try:
+            return getattr(self, {"stopid": "stopids", "name": "names", "lat": "lats", "lon": "lons"}[name])
+        except KeyError:
+            raise ValueError(f"Unknown column {name} (available columns: {', '.join(TABLE_COLUMNS)})")
+
+    def _get_order(self) -> Column:
+        """Get the positions of the rows sorted by Stop ID (calculated once and kept).
+        With NumPy, an array of positions; without it, a dict of positions by Stop ID.
+        """
+        if self._order is None:
+            if numpy is not None:
+                self._order = numpy.argsort(self.stopids, kind="stable")
+            else:
+                order = dict()
+                for i, stopid in enumerate(self.stopids):
+                    order.setdefault(stopid, i)
+                self._order = order
+        return self._order
+
+    def _index_of(self, stopid: int) -> Optional[int]:
+        """Get the position of the row of a Stop, or None if not on the table."""
+        stopid = int(stopid)
+        order = self._get_order()
+        if numpy is None:
+            return order.get(stopid)
+        position = int(numpy.searchsorted(self.stopids, stopid, sorter=order))
+        if position < len(order) and self.stopids[order[position]] == stopid:
+            return int(order[position])
+        return None
+
+
+def _int_column(values: Iterable[int]) -> Column:
+    if numpy is not None:
+        return numpy.fromiter(values, dtype=numpy.int64)
+    return array("q", values)
+
+
+def _float_column(values: Iterable[float]) -> Column:
+    if numpy is not None:
+        return numpy.fromiter(values, dtype=float)
+    return array("d", values)
+
+
+def _str_column(values: Iterable[str]) -> Column:
+    if numpy is not None:
+        values = list(values)
+        column = numpy.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+    return list(values)
+
+
+def _tolist(column: Column) -> List:
+    return column if isinstance(column, list) else column.tolist()
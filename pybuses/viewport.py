@@ -0,0 +1,245 @@
+
+# Native modules
+from math import floor, log, tan, cos, pi, radians
+from threading import Lock
+from typing import List, Dict, Set, Tuple, Iterable, Union
+# Own modules
+from .assets import Stop, StopSetter, StopDeleter
+from .geo import BoundingBox
+from .spatial import StopSpatialIndex
+
+__all__ = [
+    "StopsViewport", "StopCluster",
+    "DEFAULT_MIN_ZOOM", "DEFAULT_MAX_CLUSTER_ZOOM", "DEFAULT_CLUSTER_SIZE", "TILE_SIZE"
+]
+
+DEFAULT_MIN_ZOOM = 0
+DEFAULT_MAX_CLUSTER_ZOOM = 15
+DEFAULT_CLUSTER_SIZE = 64
+TILE_SIZE = 256
+_MAX_LAT = 85.05112878
+
+_Cell = Tuple[int, int]
+
+
+class StopCluster(object):
+    """A group of Stops close between them at a certain zoom level, shown as a single point on a map."""
+    def __init__(self, lat: float, lon: float, count: int, zoom: int):
+        """
+        :param lat: latitude of the cluster (mean latitude of its Stops)
+        :param lon: longitude of the cluster (mean longitude of its Stops)
+        :param count: number of Stops of the cluster
+        :param zoom: zoom level of the cluster
+        """
+        self.lat: float = lat
+        self.lon: float = lon
+        self.count: int = count
+        self.zoom: int = zoom
+
+    def asdict(self) -> Dict:
+        """Return the data of this cluster as a dict.
+        :rtype: dict
+        """
+        return {"lat": self.lat, "lon": self.lon, "count": self.count, "zoom": self.zoom}
+
+    def __repr__(self):
+        return f"StopCluster(lat={self.lat}, lon={self.lon}, count={self.count}, zoom={self.zoom})"
+
+
+class _Cluster(object):
+    """Cluster being built on a cell of the pyramid: sums of the coordinates and IDs of its Stops."""
+    __slots__ = ("sum_lat", "sum_lon", "stopids")
+
+    def __init__(self):
+        self.sum_lat: float = 0.0
+        self.sum_lon: float = 0.0
+        self.stopids: Set[int] = set()
+
+
+class StopsViewport(object):
+    """Viewport queries over a Stops catalogue, for map clients.
+
+    A pyramid of clusters is precomputed for each zoom level, grouping the Stops on a grid of cells of
+    cluster_size pixels (on the Web Mercator projection used by map tiles). At zoom levels up to max_cluster_zoom,
+    stops_in_bbox() returns one point per occupied cell: a StopCluster when it has many Stops, or the Stop itself.
+    At higher zoom levels, the individual Stops are returned.
+    The pyramid is updated incrementally when Stops are saved or deleted: register the viewport on PyBuses with
+    add_stops_index() to update it with every Stop found, saved or deleted through PyBuses (registering save_stop
+    and delete_stop as Stop setter/deleter is not enough, since PyBuses only uses the first setter that works,
+    unless use_all_stop_setters=True). Stops without location are ignored.
+    """
+    def __init__(
+            self,
+            stops: Iterable[Stop] = (),
+            min_zoom: int = DEFAULT_MIN_ZOOM,
+            max_cluster_zoom: int = DEFAULT_MAX_CLUSTER_ZOOM,
+            cluster_size: int = DEFAULT_CLUSTER_SIZE
+    ):
+        """
+        :param stops: Stops of the catalogue (default=none)
+        :param min_zoom: lowest zoom level of the pyramid (default=0)
+        :param max_cluster_zoom: highest zoom level where Stops are clustered (default=15)
+        :param cluster_size: size of the cluster cells, in pixels (default=64)
+        :type stops: iterable of Stop
+        :type min_zoom: int
+        :type max_cluster_zoom: int
+        :type cluster_size: int
+        """
+        self.min_zoom: int = min_zoom
+        self.max_cluster_zoom: int = max_cluster_zoom
+        self.cluster_size: int = cluster_size
+        self.index: StopSpatialIndex = StopSpatialIndex()
+        self._levels: Dict[int, Dict[_Cell, _Cluster]] = {
+            zoom: dict() for zoom in range(min_zoom, max_cluster_zoom + 1)
+        }
+        self._stops: Dict[int, Stop] = dict()
+        self._locations: Dict[int, Tuple[float, float, float, float]] = dict()
+        self._lock = Lock()
+        self.save_stop: StopSetter = self.save_stop  # Set StopSetter data type on this embedded setter
+        self.delete_stop: StopDeleter = self.delete_stop  # Set StopDeleter data type on this embedded deleter
+        for stop in stops:  # type: Stop
+            self.insert(stop)
+
+    def __len__(self):
+        return len(self._stops)
+
+    def _cell(self, lat: float, lon: float, zoom: int) -> _Cell:
+        """Get the cell of the grid of a zoom level where a location is."""
+        return self._projected_cell(*_mercator(lat, lon), zoom)
+
+    def _projected_cell(self, x: float, y: float, zoom: int) -> _Cell:
+        """Get the cell of the grid of a zoom level where a location, projected with _mercator, is."""
+        scale = TILE_SIZE * 2**zoom / self.cluster_size
+        return floor(x * scale), floor(y * scale)
+
+    def insert(self, stop: Stop):
+        """Add a Stop to the catalogue, or replace it if already added. Stops without location are removed.
+        :param stop: Stop object
+        :type stop: Stop
+        """
+        with self._lock:
+            self._remove(stop.stopid)
+            if not stop.has_location():
+                return
+            self._stops[stop.stopid] = stop
+            # The location is kept, to find the cells of the Stop when it is removed
+            x, y = _mercator(stop.lat, stop.lon)
+            self._locations[stop.stopid] = (x, y, stop.lat, stop.lon)
+            for zoom, cells in self._levels.items():
+                cell = self._projected_cell(x, y, zoom)
+                cluster = cells.get(cell)
+                if cluster is None:
+                    cluster = cells[cell] = _Cluster()
+                cluster.sum_lat += stop.lat
+                cluster.sum_lon += stop.lon
+                cluster.stopids.add(stop.stopid)
+            self.index.insert(stop)
+
+    def remove(self, stopid: int) -> bool:
+        """Remove a Stop from the catalogue.
+        :param stopid: ID of the Stop to remove
+        :type stopid: int
+        :return: True if the Stop was on the catalogue, False if not
+        :rtype: bool
+        """
+        with self._lock:
+            return self._remove(stopid)
+
+    def _remove(self, stopid: int) -> bool:
+        """Remove a Stop from the catalogue. Must be called with the lock acquired."""
+        stop = self._stops.pop(stopid, None)
+        if stop is None:
+            return False
+        x, y, lat, lon = self._locations.pop(stopid)
+        for zoom, cells in self._levels.items():
+            cell = self._projected_cell(x, y, zoom)
+            cluster = cells[cell]
+            cluster.stopids.discard(stopid)
+            if not cluster.stopids:
+                cells.pop(cell)
+            else:
+                cluster.sum_lat -= lat
+                cluster.sum_lon -= lon
+        self.index.remove(stopid)
+        return True
+
+    def save_stop(self, stop: Stop, update: bool = True):
+        """Add a Stop to the catalogue.
+        This method can be used as a StopSetter function of PyBuses.
+        :param stop: Stop object
+        :param update: if True, replace the Stop if currently on the catalogue (default=True)
+        :type stop: Stop
+        :type update: bool
+        """
+        if not update and stop.stopid in self._stops:
+            return
+        self.insert(stop)
+
+    def delete_stop(self, stopid: int) -> bool:
+        """Remove a Stop from the catalogue.
+        This method can be used as a StopDeleter function of PyBuses.
+        :param stopid: ID of the Stop to remove
+        :type stopid: int
+        :return: True if the Stop was on the catalogue, False if not
+        :rtype: bool
+        """
+        return self.remove(stopid)
+
+    def stops_in_bbox(self, bbox: BoundingBox, zoom: Union[int, float]) -> List[Union[Stop, StopCluster]]:
+        """Get the points to show on a map viewport: clusters of Stops at low zoom levels, and Stops at high levels.
+        Clusters are returned for the cells of the pyramid that intersect the viewport; a cluster with a single Stop
+        is returned as the Stop itself.
+        A viewport that crosses the antimeridian is given with a min longitude greater than its max longitude
+        (e.g. min lon=170, max lon=-170), and is queried as the two boxes at each side of the antimeridian.
+        :param bbox: bounding box of the viewport, as (min lat, min lon, max lat, max lon)
+        :param zoom: zoom level of the viewport (fractional levels are rounded down)
+        :type bbox: (float, float, float, float)
+        :type zoom: int or float
+        :return: list of Stops and StopClusters
+        :rtype: list of Stop or StopCluster
+        """
+        min_lat, min_lon, max_lat, max_lon = bbox
+        if min_lon > max_lon:
+            # The viewport crosses the antimeridian: query the boxes at each side of it
+            boxes = [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+        else:
+            boxes = [bbox]
+        zoom = max(int(zoom), self.min_zoom)
+        if zoom > self.max_cluster_zoom:
+            return [stop for box in boxes for stop in self.index.within_bbox(box)]
+
+        results: List[Union[Stop, StopCluster]] = list()
+        with self._lock:
+            cells = self._levels[zoom]
+            # Both sides of the antimeridian might share cells at low zoom levels, so selected cells are deduplicated
+            selected: Dict[_Cell, _Cluster] = dict()
+            for box_min_lat, box_min_lon, box_max_lat, box_max_lon in boxes:
+                # Mercator y grows southwards: the first row of cells is on the max latitude
+                first_x, first_y = self._cell(box_max_lat, box_min_lon, zoom)
+                last_x, last_y = self._cell(box_min_lat, box_max_lon, zoom)
+                if (last_x - first_x + 1) * (last_y - first_y + 1) > len(cells):
+                    selected.update(
+                        ((x, y), cluster) for (x, y), cluster in cells.items()
+                        if first_x <= x <= last_x and first_y <= y <= last_y
+                    )
+                else:
+                    selected.update(
+                        ((x, y), cells[(x, y)]) for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1)
+                        if (x, y) in cells
+                    )
+            for cluster in selected.values():  # type: _Cluster
+                count = len(cluster.stopids)
+                if count == 1:
+                    results.append(self._stops[next(iter(cluster.stopids))])
+                else:
+                    results.append(StopCluster(
+                        lat=cluster.sum_lat / count, lon=cluster.sum_lon / count, count=count, zoom=zoom
+                    ))
+        return results
+
+def _mercator(lat: float, lon: float) -> Tuple[float, float]:
+    """Project a location to Web Mercator coordinates, normalized between 0 and 1 (x from west, y from north)."""
+    lat = radians(max(min(lat, _MAX_LAT), -_MAX_LAT))
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - log(tan(lat) + 1.0 / cos(lat)) / pi) / 2.0
+    return x, y
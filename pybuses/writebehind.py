@@ -0,0 +1,265 @@
+
+# Native modules
+import asyncio
+import atexit
+import time
+from collections import deque
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+from typing import Optional, List, Dict, Deque, Tuple, Callable, Union
+# Own modules
+from .assets import Stop
+from .exceptions import StopSetterUnavailable
+
+__all__ = [
+    "StopsWriteBehind", "WriteBehindBatchError",
+    "DEFAULT_WRITE_BEHIND_BATCH_SIZE", "DEFAULT_WRITE_BEHIND_FLUSH_INTERVAL", "DEFAULT_WRITE_BEHIND_MAX_PENDING"
+]
+
+DEFAULT_WRITE_BEHIND_BATCH_SIZE = 100
+DEFAULT_WRITE_BEHIND_FLUSH_INTERVAL = 1
+DEFAULT_WRITE_BEHIND_MAX_PENDING = 10000
+_ERRORS_KEPT = 100
+_ASYNC_FLUSH_POLL_INTERVAL = 0.05
+
+"""A Stops Saver is a function that saves a list of Stops, given the update and use_all_stop_setters parameters,
+and returns the Stops that could not be saved (like PyBuses.save_stops).
+"""
+StopsSaver = Callable[[List[Stop], bool, Optional[bool]], List[Stop]]
+
+
+class WriteBehindBatchError(object):
+    """Information about a batch of Stops that could not be saved (completely or partially) by a StopsWriteBehind."""
+    def __init__(self, batch: List[Stop], failed: List[Stop], exception: Optional[BaseException] = None):
+        """
+        :param batch: all the Stops of the batch
+        :param failed: Stops of the batch that could not be saved
+        :param exception: exception raised while saving the batch, if any (default=None)
+        """
+        self.batch: List[Stop] = batch
+        self.failed: List[Stop] = failed
+        self.exception: Optional[BaseException] = exception
+        self.time: float = time.time()
+
+    def __repr__(self):
+        return f"WriteBehindBatchError(batch={len(self.batch)}, failed={len(self.failed)}, " \
+               f"exception={self.exception!r})"
+
+
+class StopsWriteBehind(object):
+    """Write-behind queue for Stop setters.
+    Stops are enqueued and saved on the background by a flusher thread, grouped in batches by size or time,
+    so bulk ingestion is not bound by the round-trip latency of each Stop setter call.
+
+    The queue is bounded: when full, put() blocks until there is space (backpressure).
+    Pending Stops are flushed when close() is called, and on interpreter exit.
+    Batches that could not be saved are reported on the errors list and to the on_error callback.
+
+    If the saver runs its batches on an asyncio event loop (e.g. AsyncPyBuses), that loop is set on the loop
+    attribute: flush() and close() can not be called from it, since the loop would be blocked waiting for
+    the flusher, which waits for the loop. Use the aflush() and aclose() coroutines instead.
+    """
+    def __init__(
+            self,
+            saver: StopsSaver,
+            batch_size: int = DEFAULT_WRITE_BEHIND_BATCH_SIZE,
+            flush_interval: Union[int, float] = DEFAULT_WRITE_BEHIND_FLUSH_INTERVAL,
+            max_pending: int = DEFAULT_WRITE_BEHIND_MAX_PENDING,
+            on_error: Optional[Callable[[WriteBehindBatchError], None]] = None
+    ):
+        """The flusher thread is started automatically.
+        :param saver: function that saves a batch of Stops (see StopsSaver), usually PyBuses.save_stops
+        :param batch_size: max number of Stops saved together (default=100)
+        :param flush_interval: max time, in seconds, that an enqueued Stop waits for its batch to fill (default=1)
+        :param max_pending: max number of Stops enqueued; put() blocks when reached (default=10000)
+        :param on_error: function called with a WriteBehindBatchError when a batch fails (default=None)
+        :type batch_size: int
+        :type flush_interval: int or float
+        :type max_pending: int
+        """
+        self.saver: StopsSaver = saver
+        self.batch_size: int = max(batch_size, 1)
+        self.flush_interval: Union[int, float] = flush_interval
+        self.on_error: Optional[Callable[[WriteBehindBatchError], None]] = on_error
+        self.errors: Deque[WriteBehindBatchError] = deque(maxlen=_ERRORS_KEPT)
+        self.saved: int = 0
+        self.failed: int = 0
+        self.batches: int = 0
+        self._queue: Queue = Queue(maxsize=max_pending)
+        self._counters_lock = Lock()
+        self._closed: bool = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread = Thread(target=self._flusher, name="StopsWriteBehind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending(self) -> int:
+        """Number of Stops enqueued or being saved."""
+        return self._queue.unfinished_tasks
+
+    def put(
+            self,
+            stop: Stop,
+            update: bool = True,
+            use_all_stop_setters: Optional[bool] = None,
+            timeout: Optional[float] = None
+    ):
+        """Enqueue a Stop to be saved. If the queue is full, block until there is space.
+        :param stop: Stop object to save
+        :param update: update the Stop if currently exists on a Setter data destination (default=True)
+        :param use_all_stop_setters: save the Stop on all the Stop Setters (default=None: use the PyBuses value)
+        :param timeout: max time, in seconds, to wait for space on the queue (default=None: wait forever)
+        :type stop: Stop
+        :type update: bool
+        :type use_all_stop_setters: bool or None
+        :type timeout: float or None
+        :raise: StopSetterUnavailable if the write-behind queue is closed, or full after timeout
+        """
+        if self._closed:
+            raise StopSetterUnavailable("Write-behind queue is closed")
+        try:
+            self._queue.put((stop, update, use_all_stop_setters), timeout=timeout)
+        except Full:
+            raise StopSetterUnavailable(f"Write-behind queue is full ({self._queue.maxsize} Stops pending)")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all the enqueued Stops are saved (or failed).
+        :param timeout: max time to wait, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if all the Stops were processed, False if timeout expired
+        :rtype: bool
+        :raise: RuntimeError if called from the event loop where the Stops are saved
+        """
+        self._check_blocking_allowed("flush")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Stop accepting new Stops, flush the pending ones and stop the flusher thread.
+        :param timeout: max time to wait for the pending Stops, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if all the pending Stops were processed, False if timeout expired
+        :rtype: bool
+        :raise: RuntimeError if called from the event loop where the Stops are saved
+        """
+        if self._closed:
+            return True
+        self._check_blocking_allowed("close")
+        self._closed = True
+        flushed = self.flush(timeout)
+        self._thread.join(self.flush_interval + 1)
+        atexit.unregister(self.close)
+        return flushed
+
+    async def aflush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all the enqueued Stops are saved (or failed), without blocking the running event loop.
+        :param timeout: max time to wait, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if all the Stops were processed, False if timeout expired
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(_ASYNC_FLUSH_POLL_INTERVAL)
+        return True
+
+    async def aclose(self, timeout: Optional[float] = None) -> bool:
+        """Stop accepting new Stops, flush the pending ones and stop the flusher thread,
+        without blocking the running event loop.
+        :param timeout: max time to wait for the pending Stops, in seconds (default=None: wait forever)
+        :type timeout: float or None
+        :return: True if all the pending Stops were processed, False if timeout expired
+        :rtype: bool
+        """
+        if self._closed:
+            return True
+        self._closed = True
+        flushed = await self.aflush(timeout)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join, self.flush_interval + 1)
+        atexit.unregister(self.close)
+        return flushed
+
+    def _check_blocking_allowed(self, method: str):
+        """Raise RuntimeError if the current thread runs the event loop where the Stops are saved."""
+        if self.loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if running_loop is self.loop:
+            raise RuntimeError(f"{method}() would deadlock the event loop where the Stops are saved: await a{method}()")
+
+    def stats(self) -> Dict:
+        """Get the counters of this write-behind queue.
+        :return: dict with the keys "pending", "batches", "saved", "failed" and "errors"
+        :rtype: dict
+        """
+        with self._counters_lock:
+            return {
+                "pending": self.pending,
+                "batches": self.batches,
+                "saved": self.saved,
+                "failed": self.failed,
+                "errors": len(self.errors)
+            }
+
+    def _flusher(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except Empty:
+                if self._closed:
+                    return
+                continue
+            items = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+            try:
+                self._save_items(items)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _save_items(self, items: List[Tuple[Stop, bool, Optional[bool]]]):
+        """Save the given enqueued items, grouped by their update/use_all_stop_setters parameters."""
+        groups: Dict[Tuple[bool, Optional[bool]], List[Stop]] = dict()
+        for stop, update, use_all_stop_setters in items:
+            groups.setdefault((update, use_all_stop_setters), list()).append(stop)
+        for (update, use_all_stop_setters), batch in groups.items():
+            exception = None
+            try:
+                failed = self.saver(batch, update, use_all_stop_setters)
+            except BaseException as ex:
+                # Includes cancellation of the saver (e.g. when its event loop is shut down):
+                # the flusher thread must survive, and the batch is reported as failed
+                failed = batch
+                exception = ex
+            with self._counters_lock:
+                self.batches += 1
+                self.saved += len(batch) - len(failed)
+                self.failed += len(failed)
+            if failed:
+                error = WriteBehindBatchError(batch=batch, failed=failed, exception=exception)
+                self.errors.append(error)
+                if self.on_error is not None:
+                    try:
+                        self.on_error(error)
+                    except Exception:
+                        pass
@@ -22,5 +22,6 @@ setup(
     author_email='david@python.xxx',
     url='https://www.github.com/enforcerzhukov',
     packages=['pybuses'],
-    install_requires=get_requirements()
+    install_requires=get_requirements(),
+    extras_require={"numpy": ["numpy"]}
 )
@@ -0,0 +1,39 @@
+
+# Own modules
+from pybuses import Stop
+from pybuses.exceptions import *
+
+
+class FlakyGetter(object):
+    """Stop getter that can be switched between unavailable and available."""
+    def __init__(self, stops):
+        self.stops = stops
+        self.available = True
+        self.calls = 0
+
+    def __call__(self, stopid):
+        self.calls += 1
+        if not self.available:
+            raise StopGetterUnavailable("Getter down")
+        try:
+            return self.stops[stopid]
+        except KeyError:
+            raise StopNotFound(f"Stop {stopid} not found")
+
+    def find_stops(self, stopids):
+        if not self.available:
+            raise StopGetterUnavailable("Getter down")
+        found = {stopid: self.stops[stopid] for stopid in stopids if stopid in self.stops}
+        return found, {stopid for stopid in stopids if stopid not in found}
+
+
+class MemorySetter(object):
+    """Stop setter that keeps the Stops on a dict, and can be switched to unavailable."""
+    def __init__(self):
+        self.stops = dict()
+        self.available = True
+
+    def __call__(self, stop, update=True):
+        if not self.available:
+            raise StopSetterUnavailable("Setter down")
+        self.stops[stop.stopid] = stop
@@ -0,0 +1,159 @@
+
+# Native modules
+import asyncio
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, AsyncPyBuses, PyBusesMetrics, StopsCache, Stop
+from pybuses.exceptions import *
+from .helpers import FlakyGetter, MemorySetter
+
+
+def test_async_find_stop_not_found_not_cached_when_a_getter_is_unavailable():
+    db, online = FlakyGetter({}), FlakyGetter({})
+    online.available = False
+    pybuses = AsyncPyBuses()
+    pybuses.add_stops_cache(StopsCache())
+    pybuses.add_stop_getter(db)
+    pybuses.add_stop_getter(online, online=True)
+
+    async def _run():
+        with pytest.raises(StopNotFound):
+            await pybuses.find_stop(1)
+        online.available = True
+        online.stops[1] = Stop(1, "Stop")
+        found, misses = await pybuses.find_stops([1])
+        assert set(found) == {1} and not misses
+
+    asyncio.run(_run())
+    pybuses.close()
+
+
+class _AsyncSetter(MemorySetter):
+    """Coroutine Stop setter/deleter that can be switched to unavailable."""
+    def __init__(self):
+        super().__init__()
+        self.deleted = list()
+
+    async def __call__(self, stop, update=True):
+        super().__call__(stop, update)
+
+    async def delete(self, stopid):
+        if not self.available:
+            raise StopDeleterUnavailable("Deleter down")
+        self.deleted.append(stopid)
+
+
+def test_async_pybuses_is_not_a_pybuses():
+    assert not isinstance(AsyncPyBuses(), PyBuses)
+    assert not asyncio.iscoroutinefunction(PyBuses.find_stop)
+    assert asyncio.iscoroutinefunction(AsyncPyBuses.find_stop)
+
+
+def test_async_getter_chain():
+    db, online = FlakyGetter({}), FlakyGetter({1: Stop(1, "Stop")})
+    db.available = False
+    tier = _AsyncSetter()
+    metrics = PyBusesMetrics()
+    pybuses = AsyncPyBuses(metrics=metrics)
+    pybuses.add_stop_getter(db, tier_setter=tier)
+
+    async def _online(stopid):
+        if stopid == 2:
+            raise StopNotExist("Stop 2 does not exist")
+        return online(stopid)
+
+    pybuses.add_stop_getter(_online, online=True)
+
+    async def _run():
+        assert (await pybuses.find_stop(1)).name == "Stop"
+        await asyncio.gather(*pybuses._promotion_tasks)
+        assert set(tier.stops) == {1}
+        with pytest.raises(StopNotExist):
+            await pybuses.find_stop(2)
+        online.available = False
+        with pytest.raises(StopGetterUnavailable):
+            await pybuses.find_stop(1)
+
+    asyncio.run(_run())
+    pybuses.close()
+    assert db.calls == 3 and online.calls == 2
+    assert metrics.snapshot()["fallbacks"]["find_stop"] == {1: 2, "exhausted": 1}
+
+
+def test_async_find_stops_searches_concurrently():
+    started = list()
+
+    async def _getter(stopid):
+        started.append(stopid)
+        # Only returns when all the Stops are being searched at the same time
+        while len(started) < 3:
+            await asyncio.sleep(0.001)
+        if stopid == 3:
+            raise StopNotFound("Stop 3 not found")
+        return Stop(stopid, f"Stop {stopid}")
+
+    pybuses = AsyncPyBuses()
+    pybuses.add_stop_getter(_getter)
+
+    async def _run():
+        return await asyncio.wait_for(pybuses.find_stops([1, 2, 3]), timeout=5)
+
+    found, misses = asyncio.run(_run())
+    assert set(found) == {1, 2} and misses == {3}
+
+
+@pytest.mark.parametrize("use_all", [False, True])
+def test_async_setter_chain(use_all):
+    first, second, third = _AsyncSetter(), MemorySetter(), _AsyncSetter()
+    first.available = False
+    pybuses = AsyncPyBuses(use_all_stop_setters=use_all)
+    pybuses.add_stops_cache(StopsCache())
+    for setter in (first, second, third):
+        pybuses.add_stop_setter(setter)
+
+    async def _run():
+        await pybuses.save_stop(Stop(1, "Stop"))
+        assert (await pybuses.find_stop(1)).name == "Stop"
+        failed = await pybuses.save_stops([Stop(2, "Two"), Stop(3, "Three")])
+        assert failed == []
+        second.available = third.available = False
+        with pytest.raises(StopSetterUnavailable):
+            await pybuses.save_stop(Stop(4, "Four"))
+        assert [stop.stopid for stop in await pybuses.save_stops([Stop(5, "Five")])] == [5]
+
+    asyncio.run(_run())
+    pybuses.close()
+    assert set(second.stops) == {1, 2, 3}
+    assert set(third.stops) == ({1, 2, 3} if use_all else set())
+    assert not first.stops
+
+
+@pytest.mark.parametrize("use_all", [False, True])
+def test_async_deleter_chain(use_all):
+    first, second, third = _AsyncSetter(), _AsyncSetter(), _AsyncSetter()
+    first.available = False
+    cache = StopsCache()
+    cache.save_stop(Stop(1, "Stop"))
+    pybuses = AsyncPyBuses(use_all_stop_deleters=use_all)
+    pybuses.add_stops_cache(cache)
+    pybuses.add_stop_deleter(first.delete)
+    pybuses.add_stop_deleter(second.delete)
+    pybuses.add_stop_deleter(lambda stopid: third.deleted.append(stopid))
+
+    async def _run():
+        await pybuses.delete_stop(1)
+        with pytest.raises(StopNotFound):
+            cache.find_stop(1)
+        second.available = False
+        if use_all:
+            await pybuses.delete_stop(2)
+        else:
+            with pytest.raises(StopDeleterUnavailable):
+                await AsyncPyBuses(stop_deleters=[first.delete, second.delete]).delete_stop(2)
+
+    asyncio.run(_run())
+    pybuses.close()
+    assert second.deleted == [1]
+    assert third.deleted == ([1, 2] if use_all else [])
+    assert not first.deleted
@@ -0,0 +1,80 @@
+
+# Native modules
+import asyncio
+import time
+from threading import Thread, Event
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import BusesCache, StopsCache, Bus, Stop
+from pybuses.exceptions import *
+
+
+def test_fetch_counts_coalesced_callers_apart_from_misses():
+    cache = BusesCache()
+    started, release = Event(), Event()
+
+    def _fetch(stopid):
+        started.set()
+        release.wait(5)
+        return [Bus("C1", "Route", 5)]
+
+    owner = Thread(target=cache.fetch, args=(1, _fetch))
+    owner.start()
+    assert started.wait(5)
+    waiter = Thread(target=cache.fetch, args=(1, _fetch))
+    waiter.start()
+    while not cache.coalesced:
+        time.sleep(0.01)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    cache.fetch(1, _fetch)
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 1, "size": 1}
+
+
+def test_afetch_owner_cancelled_does_not_cancel_waiters():
+    cache = BusesCache()
+    calls = list()
+
+    async def _fetch(stopid):
+        calls.append(stopid)
+        await asyncio.sleep(0.1)
+        return [Bus("C1", "Route", 5)]
+
+    async def _run():
+        owner = asyncio.ensure_future(cache.afetch(1, _fetch))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(cache.afetch(1, _fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        results = await asyncio.gather(*waiters)
+        assert all(buses[0].line == "C1" for buses in results)
+
+    asyncio.run(_run())
+    assert len(calls) == 2
+    assert cache.misses == 2 and cache.coalesced >= 3
+
+
+def test_stops_cache_negative_results_expire():
+    cache = StopsCache(negative_ttl=0.05)
+    cache.save_negative(1, not_exist=True)
+    cache.save_negative(2, not_exist=False)
+    with pytest.raises(StopNotExist):
+        cache.check_negative(1)
+    with pytest.raises(StopNotFound):
+        cache.find_stop(2)
+    time.sleep(0.1)
+    cache.check_negative(1)
+    cache.save_stop(Stop(2, "Stop"))
+    assert cache.find_stop(2).name == "Stop"
+    assert cache.stats()["negative_size"] == 0
+
+
+def test_stops_cache_negative_caching_disabled():
+    cache = StopsCache(negative_ttl=0)
+    cache.save_negative(1)
+    cache.check_negative(1)
+    assert cache.stats()["negative_size"] == 0
@@ -0,0 +1,61 @@
+
+# Native modules
+import json
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, Stop, CrawlCheckpoint, CrawlOutcomes
+from pybuses.exceptions import *
+from .helpers import MemorySetter
+
+
+def test_outcomes_saved_as_ranges_and_loaded(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = CrawlCheckpoint(path, interval=3600)
+    checkpoint.begin()
+    for stopid in range(1, 6):
+        checkpoint.record(stopid, CrawlOutcomes.NOT_EXIST)
+    checkpoint.record(6, CrawlOutcomes.FOUND)
+    checkpoint.record(7, CrawlOutcomes.ERROR)
+    checkpoint.save()
+    with open(path) as f:
+        ranges = json.load(f)["ranges"]
+    assert [r[:3] for r in ranges] == [[1, 5, CrawlOutcomes.NOT_EXIST], [6, 6, CrawlOutcomes.FOUND]]
+
+    loaded = CrawlCheckpoint(path)
+    assert len(loaded) == 6 and not loaded.finished
+    assert loaded.known_outcome(6) == CrawlOutcomes.FOUND
+    assert loaded.known_outcome(7) is None
+
+
+def test_rescan_skips_non_existing_ids_until_refresh_age(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    searched = list()
+
+    def _get(stopid):
+        searched.append(stopid)
+        if stopid in (1, 2):
+            return Stop(stopid, "Stop")
+        raise StopNotExist()
+
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(MemorySetter())
+    pybuses.find_all_stops(start=1, end=5, checkpoint=path)
+    assert searched == [1, 2, 3, 4, 5]
+
+    # New run: found Stops are searched again, non-existing ones are skipped while fresh
+    searched.clear()
+    crawl = pybuses.find_all_stops(start=1, end=5, checkpoint=path, refresh_age=3600)
+    assert searched == [1, 2] and crawl.progress().skipped == 3
+
+    searched.clear()
+    pybuses.find_all_stops(start=1, end=5, checkpoint=path)
+    assert searched == [1, 2, 3, 4, 5]
+
+
+def test_unsupported_version_rejected(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text(json.dumps({"version": -1}))
+    with pytest.raises(ValueError):
+        CrawlCheckpoint(str(path))
@@ -0,0 +1,126 @@
+
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, StopsCache, StopSpatialIndex, Stop
+from pybuses.exceptions import *
+from .helpers import FlakyGetter, MemorySetter
+
+
+def _pybuses(db, online):
+    pybuses = PyBuses()
+    pybuses.add_stops_cache(StopsCache())
+    pybuses.add_stop_getter(db)
+    pybuses.add_stop_getter(online, online=True)
+    return pybuses
+
+
+def test_find_stop_not_found_cached_when_all_getters_answered():
+    db, online = FlakyGetter({}), FlakyGetter({})
+    pybuses = _pybuses(db, online)
+    with pytest.raises(StopNotFound):
+        pybuses.find_stop(1)
+    online.stops[1] = Stop(1, "Stop")
+    with pytest.raises(StopNotFound):
+        pybuses.find_stop(1)
+    assert online.calls == 1
+
+
+def test_find_stop_not_found_not_cached_when_a_getter_is_unavailable():
+    db, online = FlakyGetter({}), FlakyGetter({})
+    online.available = False
+    pybuses = _pybuses(db, online)
+    with pytest.raises(StopNotFound):
+        pybuses.find_stop(1)
+    online.available = True
+    online.stops[1] = Stop(1, "Stop")
+    assert pybuses.find_stop(1).name == "Stop"
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_find_stops_not_found_not_cached_when_a_getter_is_unavailable(bulk):
+    db, online = FlakyGetter({2: Stop(2, "Two")}), FlakyGetter({})
+    online.available = False
+    pybuses = PyBuses()
+    pybuses.add_stops_cache(StopsCache())
+    pybuses.add_stop_getter(db, bulk=db.find_stops if bulk else None)
+    pybuses.add_stop_getter(online, online=True, bulk=online.find_stops if bulk else None)
+    found, misses = pybuses.find_stops([1, 2])
+    assert set(found) == {2} and misses == {1}
+    online.available = True
+    online.stops[1] = Stop(1, "One")
+    found, misses = pybuses.find_stops([1, 2])
+    assert set(found) == {1, 2} and not misses
+
+
+def test_stops_index_updated_through_pybuses():
+    index = StopSpatialIndex()
+    db = MemorySetter()
+    pybuses = PyBuses()
+    pybuses.add_stop_setter(db)
+    pybuses.add_stop_deleter(lambda stopid: db.stops.pop(stopid, None))
+    pybuses.add_stops_index(index)
+    pybuses.save_stop(Stop(1, "Stop", 42.23, -8.72))
+    pybuses.save_stops([Stop(2, "Stop", 42.24, -8.71)])
+    assert 1 in db.stops and 1 in index and 2 in index
+    pybuses.delete_stop(1)
+    assert 1 not in index
+
+    pybuses.add_stop_getter(FlakyGetter({3: Stop(3, "Stop", 42.25, -8.70)}), online=True)
+    pybuses.find_stop(3)
+    assert 3 in index
+
+
+def _tiered_pybuses(stops):
+    """PyBuses with three getters; the first two tiers have a Tier Setter that writes where they read from."""
+    tiers = [MemorySetter(), MemorySetter()]
+    getters = [FlakyGetter(tiers[0].stops), FlakyGetter(tiers[1].stops), FlakyGetter(stops)]
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(getters[0], tier_setter=tiers[0], bulk=getters[0].find_stops)
+    pybuses.add_stop_getter(getters[1], tier_setter=tiers[1])
+    pybuses.add_stop_getter(getters[2], online=True)
+    return pybuses, getters, tiers
+
+
+def test_stop_promoted_into_faster_tiers():
+    pybuses, getters, tiers = _tiered_pybuses({1: Stop(1, "One"), 2: Stop(2, "Two")})
+    with pybuses:
+        assert pybuses.find_stop(1).name == "One"
+    # Closing waits for the pending promotions, and shuts the executor down
+    assert pybuses._promotion_executor is None
+    assert set(tiers[0].stops) == set(tiers[1].stops) == {1}
+
+    # Found on the second tier: only promoted into the first one
+    tiers[1].stops[2] = Stop(2, "Two")
+    assert pybuses.find_stop(2).name == "Two"
+    pybuses.close()
+    assert set(tiers[0].stops) == {1, 2}
+    assert getters[2].calls == 1
+    # Found on the first tier: nothing to promote
+    assert pybuses.find_stop(1).name == "One"
+    assert pybuses._promotion_executor is None
+
+
+def test_stops_promoted_by_find_stops():
+    pybuses, getters, tiers = _tiered_pybuses({stopid: Stop(stopid, str(stopid)) for stopid in range(1, 5)})
+    tiers[1].stops[4] = Stop(4, "4")
+    tiers[0].available = False
+    with pybuses:
+        found, misses = pybuses.find_stops([1, 2, 3, 4, 5])
+        assert set(found) == {1, 2, 3, 4} and misses == {5}
+    # Errors of the Tier Setters are ignored
+    assert not tiers[0].stops
+    assert set(tiers[1].stops) == {1, 2, 3, 4}
+    tiers[0].available = True
+    with pybuses:
+        pybuses.find_stops([1, 2, 3, 4])
+    assert set(tiers[0].stops) == {1, 2, 3, 4}
+
+
+def test_stop_promotion_disabled():
+    pybuses, getters, tiers = _tiered_pybuses({1: Stop(1, "One")})
+    pybuses.promote_stops = False
+    with pybuses:
+        pybuses.find_stop(1)
+    assert pybuses._promotion_executor is None
+    assert not tiers[0].stops and not tiers[1].stops
@@ -0,0 +1,221 @@
+
+# Native modules
+import asyncio
+import os
+import time
+from threading import Event
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, AsyncPyBuses, Stop, StopsSync, CrawlCheckpoint, CrawlOutcomes, AdaptiveDiscovery
+from pybuses import StopsCrawl, AsyncStopsCrawl
+from pybuses.exceptions import *
+from .helpers import MemorySetter
+
+
+def _getter(existing):
+    def _get(stopid):
+        if stopid in existing:
+            return Stop(stopid, f"Stop {stopid}")
+        raise StopNotExist()
+    return _get
+
+
+def test_checkpoint_resume_skips_searched_ids(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    searched = list()
+    reached, interrupted = Event(), Event()
+
+    def _get(stopid):
+        searched.append(stopid)
+        if stopid == 6:
+            reached.set()
+            interrupted.wait(5)
+        return _getter({2, 4})(stopid)
+
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(MemorySetter())
+    crawl = pybuses.find_all_stops(start=1, end=10, threads=1, checkpoint=CrawlCheckpoint(path, interval=0))
+    assert reached.wait(5)
+    crawl.cancel()
+    interrupted.set()
+    assert crawl.join(5)
+    assert searched == [1, 2, 3, 4, 5, 6]
+
+    searched.clear()
+    crawl = pybuses.find_all_stops(start=1, end=10, checkpoint=CrawlCheckpoint(path, interval=0))
+    assert searched == [7, 8, 9, 10]
+    assert crawl.progress().skipped == 6
+    assert CrawlCheckpoint(path).finished
+
+
+def test_sync_pending_stops_not_checkpointed(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    setter = MemorySetter()
+    get = _getter({1, 2, 3})
+
+    def _get(stopid):
+        if stopid == 5:
+            # Simulate a crash: the queued Stops 1-3 are not saved yet, so must not be on the checkpoint
+            checkpoint = CrawlCheckpoint(path)
+            assert all(checkpoint.known_outcome(i) != CrawlOutcomes.FOUND for i in (1, 2, 3))
+            assert checkpoint.known_outcome(4) == CrawlOutcomes.NOT_EXIST
+        return get(stopid)
+
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(setter)
+    pybuses.find_all_stops(
+        start=1, end=6, checkpoint=CrawlCheckpoint(path, interval=0), sync=StopsSync(batch_size=100)
+    )
+    assert set(setter.stops) == {1, 2, 3}
+    checkpoint = CrawlCheckpoint(path)
+    assert checkpoint.finished
+    assert all(checkpoint.known_outcome(i, refresh_age=None) is not None for i in range(1, 7))
+
+
+def test_sync_failed_batch_searched_again_on_resume(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    setter = MemorySetter()
+    setter.available = False
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_getter({1, 2}), online=True)
+    pybuses.add_stop_setter(setter)
+
+    crawl = pybuses.find_all_stops(start=1, end=4, checkpoint=path, sync=StopsSync(batch_size=2))
+    assert crawl.progress().save_errors == 2
+    assert sorted(crawl.sync.summary.save_errors) == [1, 2]
+    checkpoint = CrawlCheckpoint(path)
+    assert checkpoint.known_outcome(1) is None and checkpoint.known_outcome(2) is None
+
+    # Resume the run as interrupted: the IDs that could not be saved are searched and saved again
+    checkpoint.finished = False
+    checkpoint.save()
+    setter.available = True
+    crawl = pybuses.find_all_stops(start=1, end=4, checkpoint=path, sync=StopsSync(batch_size=2))
+    assert crawl.progress().scanned == 2 and crawl.progress().skipped == 2
+    assert set(setter.stops) == {1, 2}
+    assert os.path.exists(path)
+
+
+def test_found_stops_streamed_from_the_first_one():
+    release = Event()
+
+    def _get(stopid):
+        if stopid == 3:
+            release.wait(5)
+        return _getter({1, 2, 3})(stopid)
+
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(MemorySetter())
+    crawl = pybuses.find_all_stops(start=1, end=4, threads=1)
+    while len(crawl.found_stops) < 2:
+        time.sleep(0.01)
+    # Stops found before attaching a consumer are not buffered twice, but are still yielded
+    release.set()
+    assert [stop.stopid for stop in crawl] == [1, 2, 3]
+    assert [stop.stopid for stop in crawl] == [1, 2, 3]
+
+
+def test_worker_exception_raised_from_join(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+
+    def _get(stopid):
+        if stopid == 3:
+            raise ValueError("Broken getter")
+        return _getter({1, 2})(stopid)
+
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(MemorySetter())
+    crawl = pybuses.find_all_stops(start=1, end=10, threads=2, checkpoint=CrawlCheckpoint(path, interval=0))
+    with pytest.raises(ValueError):
+        crawl.join(5)
+    assert isinstance(crawl.exception, ValueError) and crawl.cancelled
+    assert not CrawlCheckpoint(path).finished
+
+
+def test_async_worker_exception_raised_from_join():
+    async def _get(stopid):
+        if stopid == 3:
+            raise ValueError("Broken getter")
+        return _getter({1, 2})(stopid)
+
+    pybuses = AsyncPyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(MemorySetter())
+
+    async def _run():
+        crawl = pybuses.find_all_stops(start=1, end=10)
+        found = [stop.stopid async for stop in crawl]
+        assert found == [1, 2]
+        with pytest.raises(ValueError):
+            await crawl.join(5)
+
+    asyncio.run(_run())
+    pybuses.close()
+
+
+def test_adaptive_block_size_scales_with_workers():
+    discovery = AdaptiveDiscovery(start=1, end=20000)
+    assert discovery.get_block_size(1) == 500
+    assert discovery.get_block_size(16) == 313
+    assert discovery.get_block_size(1000) == discovery.miss_run * 4
+    assert AdaptiveDiscovery(start=1, end=20000, block_size=1000).get_block_size(16) == 1000
+    assert len(list(discovery.chunks(16))) == 64
+
+
+def test_adaptive_fallback_searches_skipped_ids():
+    existing = set(range(1, 50)) | {300, 1000}
+    searched = list()
+
+    def _get(stopid):
+        searched.append(stopid)
+        return _getter(existing)(stopid)
+
+    pybuses = PyBuses()
+    pybuses.add_stop_getter(_get, online=True)
+    pybuses.add_stop_setter(MemorySetter())
+    crawl = pybuses.find_all_stops(start=1, end=1000, adaptive=AdaptiveDiscovery(start=1, end=1000, block_size=1000))
+    assert len(searched) < 1000
+    assert 300 not in {stop.stopid for stop in crawl.found_stops}
+
+    searched.clear()
+    discovery = AdaptiveDiscovery(start=1, end=1000, block_size=1000, fallback=True)
+    crawl = pybuses.find_all_stops(start=1, end=1000, adaptive=discovery)
+    assert {stop.stopid for stop in crawl.found_stops} == existing
+    assert sorted(searched) == list(range(1, 1001))
+
+
+def test_on_end_exception_does_not_hang_join(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+
+    def _on_end():
+        raise OSError("Disk full")
+
+    crawl = StopsCrawl(
+        lambda stopid: (CrawlOutcomes.NOT_EXIST, None, True), range(1, 5), threads=2,
+        checkpoint=CrawlCheckpoint(path, interval=0), on_end=_on_end
+    ).start()
+    with pytest.raises(OSError):
+        crawl.join(5)
+    assert crawl.done and list(crawl) == []
+    assert not CrawlCheckpoint(path).finished
+
+
+def test_async_on_end_exception_does_not_hang_join():
+    async def _probe(stopid):
+        return CrawlOutcomes.NOT_EXIST, None, True
+
+    async def _on_end():
+        raise OSError("Disk full")
+
+    async def _run():
+        crawl = AsyncStopsCrawl(_probe, range(1, 5), concurrency=2, on_end=_on_end).start()
+        with pytest.raises(OSError):
+            await crawl.join(5)
+        assert crawl.done and [stop async for stop in crawl] == []
+
+    asyncio.run(_run())
@@ -0,0 +1,133 @@
+
+# Native modules
+import random
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import geo
+from pybuses.geo import haversine, haversine_many, haversine_matrix, haversine_matrix_blocks, pairs_within
+
+
+@pytest.fixture(params=["numpy", "python"])
+def implementation(request, monkeypatch):
+    """Run the tests with NumPy and with the pure-Python fallback."""
+    if request.param == "python":
+        monkeypatch.setattr(geo, "numpy", None)
+    elif geo.numpy is None:
+        pytest.skip("NumPy is not installed")
+    return request.param
+
+
+def _points(n, seed=1, lat=42.23, lon=-8.71, spread=0.05):
+    rnd = random.Random(seed)
+    lats = [lat + rnd.uniform(-spread, spread) for _ in range(n)]
+    lons = [lon + rnd.uniform(-spread, spread) for _ in range(n)]
+    return lats, lons
+
+
+def _brute_force_pairs(lats, lons, radius_m):
+    pairs = list()
+    for i in range(len(lats)):
+        for j in range(i + 1, len(lats)):
+            distance = haversine(lats[i], lons[i], lats[j], lons[j])
+            if distance <= radius_m:
+                pairs.append((i, j, distance))
+    return pairs
+
+
+def _as_lists(matrix):
+    return [list(row) for row in matrix]
+
+
+def test_haversine_known_distances():
+    assert haversine(42.23, -8.71, 42.23, -8.71) == 0
+    # One degree of latitude, and a quarter of the meridian
+    assert haversine(0, 0, 1, 0) == pytest.approx(111195.08, abs=0.01)
+    assert haversine(0, 0, 90, 0) == pytest.approx(geo.EARTH_RADIUS * 3.141592653589793 / 2)
+    # Antipodal points, without math domain errors from rounding
+    assert haversine(0, 0, 0, 180) == pytest.approx(geo.EARTH_RADIUS * 3.141592653589793)
+    assert haversine(0, 179.9, 0, -179.9) == pytest.approx(haversine(0, 0, 0, 0.2))
+    # Vigo - A Coruña is roughly 120 km
+    assert 115000 < haversine(42.2406, -8.7207, 43.3623, -8.4115) < 130000
+
+
+def test_haversine_many(implementation):
+    lats, lons = _points(50)
+    distances = haversine_many(42.23, -8.71, lats, lons)
+    assert isinstance(distances, list) == (implementation == "python")
+    expected = [haversine(42.23, -8.71, lat, lon) for lat, lon in zip(lats, lons)]
+    assert list(distances) == pytest.approx(expected)
+    assert len(haversine_many(42.23, -8.71, [], [])) == 0
+
+
+def test_haversine_matrix(implementation):
+    lats, lons = _points(20)
+    other_lats, other_lons = _points(7, seed=2)
+    matrix = _as_lists(haversine_matrix(lats, lons, other_lats, other_lons))
+    assert len(matrix) == 20 and all(len(row) == 7 for row in matrix)
+    for i in range(20):
+        for j in range(7):
+            assert matrix[i][j] == pytest.approx(haversine(lats[i], lons[i], other_lats[j], other_lons[j]))
+
+    # Without destination points, the matrix is square and symmetric, with zeros on the diagonal
+    square = _as_lists(haversine_matrix(lats, lons))
+    for i in range(20):
+        assert square[i][i] == 0
+        for j in range(20):
+            assert square[i][j] == pytest.approx(square[j][i])
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 20, 100])
+def test_haversine_matrix_blocks(implementation, block_size):
+    lats, lons = _points(20)
+    full = _as_lists(haversine_matrix(lats, lons))
+    rows, starts = list(), list()
+    for start, block in haversine_matrix_blocks(lats, lons, block_size=block_size):
+        block = _as_lists(block)
+        assert len(block) <= block_size
+        starts.append(start)
+        rows.extend(block)
+    assert starts == list(range(0, 20, block_size))
+    assert len(rows) == 20
+    for row, expected in zip(rows, full):
+        assert row == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("radius_m,block_size", [(50, 1024), (300, 1024), (300, 7), (2000, 16), (0, 1024)])
+def test_pairs_within_matches_brute_force(implementation, radius_m, block_size):
+    lats, lons = _points(300, spread=0.02)
+    # Duplicated points are always pairs, even with a radius of 0
+    lats.append(lats[0])
+    lons.append(lons[0])
+    pairs = pairs_within(lats, lons, radius_m, block_size=block_size)
+    expected = _brute_force_pairs(lats, lons, radius_m)
+    assert [(i, j) for i, j, _ in pairs] == [(i, j) for i, j, _ in expected]
+    assert [distance for _, _, distance in pairs] == pytest.approx([distance for _, _, distance in expected])
+    assert (0, 300, 0.0) in pairs
+
+
+def test_pairs_within_high_latitudes(implementation):
+    # Longitude degrees are short near the poles, so the longitude window must widen
+    lats, lons = _points(200, seed=3, lat=89.5, lon=0, spread=0.5)
+    lats += [-89.99, -89.99]
+    lons += [0, 180]
+    pairs = pairs_within(lats, lons, 5000)
+    assert [(i, j) for i, j, _ in pairs] == [(i, j) for i, j, _ in _brute_force_pairs(lats, lons, 5000)]
+    assert (200, 201) in [(i, j) for i, j, _ in pairs]
+
+
+def test_pairs_within_edge_cases(implementation):
+    assert pairs_within([], [], 300) == []
+    assert pairs_within([42.23], [-8.71], 300) == []
+    assert pairs_within([42.23, 42.23], [-8.71, -8.71], 300) == [(0, 1, 0.0)]
+
+
+def test_same_results_with_and_without_numpy(monkeypatch):
+    if geo.numpy is None:
+        pytest.skip("NumPy is not installed")
+    lats, lons = _points(500, seed=4, spread=0.03)
+    vectorized = pairs_within(lats, lons, 250, block_size=64)
+    monkeypatch.setattr(geo, "numpy", None)
+    python = pairs_within(lats, lons, 250)
+    assert [(i, j) for i, j, _ in python] == [(i, j) for i, j, _ in vectorized]
+    assert [distance for _, _, distance in python] == pytest.approx([distance for _, _, distance in vectorized])
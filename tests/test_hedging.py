@@ -0,0 +1,174 @@
+
+# Native modules
+import asyncio
+import time
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, AsyncPyBuses, PyBusesMetrics, HedgePolicy, Bus
+from pybuses.hedging import LatencyTracker
+from pybuses.exceptions import *
+
+
+class _BusGetter(object):
+    """Bus getter that answers its buses after a delay, or raises BusGetterUnavailable."""
+    def __init__(self, line, delay=0.0, available=True):
+        self.line = line
+        self.delay = delay
+        self.available = available
+        self.calls = 0
+
+    def __call__(self, stopid):
+        self.calls += 1
+        time.sleep(self.delay)
+        if not self.available:
+            raise BusGetterUnavailable("Getter down")
+        return [Bus(self.line, "Route", time=1)]
+
+
+class _AsyncBusGetter(_BusGetter):
+    """Coroutine version of _BusGetter, that records when it was cancelled."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cancelled = False
+
+    async def __call__(self, stopid):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if not self.available:
+            raise BusGetterUnavailable("Getter down")
+        return [Bus(self.line, "Route", time=1)]
+
+
+def _lines(buses):
+    return [bus.line for bus in buses]
+
+
+def test_latency_tracker_percentiles():
+    tracker = LatencyTracker(window=10)
+    f = object()
+    assert tracker.percentile(f, 50) is None
+    for latency in range(1, 21):
+        tracker.record(f, latency / 100)
+    # Only the latest 10 latencies (0.11-0.20) are remembered
+    assert tracker.samples(f) == 10
+    assert tracker.percentile(f, 0) == 0.11
+    assert tracker.percentile(f, 100) == 0.2
+    assert tracker.percentile(f, 50) in (0.15, 0.16)
+    assert tracker.percentile(f, 50, min_samples=11) is None
+
+
+def test_hedge_delay_uses_percentile_once_enough_samples():
+    f = object()
+    assert HedgePolicy().hedge_delay(f) is None
+    policy = HedgePolicy(delay=0.5, percentile=90, min_samples=5)
+    for _ in range(4):
+        policy.tracker.record(f, 0.01)
+    assert policy.hedge_delay(f) == 0.5
+    policy.tracker.record(f, 0.01)
+    assert policy.hedge_delay(f) == 0.01
+    assert HedgePolicy(percentile=90, min_samples=5).hedge_delay(object()) is None
+
+
+def _run_sync(getters, policy, metrics=None):
+    pybuses = PyBuses(bus_getters=getters, bus_hedge_policy=policy, metrics=metrics)
+    try:
+        start = time.perf_counter()
+        buses = pybuses.get_buses(1)
+        return buses, time.perf_counter() - start
+    finally:
+        policy.close()
+
+
+def _run_async(getters, policy, metrics=None):
+    pybuses = AsyncPyBuses(bus_getters=getters, bus_hedge_policy=policy, metrics=metrics)
+
+    async def _run():
+        start = time.perf_counter()
+        buses = await pybuses.get_buses(1)
+        elapsed = time.perf_counter() - start
+        # Let the cancelled losers run their cancellation
+        await asyncio.sleep(0)
+        return buses, elapsed
+
+    try:
+        return asyncio.run(_run())
+    finally:
+        pybuses.close()
+
+
+@pytest.mark.parametrize("run,getter", [(_run_sync, _BusGetter), (_run_async, _AsyncBusGetter)])
+def test_delay_hedging_slow_primary_loses(run, getter):
+    primary, secondary, third = getter("1", delay=1), getter("2", delay=0.01), getter("3")
+    metrics = PyBusesMetrics()
+    buses, elapsed = run([primary, secondary, third], HedgePolicy(delay=0.05), metrics)
+    assert _lines(buses) == ["2"]
+    assert elapsed < 0.5
+    # The third getter was not needed
+    assert third.calls == 0
+    assert metrics.snapshot()["fallbacks"]["get_buses"] == {1: 1}
+    if getter is _AsyncBusGetter:
+        assert primary.cancelled
+
+
+@pytest.mark.parametrize("run,getter", [(_run_sync, _BusGetter), (_run_async, _AsyncBusGetter)])
+def test_fast_primary_wins_without_hedging(run, getter):
+    primary, secondary = getter("1", delay=0.01), getter("2")
+    buses, _ = run([primary, secondary], HedgePolicy(delay=0.5))
+    assert _lines(buses) == ["1"]
+    assert secondary.calls == 0
+
+
+@pytest.mark.parametrize("run,getter", [(_run_sync, _BusGetter), (_run_async, _AsyncBusGetter)])
+def test_failed_primary_starts_next_getter_immediately(run, getter):
+    primary, secondary = getter("1", available=False), getter("2")
+    buses, elapsed = run([primary, secondary], HedgePolicy(delay=5))
+    assert _lines(buses) == ["2"]
+    assert elapsed < 1
+
+
+@pytest.mark.parametrize("run,getter", [(_run_sync, _BusGetter), (_run_async, _AsyncBusGetter)])
+def test_all_getters_failing(run, getter):
+    getters = [getter("1", available=False), getter("2", delay=0.05, available=False)]
+    metrics = PyBusesMetrics()
+    with pytest.raises(BusGetterUnavailable):
+        run(getters, HedgePolicy(delay=0.01), metrics)
+    assert [g.calls for g in getters] == [1, 1]
+    assert metrics.snapshot()["fallbacks"]["get_buses"] == {"exhausted": 1}
+
+
+@pytest.mark.parametrize("run,getter", [(_run_sync, _BusGetter), (_run_async, _AsyncBusGetter)])
+def test_percentile_hedging(run, getter):
+    primary, secondary = getter("1", delay=1), getter("2")
+    policy = HedgePolicy(percentile=50, min_samples=3)
+    # Without enough samples (and no fixed delay), the slow primary is waited for
+    buses, elapsed = run([getter("1", delay=0.1), secondary], policy)
+    assert _lines(buses) == ["1"] and secondary.calls == 0
+    for _ in range(3):
+        policy.tracker.record(primary, 0.02)
+    buses, elapsed = run([primary, secondary], policy)
+    assert _lines(buses) == ["2"]
+    assert elapsed < 0.5
+
+
+def test_sync_losers_not_started_are_cancelled():
+    # With a single worker, the hedged getters wait on the executor queue until the primary answers
+    primary, secondary, third = _BusGetter("1", delay=0.2), _BusGetter("2", delay=0.05), _BusGetter("3")
+    buses, _ = _run_sync([primary, secondary, third], HedgePolicy(delay=0.01, max_workers=1))
+    assert _lines(buses) == ["1"]
+    time.sleep(0.1)
+    # The secondary might have been taken by the worker before the race ended, but the third must be cancelled
+    assert third.calls == 0
+
+
+def test_hedge_disabled_per_call():
+    primary, secondary = _BusGetter("1", delay=0.1), _BusGetter("2")
+    policy = HedgePolicy(delay=0.01)
+    pybuses = PyBuses(bus_getters=[primary, secondary], bus_hedge_policy=policy)
+    assert _lines(pybuses.get_buses(1, hedge=False)) == ["1"]
+    assert secondary.calls == 0
+    policy.close()
@@ -0,0 +1,31 @@
+
+# Own modules
+from pybuses import PyBuses, StopsViewport, StopNameIndex, Stop
+from .helpers import MemorySetter
+
+
+def _pybuses(index):
+    pybuses = PyBuses()
+    pybuses.add_stop_setter(MemorySetter())
+    pybuses.add_stop_deleter(lambda stopid: None)
+    pybuses.add_stops_index(index)
+    return pybuses
+
+
+def test_viewport_updated_through_pybuses():
+    viewport = StopsViewport()
+    pybuses = _pybuses(viewport)
+    pybuses.save_stop(Stop(1, "Stop", 42.23, -8.72))
+    assert len(viewport) == 1
+    assert [stop.stopid for stop in viewport.stops_in_bbox((42.0, -9.0, 42.5, -8.5), 18)] == [1]
+    pybuses.delete_stop(1)
+    assert len(viewport) == 0
+
+
+def test_name_index_updated_through_pybuses():
+    index = StopNameIndex()
+    pybuses = _pybuses(index)
+    pybuses.save_stops([Stop(1, "Praza de España"), Stop(2, "Rúa Urzaiz")])
+    assert [stop.stopid for stop, _ in index.search("espana")] == [1]
+    pybuses.delete_stop(1)
+    assert not index.search("espana")
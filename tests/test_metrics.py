@@ -0,0 +1,151 @@
+
+# Native modules
+import gc
+import weakref
+from urllib.request import urlopen
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, PyBusesMetrics, CallableKinds, CallOutcomes, Stop
+from pybuses.metrics import classify
+from pybuses.exceptions import *
+from .helpers import FlakyGetter
+
+
+def _calls(metrics):
+    return {(c["kind"], c["name"]): c["count"] for c in metrics.snapshot()["callables"]}
+
+
+def test_metrics_keyed_by_registration_label():
+    metrics = PyBusesMetrics()
+    primary, replica = FlakyGetter({1: Stop(1, "Stop")}), FlakyGetter({1: Stop(1, "Stop")})
+    pybuses = PyBuses(metrics=metrics)
+    pybuses.add_stop_getter(primary, label="primary")
+    pybuses.add_stop_getter(replica, label="replica")
+    pybuses.find_stop(1)
+    assert _calls(metrics) == {(CallableKinds.STOP_GETTER, "primary"): 1}
+    assert 'callable="primary"' in metrics.prometheus()
+
+
+def test_unlabeled_callables_with_the_same_name_are_aggregated():
+    metrics = PyBusesMetrics()
+    for _ in range(3):
+        pybuses = PyBuses(metrics=metrics)
+        getter = FlakyGetter({1: Stop(1, "Stop")})
+        pybuses.add_stop_getter(getter)
+        pybuses.find_stop(1)
+    assert _calls(metrics) == {(CallableKinds.STOP_GETTER, "FlakyGetter"): 3}
+
+
+def test_metrics_do_not_keep_the_callables_alive():
+    metrics = PyBusesMetrics()
+    getter = FlakyGetter({1: Stop(1, "Stop")})
+    pybuses = PyBuses(metrics=metrics)
+    pybuses.add_stop_getter(getter)
+    pybuses.find_stop(1)
+    ref = weakref.ref(getter)
+    del pybuses, getter
+    gc.collect()
+    assert ref() is None
+
+
+@pytest.mark.parametrize("exception,outcome", [
+    (StopNotExist("Stop does not exist"), CallOutcomes.NOT_EXIST),
+    (StopNotFound("Stop not found"), CallOutcomes.NOT_FOUND),
+    (StopGetterUnavailable("Getter down"), CallOutcomes.UNAVAILABLE),
+    (StopSetterUnavailable("Setter down"), CallOutcomes.UNAVAILABLE),
+    (BusGetterUnavailable("Getter down"), CallOutcomes.UNAVAILABLE),
+    (ValueError("Bug"), CallOutcomes.ERROR)
+])
+def test_classify(exception, outcome):
+    assert classify(exception) == outcome
+
+
+def test_outcomes_recorded_by_call():
+    metrics = PyBusesMetrics(buckets=(0.1, 1.0))
+
+    def _raise(exception):
+        raise exception
+
+    assert metrics.call(CallableKinds.STOP_GETTER, "getter", lambda: 1) == 1
+    for exception in (StopNotExist("Gone"), StopNotFound("Missing"), StopGetterUnavailable("Down"), KeyError(1)):
+        with pytest.raises(type(exception)):
+            metrics.call(CallableKinds.STOP_GETTER, "getter", _raise, exception)
+    with pytest.raises(StopNotFound):
+        with metrics.timed(CallableKinds.STOP_GETTER, "getter"):
+            raise StopNotFound("Missing")
+
+    callable_metrics, = metrics.snapshot()["callables"]
+    assert callable_metrics["calls"] == {
+        CallOutcomes.SUCCESS: 1, CallOutcomes.UNAVAILABLE: 1, CallOutcomes.NOT_FOUND: 2,
+        CallOutcomes.NOT_EXIST: 1, CallOutcomes.ERROR: 1
+    }
+    assert callable_metrics["count"] == 6
+    assert callable_metrics["histogram"] == {0.1: 6, 1.0: 6, float("inf"): 6}
+    # Success over the calls that answered (success, not found, not exist)
+    assert callable_metrics["hit_rate"] == 1 / 4
+
+
+def test_fallback_depth_and_exhausted():
+    metrics = PyBusesMetrics()
+    primary, replica = FlakyGetter({1: Stop(1, "Stop")}), FlakyGetter({1: Stop(1, "Stop"), 2: Stop(2, "Other")})
+    pybuses = PyBuses(metrics=metrics)
+    pybuses.add_stop_getter(primary)
+    pybuses.add_stop_getter(replica)
+    pybuses.find_stop(1)
+    pybuses.find_stop(2)
+    primary.available = False
+    pybuses.find_stop(1)
+    replica.available = False
+    with pytest.raises(StopGetterUnavailable):
+        pybuses.find_stop(1)
+    assert metrics.snapshot()["fallbacks"] == {"find_stop": {0: 1, 1: 2, "exhausted": 1}}
+
+    metrics.record_fallback("find_stops", 0, count=3)
+    metrics.record_fallback("find_stops", None, count=2)
+    assert metrics.snapshot()["fallbacks"]["find_stops"] == {0: 3, "exhausted": 2}
+    metrics.reset()
+    assert metrics.snapshot() == {"callables": [], "fallbacks": {}}
+
+
+def test_prometheus_text_format():
+    metrics = PyBusesMetrics(buckets=(0.5, 0.1), namespace="test")
+    metrics.record(CallableKinds.STOP_GETTER, 'Mongo "main"\\db', CallOutcomes.SUCCESS, 0.05)
+    metrics.record(CallableKinds.STOP_GETTER, 'Mongo "main"\\db', CallOutcomes.NOT_FOUND, 0.3)
+    metrics.record(CallableKinds.STOP_GETTER, 'Mongo "main"\\db', CallOutcomes.ERROR, 2.0)
+    metrics.record_fallback("find_stop", 0)
+    metrics.record_fallback("find_stop", None)
+    lines = metrics.prometheus().splitlines()
+    labels = 'kind="stop_getter",callable="Mongo \\"main\\"\\\\db"'
+    for line in [
+        "# TYPE test_calls_total counter",
+        f'test_calls_total{{{labels},outcome="success"}} 1',
+        f'test_calls_total{{{labels},outcome="not_found"}} 1',
+        f'test_calls_total{{{labels},outcome="unavailable"}} 0',
+        f'test_calls_total{{{labels},outcome="error"}} 1',
+        "# TYPE test_call_duration_seconds histogram",
+        # Buckets are sorted and cumulative
+        f'test_call_duration_seconds_bucket{{{labels},le="0.1"}} 1',
+        f'test_call_duration_seconds_bucket{{{labels},le="0.5"}} 2',
+        f'test_call_duration_seconds_bucket{{{labels},le="+Inf"}} 3',
+        f"test_call_duration_seconds_sum{{{labels}}} {0.05 + 0.3 + 2.0!r}",
+        f"test_call_duration_seconds_count{{{labels}}} 3",
+        "# TYPE test_fallback_depth_total counter",
+        'test_fallback_depth_total{operation="find_stop",depth="0"} 1',
+        'test_fallback_depth_total{operation="find_stop",depth="exhausted"} 1'
+    ]:
+        assert line in lines
+    # Each callable creates (outcomes + buckets + 3) series
+    assert len([line for line in lines if not line.startswith("#")]) == 5 + 2 + 3 + 2
+
+
+def test_serve():
+    metrics = PyBusesMetrics()
+    metrics.record_fallback("get_buses", 0)
+    server = metrics.serve(port=0)
+    try:
+        with urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert response.read().decode("utf-8") == metrics.prometheus()
+    finally:
+        metrics.stop_serving()
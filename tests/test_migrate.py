@@ -0,0 +1,46 @@
+
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import AsyncPyBuses, SQLite, Stop, migrate_stops, write_snapshot
+from .helpers import MemorySetter
+
+
+def _source():
+    return [Stop(1, "One"), Stop(2, "Two changed"), Stop(3, "Three")]
+
+
+@pytest.fixture
+def sqlite(tmp_path):
+    db = SQLite(str(tmp_path / "stops.sqlite"))
+    db.save_stops([Stop(2, "Two"), Stop(3, "Three"), Stop(4, "Four"), Stop(5, "Five")])
+    yield db
+    db.close()
+
+
+def test_dry_run_reports_added_changed_and_removed(sqlite):
+    summary = migrate_stops(_source(), sqlite, chunk_size=2, dry_run=True)
+    assert summary.added == [1] and summary.changed == [2] and summary.unchanged == 1
+    assert sorted(summary.removed) == [4, 5]
+    assert sqlite.find_stop(2).name == "Two"
+
+
+def test_migration_with_diff_reports_removed(sqlite):
+    summary = migrate_stops(_source(), sqlite, diff=True)
+    assert summary.written == 3 and sorted(summary.removed) == [4, 5]
+    assert sqlite.find_stop(2).name == "Two changed"
+
+
+def test_snapshot_destination_reports_removed(tmp_path):
+    path = str(tmp_path / "stops.snapshot")
+    write_snapshot(path, [Stop(3, "Three"), Stop(4, "Four")])
+    summary = migrate_stops(_source(), path, dry_run=True)
+    assert summary.added == [1, 2] and summary.removed == [4]
+
+
+def test_async_destination_rejected():
+    pybuses = AsyncPyBuses()
+    pybuses.add_stop_setter(MemorySetter())
+    with pytest.raises(TypeError):
+        migrate_stops(_source(), pybuses)
+    pybuses.close()
@@ -0,0 +1,185 @@
+
+# Native modules
+import math
+# Installed libraries
+import pytest
+from pymongo.errors import AutoReconnect
+# Own modules
+from pybuses import PyBuses, Stop
+from pybuses.exceptions import *
+from pybuses.mongodb import MongoDB, stop_upsert, geo_near_pipeline, bbox_query, LOCATION_FIELD
+
+
+def test_upsert_stop_with_location():
+    operation = stop_upsert(Stop(1, "Stop", 42.23, -8.72))["update"]
+    assert operation["$set"][LOCATION_FIELD] == {"type": "Point", "coordinates": [-8.72, 42.23]}
+    assert "$unset" not in operation
+
+
+def test_upsert_stop_without_location_removes_existing_location():
+    upsert = stop_upsert(Stop(1, "Stop"))
+    assert upsert["filter"] == {"_id": "1"}
+    operation = upsert["update"]
+    assert set(operation["$unset"]) == {"lat", "lon", LOCATION_FIELD}
+    assert not set(operation["$set"]) & set(operation["$unset"])
+
+
+def test_insert_only_upsert_does_not_remove_fields():
+    operation = stop_upsert(Stop(1, "Stop"), update=False)["update"]
+    assert set(operation) == {"$setOnInsert"}
+
+
+def test_shared_client_key_includes_reconnect_backoffs():
+    first = MongoDB(port=1, reconnect_backoff=1)
+    same = MongoDB(port=1, reconnect_backoff=1)
+    other = MongoDB(port=1, reconnect_backoff=5)
+    try:
+        for mongo in (first, same, other):
+            mongo.connect()
+        assert first.client is same.client
+        assert other.client is not first.client
+        assert other.health.backoff == 5
+    finally:
+        for mongo in (first, same, other):
+            mongo.close()
+
+
+class _Collection(object):
+    """Stand-in for the stops Collection, that records the queries and returns the given documents."""
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = list()
+        self.projections = list()
+
+    def aggregate(self, pipeline):
+        self.queries.append(pipeline)
+        return iter(self.documents)
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        self.projections.append(projection)
+        return iter(self.documents)
+
+
+def _mongodb(documents):
+    mongo = MongoDB(port=1)
+    mongo.documents = _Collection(documents)
+    mongo.indexes_ensured = True
+    return mongo
+
+
+def _arc_max_lat(lat, lon1, lon2):
+    """Latitude of the point of the great circle arc between two points of the same latitude furthest from
+    the equator (its midpoint)."""
+    return math.degrees(math.atan(math.tan(math.radians(lat)) / math.cos(math.radians(lon2 - lon1) / 2)))
+
+
+def test_geo_near_pipeline():
+    pipeline = geo_near_pipeline(42.23, -8.72, radius_m=500, limit=5)
+    geo_near = pipeline[0]["$geoNear"]
+    assert geo_near["near"] == {"type": "Point", "coordinates": [-8.72, 42.23]}
+    assert geo_near["key"] == LOCATION_FIELD and geo_near["spherical"] is True
+    assert geo_near["distanceField"] == "distance" and geo_near["maxDistance"] == 500
+    assert pipeline[1:] == [{"$limit": 5}]
+    assert "maxDistance" not in geo_near_pipeline(42.23, -8.72)[0]["$geoNear"]
+
+
+def test_find_stops_near_uses_pipeline():
+    mongo = _mongodb([{"_id": "1", "name": "Stop", "lat": 42.23, "lon": -8.72, "distance": 12.5}])
+    results = mongo.find_stops_near(42.23, -8.72, radius_m=100, limit=3)
+    assert [(stop.stopid, distance) for stop, distance in results] == [(1, 12.5)]
+    assert mongo.documents.queries == [geo_near_pipeline(42.23, -8.72, 100, 3)]
+    assert mongo.find_stops_near(42.23, -8.72, limit=0) == []
+    assert len(mongo.documents.queries) == 1
+
+
+@pytest.mark.parametrize("bbox", [
+    (42.20, -8.80, 42.25, -8.70),
+    (10.0, 0.0, 40.0, 120.0),
+    (-40.0, -60.0, -10.0, 0.0),
+    (-5.0, 100.0, 5.0, 110.0)
+])
+def test_bbox_query_polygon_covers_bbox(bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    query = bbox_query(bbox)
+    assert query["lat"] == {"$gte": min_lat, "$lte": max_lat}
+    assert query["lon"] == {"$gte": min_lon, "$lte": max_lon}
+    polygon = query[LOCATION_FIELD]["$geoWithin"]["$geometry"]
+    ring = polygon["coordinates"][0]
+    assert polygon["type"] == "Polygon" and len(ring) == 5 and ring[0] == ring[-1]
+    assert {lon for lon, _ in ring} == {min_lon, max_lon}
+    south, north = min(lat for _, lat in ring), max(lat for _, lat in ring)
+    assert south <= min_lat and north >= max_lat
+    # The arcs of the polygon edges do not cut the bbox, and stay close to it
+    if min_lat > 0:
+        assert min_lat - 1e-6 < _arc_max_lat(south, min_lon, max_lon) <= min_lat
+    else:
+        assert south == min_lat
+    if max_lat < 0:
+        assert max_lat <= _arc_max_lat(north, min_lon, max_lon) < max_lat + 1e-6
+    else:
+        assert north == max_lat
+
+
+@pytest.mark.parametrize("bbox", [(42.2, -8.7, 42.3, -8.8), (42.3, -8.8, 42.2, -8.7), (0, -100, 10, 100)])
+def test_bbox_query_rejects_invalid_bbox(bbox):
+    with pytest.raises(ValueError):
+        bbox_query(bbox)
+
+
+def test_find_stops_within_uses_query():
+    mongo = _mongodb([{"_id": "2", "name": "Stop", "lat": 42.23, "lon": -8.72}])
+    stops = mongo.find_stops_within((42.2, -8.8, 42.3, -8.7))
+    assert [stop.stopid for stop in stops] == [2]
+    assert mongo.documents.queries == [bbox_query((42.2, -8.8, 42.3, -8.7))]
+
+
+@pytest.mark.parametrize("fields,expected", [
+    (None, None),
+    (["other"], {"other": True, "name": True}),
+    (["lat"], {"lat": True, "lon": True, "name": True}),
+    (["lon", "other"], {"lat": True, "lon": True, "other": True, "name": True}),
+])
+def test_find_stops_projection(fields, expected):
+    mongo = _mongodb([{"_id": "1", "name": "Stop", "lat": 42.23, "lon": -8.72}])
+    # Skip the connection to the server
+    mongo.check_available = lambda: None
+    found, missing = mongo.find_stops([1, 2], fields=fields)
+    assert mongo.documents.projections == [expected]
+    assert mongo.documents.queries == [{"_id": {"$in": ["1", "2"]}}]
+    assert found[1].has_location() and missing == {2}
+
+
+class _DeleteCollection(object):
+    """Stand-in for the stops Collection on delete operations, that fails while down."""
+    def __init__(self):
+        self.down = False
+        self.deleted = list()
+
+    def delete_one(self, query):
+        if self.down:
+            raise AutoReconnect("Connection lost")
+        self.deleted.append(query)
+        return type("DeleteResult", (object,), {"deleted_count": 1})()
+
+
+def test_delete_stop_raises_deleter_unavailable():
+    mongo = MongoDB(port=1)
+    mongo.collection = _DeleteCollection()
+    mongo.check_available = lambda: None
+    assert mongo.delete_stop(1) is True
+    assert mongo.collection.deleted == [{"_id": "1"}]
+
+    mongo.collection.down = True
+    with pytest.raises(StopDeleterUnavailable) as exc_info:
+        mongo.delete_stop(1)
+    assert not isinstance(exc_info.value, StopSetterUnavailable)
+    assert isinstance(exc_info.value.__cause__, AutoReconnect)
+
+    # PyBuses falls through to the next Stop deleter
+    deleted = list()
+    pybuses = PyBuses()
+    pybuses.add_stop_deleter(mongo.delete_stop)
+    pybuses.add_stop_deleter(deleted.append)
+    pybuses.delete_stop(2)
+    assert deleted == [2]
@@ -0,0 +1,82 @@
+
+# Own modules
+from pybuses import StopNameIndex, Stop
+from pybuses.search import normalize_name
+
+
+def _index():
+    return StopNameIndex([
+        Stop(1, "Rúa Urzáiz, N"),
+        Stop(2, "Avenida de Castrelos"),
+        Stop(3, "Rúa Urzáiz - Praza de España"),
+        Stop(4, "Rúa Ramón Nieto, 12"),
+        Stop(5, "Praza de España"),
+        Stop(6, "Estrada de Castrelos, 202")
+    ])
+
+
+def _ids(results):
+    return [stop.stopid for stop, _ in results]
+
+
+def test_normalize_name():
+    assert normalize_name("Rúa Urzáiz, 12") == "rua urzaiz 12"
+    assert normalize_name("  PRAZA  de España!! ") == "praza de espana"
+
+
+def test_accents_and_case_folded():
+    index = _index()
+    assert _ids(index.search("URZAIZ")) == [1, 3]
+    assert _ids(index.search("españa")) == _ids(index.search("espana")) == [5, 3]
+
+
+def test_prefix_ranking():
+    index = _index()
+    # Whole-word matches rank above prefix matches, and shorter names (more covered by the query) first
+    results = index.search("praza de esp")
+    assert _ids(results)[:2] == [5, 3]
+    assert results[0][1] > results[1][1]
+    assert _ids(index.search("rua")) == [1, 4, 3]
+    assert _ids(index.search("rua", limit=1)) == [1]
+    assert _ids(index.search("castrelos")) == [2, 6]
+
+
+def test_typos_in_multi_word_names():
+    index = _index()
+    assert _ids(index.search("urzaz"))[:2] == [1, 3]
+    assert _ids(index.search("castrelso")) == [2, 6]
+    assert _ids(index.search("rua urzaz"))[:2] == [1, 3]
+    results = index.search("rua")
+    # Fuzzy matches never rank above prefix matches
+    assert min(score for _, score in results) > max(score for _, score in index.search("ruaa"))
+    assert index.search("xyzzy") == []
+
+
+def test_index_updates_invalidate_cached_matches():
+    index = _index()
+    assert _ids(index.search("urz")) == [1, 3]
+    index.remove(1)
+    index.insert(Stop(7, "Urzáiz"))
+    assert _ids(index.search("urz")) == [7, 3]
+    assert _ids(index.search("urzaz"))[0] == 7
+    index.insert(Stop(7, "Gran Vía"))
+    assert _ids(index.search("urz")) == [3]
+    assert len(index) == 6 and 7 in index
+
+
+def test_typos_in_large_catalogue():
+    streets = ("Urzáiz", "Castrelos", "Gran Vía", "Policarpo Sanz", "Colón", "García Barbón", "Camelias", "Samil")
+    kinds = ("Rúa", "Avenida de", "Praza de", "Estrada")
+    stops = [
+        Stop(i, "{} {}, {}".format(kinds[i % len(kinds)], streets[i % len(streets)], i))
+        for i in range(1, 1001)
+    ]
+    stops.extend([Stop(5000, "Rúa Urzáiz, N"), Stop(5001, "Avenida de Castrelos")])
+    index = StopNameIndex(stops)
+    assert all("Urzáiz" in stop.name for stop, _ in index.search("urzaz"))
+    assert 5000 in _ids(index.search("rua urzaz n"))
+    assert _ids(index.search("castrelso", limit=1)) == [5001]
+    assert _ids(index.search("avenida castrelos", limit=1)) == [5001]
+    results = index.search("r", limit=5)
+    assert len(results) == 5
+    assert all(stop.name.startswith("Rúa") for stop, _ in results)
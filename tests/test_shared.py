@@ -0,0 +1,134 @@
+
+# Native modules
+import asyncio
+import errno
+import socket
+import time
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, AsyncPyBuses, SharedStopsCache, SharedStopsCacheServer, Stop
+from pybuses.exceptions import *
+from .helpers import FlakyGetter
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sock")
+
+
+def _count_requests(cache):
+    requests = list()
+    request = cache._request
+
+    def _request(*args):
+        requests.append(args[0])
+        return request(*args)
+
+    cache._request = _request
+    return requests
+
+
+def test_round_trip(path):
+    with SharedStopsCacheServer(path):
+        cache, other = SharedStopsCache(path), SharedStopsCache(path)
+        cache.save_stops([Stop(1, "One", 42.2, -8.7, other={"lines": ["C1"]}), Stop(2, "Two")])
+        stop = other.find_stop(1)
+        assert (stop.name, stop.lat, stop.lon, stop.other) == ("One", 42.2, -8.7, {"lines": ["C1"]})
+        found, misses = other.find_stops([1, 2, 3])
+        assert set(found) == {1, 2} and misses == {3}
+        cache.save_negative(3, not_exist=True)
+        with pytest.raises(StopNotExist):
+            other.find_stop(3)
+        assert other.delete_stop(1)
+        with pytest.raises(StopNotFound):
+            other.find_stop(1)
+        assert other.stats()["size"] == 1
+
+
+def test_find_stop_single_round_trip(path):
+    with SharedStopsCacheServer(path):
+        cache = SharedStopsCache(path)
+        requests = _count_requests(cache)
+        pybuses = PyBuses()
+        pybuses.add_stops_cache(cache)
+        pybuses.add_stop_getter(FlakyGetter({1: Stop(1, "One")}), online=True)
+        pybuses.find_stop(1)
+        requests.clear()
+        assert pybuses.find_stop(1).name == "One"
+        assert requests == ["lookup"]
+
+        # A Stop saved after the lookup is not hidden by the prefetched result
+        cache.check_negative(2)
+        cache.save_stop(Stop(2, "Two"))
+        assert cache.find_stop(2).name == "Two"
+
+
+def test_negative_results(path):
+    with SharedStopsCacheServer(path):
+        cache = SharedStopsCache(path)
+        online = FlakyGetter({})
+        pybuses = PyBuses()
+        pybuses.add_stops_cache(cache)
+        pybuses.add_stop_getter(online, online=True)
+        with pytest.raises(StopNotFound):
+            pybuses.find_stop(1)
+        with pytest.raises(StopNotFound):
+            pybuses.find_stop(1)
+        assert online.calls == 1
+
+
+def test_fail_fast_while_server_down(path):
+    cache = SharedStopsCache(path, failure_threshold=2, retry_after=0.2)
+    for _ in range(2):
+        with pytest.raises(StopGetterUnavailable):
+            cache.find_stop(1)
+    assert not cache.available
+    errors_before = cache.errors
+    cache.save_stop(Stop(1, "One"))
+    assert cache.errors == errors_before + 1
+
+    time.sleep(0.25)
+    with SharedStopsCacheServer(path):
+        assert cache.available
+        cache.save_stop(Stop(1, "One"))
+        assert cache.find_stop(1).name == "One"
+        assert cache.consecutive_failures == 0
+
+
+def test_server_does_not_replace_a_live_server(path):
+    with SharedStopsCacheServer(path):
+        with pytest.raises(OSError) as e:
+            SharedStopsCacheServer(path).start()
+        assert e.value.errno == errno.EADDRINUSE
+        SharedStopsCache(path).save_stop(Stop(1, "One"))
+
+
+def test_server_replaces_a_stale_socket(path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    with SharedStopsCacheServer(path):
+        cache = SharedStopsCache(path)
+        cache.save_stop(Stop(1, "One"))
+        assert cache.find_stop(1).name == "One"
+
+
+def test_async_pybuses_with_shared_cache(path):
+    with SharedStopsCacheServer(path):
+        cache = SharedStopsCache(path)
+        online = FlakyGetter({1: Stop(1, "One")})
+        pybuses = AsyncPyBuses()
+        pybuses.add_stops_cache(cache)
+        pybuses.add_stop_getter(online, online=True)
+
+        async def _run():
+            assert (await pybuses.find_stop(1)).name == "One"
+            assert (await pybuses.find_stop(1)).name == "One"
+            with pytest.raises(StopNotFound):
+                await pybuses.find_stop(2)
+
+        asyncio.run(_run())
+        pybuses.close()
+        assert online.calls == 2
+        assert cache.stats()["negative_size"] == 1
@@ -0,0 +1,47 @@
+
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, Stop, StopSnapshot, write_snapshot
+from pybuses.exceptions import *
+
+
+def _stops():
+    return [
+        Stop(30, "Praza de España", 42.23, -8.72, other={"lines": ["C1", "4A"]}),
+        Stop(10, "No location"),
+        Stop(20, "Old name"),
+        Stop(20, "New name", 42.24, -8.71)
+    ]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "stops.snapshot")
+    assert write_snapshot(path, _stops()) == 3
+    with StopSnapshot(path) as snapshot:
+        assert len(snapshot) == 3 and list(snapshot.stopids) == [10, 20, 30]
+        stop = snapshot.find_stop(30)
+        assert (stop.name, stop.lat, stop.lon) == ("Praza de España", 42.23, -8.72)
+        assert stop.other == {"lines": ["C1", "4A"]}
+        stop = snapshot.find_stop(10)
+        assert (stop.lat, stop.lon, stop.other) == (None, None, {})
+        assert snapshot.find_stop(20).name == "New name"
+        assert [stop.stopid for stop in snapshot.iter_stops()] == [10, 20, 30]
+        found, misses = snapshot.find_stops([20, 40])
+        assert set(found) == {20} and misses == {40}
+        with pytest.raises(StopNotFound):
+            snapshot.find_stop(40)
+
+
+def test_snapshot_replaced_and_used_as_getter(tmp_path):
+    path = str(tmp_path / "stops.snapshot")
+    write_snapshot(path, _stops())
+    with StopSnapshot(path) as snapshot:
+        write_snapshot(path, [Stop(1, "Other catalogue")])
+        assert snapshot.find_stop(30).name == "Praza de España"  # The opened snapshot is not affected
+    with StopSnapshot(path) as snapshot:
+        pybuses = PyBuses()
+        pybuses.add_stop_getter(snapshot.find_stop, bulk=snapshot.find_stops)
+        assert pybuses.find_stop(1).name == "Other catalogue"
+        found, misses = pybuses.find_stops([1, 30])
+        assert set(found) == {1} and misses == {30}
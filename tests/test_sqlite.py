@@ -0,0 +1,92 @@
+
+# Native modules
+import time
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import SQLite, Stop
+from pybuses import sqlite as sqlite_module
+from pybuses.geo import haversine
+from pybuses.exceptions import *
+
+
+@pytest.fixture(params=[True, False], ids=["rtree", "index"])
+def db(request, tmp_path, monkeypatch):
+    if not request.param:
+        # Simulate a SQLite library compiled without the R*Tree module
+        monkeypatch.setattr(sqlite_module, "_CREATE_STOPS_LOCATION", "CREATE VIRTUAL TABLE x USING missing_module(a)")
+    database = SQLite(str(tmp_path / "stops.sqlite"))
+    yield database
+    database.close()
+
+
+def _saved(db, stopid):
+    return db.read("SELECT saved, updated FROM stops WHERE stopid=?", stopid, fetchall=False)
+
+
+def test_wal_mode(db):
+    assert db.read("PRAGMA journal_mode", single_column=True) == ["wal"]
+
+
+def test_upsert(db):
+    db.save_stop(Stop(1, "Old", 42.2, -8.7, other={"lines": ["C1"]}))
+    saved, _ = _saved(db, 1)
+    db.save_stop(Stop(1, "Ignored"), update=False)
+    assert db.find_stop(1).name == "Old"
+
+    time.sleep(1.1)
+    db.save_stops([Stop(1, "New"), Stop(2, "Two", 42.3, -8.6)])
+    stop = db.find_stop(1)
+    assert (stop.name, stop.lat, stop.lon, stop.other) == ("New", None, None, {})
+    assert _saved(db, 1)[0] == saved and _saved(db, 1)[1] > saved
+    # The location entry of the updated Stop is removed too
+    assert [s.stopid for s in db.find_stops_within((-90, -180, 90, 180))] == [2]
+
+    assert db.delete_stop(2) and not db.delete_stop(2)
+    assert db.find_stops_within((-90, -180, 90, 180)) == []
+    with pytest.raises(StopNotFound):
+        db.find_stop(2)
+
+
+def test_within_bbox_edges(db):
+    db.save_stops([
+        Stop(1, "Inside", 42.15, -8.7),
+        Stop(2, "On the edge", 42.2, -8.6),
+        Stop(3, "Just outside", 42.200003, -8.7),
+        Stop(4, "Outside lon", 42.15, -8.599997),
+        Stop(5, "No location")
+    ])
+    assert sorted(s.stopid for s in db.find_stops_within((42.1, -8.8, 42.2, -8.6))) == [1, 2]
+
+
+def test_near(db):
+    db.save_stops([
+        Stop(1, "Origin", 42.2, -8.7),
+        Stop(2, "100 m", 42.2009, -8.7),
+        Stop(3, "1 km", 42.209, -8.7),
+        Stop(4, "Far away", 40.4, -3.7),
+        Stop(5, "No location")
+    ])
+    results = db.find_stops_near(42.2, -8.7, radius_m=500)
+    assert [stop.stopid for stop, _ in results] == [1, 2]
+    assert results[0][1] == 0 and 99 < results[1][1] < 101
+
+    assert [stop.stopid for stop, _ in db.find_stops_near(42.2, -8.7, limit=3)] == [1, 2, 3]
+    assert [stop.stopid for stop, _ in db.find_stops_near(42.2, -8.7)] == [1, 2, 3, 4]
+    assert [stop.stopid for stop, _ in db.find_stops_near(-42.2, 171.3, limit=1)] == [4]
+    assert db.find_stops_near(42.2, -8.7, limit=0) == []
+
+
+def test_near_without_radius_does_not_load_all_the_stops(db, monkeypatch):
+    db.save_stops([Stop(i, "Stop", 42.2 + i * 0.0001, -8.7) for i in range(1, 6)])
+    db.save_stops([Stop(i, "Far away", 40.4, -3.7 + i * 0.0001) for i in range(100, 300)])
+    distances = list()
+
+    def _haversine(*args):
+        distances.append(args)
+        return haversine(*args)
+
+    monkeypatch.setattr(sqlite_module, "haversine", _haversine)
+    results = db.find_stops_near(42.2, -8.7, limit=5)
+    assert [stop.stopid for stop, _ in results] == [1, 2, 3, 4, 5]
+    assert len(distances) == 5
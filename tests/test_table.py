@@ -0,0 +1,128 @@
+
+# Native modules
+import math
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import StopTable, Stop
+from pybuses import table, geo
+from pybuses.exceptions import *
+
+_ROWS = [
+    (5, "Praza de España", 42.230, -8.710),
+    (2, "Rúa Urzáiz", 42.220, -8.720),
+    (9, "Gran Vía", None, None),
+    (1, "Praza de España", 42.230, -8.700),
+    (7, "Castrelos", 42.210, -8.730),
+    (3, "Samil", None, None),
+    (5, "Duplicated 5", 42.240, -8.740)
+]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def stop_table(request, monkeypatch):
+    """The same StopTable, built with NumPy columns and with the pure-Python fallback."""
+    if request.param == "python":
+        monkeypatch.setattr(table, "numpy", None)
+        monkeypatch.setattr(geo, "numpy", None)
+    elif table.numpy is None:
+        pytest.skip("NumPy is not installed")
+    return StopTable.from_rows(_ROWS)
+
+
+def _rows(stop_table):
+    return list(stop_table.iter_rows())
+
+
+def _sort_key(row, column):
+    return row[("stopid", "name", "lat", "lon").index(column)]
+
+
+def test_columns_and_rows(stop_table):
+    assert len(stop_table) == len(_ROWS)
+    assert _rows(stop_table) == _ROWS
+    assert [type(value) for value in _rows(stop_table)[0]] == [int, str, float, float]
+    assert math.isnan(stop_table.lats[2])
+    # Names are interned
+    assert stop_table.names[0] is stop_table.names[3]
+
+
+def test_take(stop_table):
+    assert _rows(stop_table.take([4, 0, 0])) == [_ROWS[4], _ROWS[0], _ROWS[0]]
+    assert _rows(stop_table.take([])) == []
+    taken = stop_table.take(range(len(_ROWS) - 1, -1, -1))
+    assert _rows(taken) == _ROWS[::-1]
+
+
+def test_filter(stop_table):
+    mask = [row[0] > 4 for row in _ROWS]
+    assert _rows(stop_table.filter(mask)) == [row for row in _ROWS if row[0] > 4]
+    assert _rows(stop_table.filter(stop_table.has_location())) == [row for row in _ROWS if row[2] is not None]
+    assert _rows(stop_table.filter([False] * len(_ROWS))) == []
+    with pytest.raises(ValueError):
+        stop_table.filter([True])
+
+
+@pytest.mark.parametrize("column", ["stopid", "name", "lat", "lon"])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_sort(stop_table, column, reverse):
+    if column in ("lat", "lon"):
+        # Stops without location go last, on both directions
+        located = sorted((row for row in _ROWS if row[2] is not None),
+                         key=lambda row: _sort_key(row, column), reverse=reverse)
+        expected = located + [row for row in _ROWS if row[2] is None]
+    else:
+        expected = sorted(_ROWS, key=lambda row: _sort_key(row, column), reverse=reverse)
+    assert _rows(stop_table.sort(column, reverse=reverse)) == expected
+
+
+def test_sort_is_stable(stop_table):
+    # Rows 0 and 3 share the name and lat, and keep their relative order on both directions
+    for column in ("name", "lat"):
+        for reverse in (False, True):
+            stopids = [row[0] for row in _rows(stop_table.sort(column, reverse=reverse))]
+            assert stopids.index(5) < stopids.index(1)
+    with pytest.raises(ValueError):
+        stop_table.sort("other")
+
+
+def test_select(stop_table):
+    # Duplicated IDs select their first row; unknown IDs are ignored
+    assert _rows(stop_table.select([3, 99, 5, 1, 3])) == [_ROWS[5], _ROWS[0], _ROWS[3], _ROWS[5]]
+    assert _rows(stop_table.select([])) == []
+    assert _rows(StopTable().select([1])) == []
+
+
+def test_index_of(stop_table):
+    for stopid, expected in ((5, 0), (2, 1), (9, 2), (1, 3), (7, 4), (3, 5), (4, None), (10, None), (0, None)):
+        assert stop_table._index_of(stopid) == expected
+    assert 9 in stop_table and 4 not in stop_table
+    assert stop_table.find_stop(9).lat is None
+    stop = stop_table.find_stop(5)
+    assert (stop.stopid, stop.name, stop.lat) == (5, "Praza de España", 42.23)
+    with pytest.raises(StopNotFound):
+        stop_table.find_stop(4)
+
+
+def test_within_radius_and_bbox(stop_table):
+    near = stop_table.within_radius(42.23, -8.71, 1000)
+    assert [row[0] for row in _rows(near)] == [5, 1]
+    assert [row[0] for row in _rows(stop_table.within_bbox((42.215, -8.725, 42.235, -8.705)))] == [5, 2]
+
+
+def test_same_results_with_and_without_numpy(monkeypatch):
+    if table.numpy is None:
+        pytest.skip("NumPy is not installed")
+
+    def _results():
+        t = StopTable.from_stops(Stop(stopid, name, lat, lon) for stopid, name, lat, lon in _ROWS)
+        return [
+            _rows(t.take([6, 1, 1])), _rows(t.filter(t.has_location())), _rows(t.select([7, 5, 0])),
+            [_rows(t.sort(column, reverse)) for column in ("stopid", "name", "lat", "lon") for reverse in (0, 1)],
+            [t._index_of(stopid) for stopid in range(11)], t.to_dicts()
+        ]
+
+    vectorized = _results()
+    monkeypatch.setattr(table, "numpy", None)
+    monkeypatch.setattr(geo, "numpy", None)
+    assert _results() == vectorized
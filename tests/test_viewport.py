@@ -0,0 +1,103 @@
+
+# Native modules
+import random
+from threading import Thread
+# Own modules
+from pybuses import StopsViewport, StopCluster, Stop
+
+_WORLD = (-85.0, -180.0, 85.0, 180.0)
+
+
+def _stops(n, seed=1):
+    rnd = random.Random(seed)
+    return [
+        Stop(stopid, f"Stop {stopid}", 42.23 + rnd.uniform(-0.2, 0.2), -8.71 + rnd.uniform(-0.2, 0.2))
+        for stopid in range(n)
+    ]
+
+
+def _count(points):
+    return sum(point.count if isinstance(point, StopCluster) else 1 for point in points)
+
+
+def _summary(points):
+    """Points of a viewport as comparable tuples."""
+    return sorted(
+        ("cluster", round(point.lat, 9), round(point.lon, 9), point.count) if isinstance(point, StopCluster)
+        else ("stop", point.stopid)
+        for point in points
+    )
+
+
+def test_cluster_counts_add_up_per_zoom():
+    viewport = StopsViewport(_stops(500), max_cluster_zoom=16)
+    for zoom in range(0, 17):
+        points = viewport.stops_in_bbox(_WORLD, zoom)
+        assert _count(points) == 500
+        # Clusters get smaller as the zoom grows
+        assert len(points) >= len(viewport.stops_in_bbox(_WORLD, max(zoom - 1, 0)))
+    assert len(viewport.stops_in_bbox(_WORLD, 17)) == 500
+
+
+def test_clusters_consistent_after_removals_and_updates():
+    stops = _stops(300)
+    viewport = StopsViewport(stops)
+    for stopid in range(0, 300, 3):
+        assert viewport.remove(stopid)
+    assert not viewport.remove(0)
+    # Moved Stops, and Stops that lose their location
+    moved = [Stop(stopid, "Moved", 42.5, -8.5) for stopid in range(1, 60, 3)]
+    for stop in moved:
+        viewport.insert(stop)
+    viewport.insert(Stop(2, "No location"))
+
+    expected_stops = {stop.stopid: stop for stop in stops if stop.stopid % 3}
+    expected_stops.update((stop.stopid, stop) for stop in moved)
+    expected_stops.pop(2)
+    rebuilt = StopsViewport(expected_stops.values())
+    assert len(viewport) == len(rebuilt) == len(expected_stops)
+    for zoom in range(0, 19):
+        points = viewport.stops_in_bbox(_WORLD, zoom)
+        assert _count(points) == len(expected_stops)
+        assert _summary(points) == _summary(rebuilt.stops_in_bbox(_WORLD, zoom))
+    # The spatial index is updated too
+    assert sorted(stop.stopid for stop in viewport.index.within_bbox(_WORLD)) == sorted(expected_stops)
+
+    for stopid in list(expected_stops):
+        viewport.remove(stopid)
+    assert all(not viewport.stops_in_bbox(_WORLD, zoom) for zoom in range(0, 19))
+
+
+def test_bbox_crossing_antimeridian():
+    stops = [Stop(1, "East", 10.0, 179.5), Stop(2, "West", 10.0, -179.5), Stop(3, "Far", 10.0, 0.0)]
+    viewport = StopsViewport(stops)
+    bbox = (9.0, 179.0, 11.0, -179.0)
+    # Individual Stops
+    assert sorted(stop.stopid for stop in viewport.stops_in_bbox(bbox, 18)) == [1, 2]
+    # Clusters at each side of the antimeridian
+    assert _count(viewport.stops_in_bbox(bbox, 10)) == 2
+    # Low zoom levels, where both sides of the viewport share cells, do not return cells twice
+    assert _count(viewport.stops_in_bbox((9.0, 1.0, 11.0, -1.0), 0)) == 3
+    assert _count(viewport.stops_in_bbox((9.0, 1.0, 11.0, -1.0), 18)) == 2
+
+
+def test_index_consistent_under_concurrent_updates():
+    viewport = StopsViewport()
+    stops = _stops(50)
+
+    def _update(seed):
+        rnd = random.Random(seed)
+        for _ in range(500):
+            stop = rnd.choice(stops)
+            if rnd.random() < 0.5:
+                viewport.insert(stop)
+            else:
+                viewport.remove(stop.stopid)
+
+    threads = [Thread(target=_update, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(stop.stopid for stop in viewport.index.within_bbox(_WORLD)) == sorted(viewport._stops)
+    assert _count(viewport.stops_in_bbox(_WORLD, 5)) == len(viewport)
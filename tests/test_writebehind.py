@@ -0,0 +1,98 @@
+
+# Native modules
+import asyncio
+import time
+# Installed libraries
+import pytest
+# Own modules
+from pybuses import PyBuses, AsyncPyBuses, Stop, StopsWriteBehind
+from pybuses.exceptions import *
+from .helpers import MemorySetter
+
+
+def test_flush_and_close():
+    setter = MemorySetter()
+    pybuses = PyBuses()
+    pybuses.add_stop_setter(setter)
+    write_behind = pybuses.enable_write_behind(batch_size=10, flush_interval=0.05)
+    for stopid in range(25):
+        pybuses.save_stop(Stop(stopid, "Stop"))
+    assert write_behind.flush(timeout=5)
+    assert len(setter.stops) == 25
+    assert write_behind.stats()["saved"] == 25
+    pybuses.save_stop(Stop(100, "Stop"))
+    assert pybuses.disable_write_behind(timeout=5)
+    assert 100 in setter.stops
+    with pytest.raises(StopSetterUnavailable):
+        write_behind.put(Stop(101, "Stop"))
+
+
+def test_failed_batches_are_reported():
+    setter = MemorySetter()
+    setter.available = False
+    errors = list()
+    pybuses = PyBuses()
+    pybuses.add_stop_setter(setter)
+    write_behind = pybuses.enable_write_behind(flush_interval=0.05, on_error=errors.append)
+    pybuses.save_stop(Stop(1, "Stop"))
+    assert write_behind.close(timeout=5)
+    assert write_behind.stats()["failed"] == 1
+    assert len(errors) == 1 and errors[0].failed[0].stopid == 1
+
+
+def test_flusher_survives_base_exceptions():
+    calls = list()
+
+    def _saver(stops, update, use_all_stop_setters):
+        calls.append(stops)
+        if len(calls) == 1:
+            raise asyncio.CancelledError()
+        return []
+
+    write_behind = StopsWriteBehind(_saver, flush_interval=0.05)
+    write_behind.put(Stop(1, "Stop"))
+    assert write_behind.flush(timeout=5)
+    write_behind.put(Stop(2, "Stop"))
+    assert write_behind.close(timeout=5)
+    assert write_behind.stats()["saved"] == 1 and write_behind.stats()["failed"] == 1
+    assert isinstance(write_behind.errors[0].exception, asyncio.CancelledError)
+
+
+def test_async_flush_and_close_from_the_loop():
+    setter = MemorySetter()
+    pybuses = AsyncPyBuses()
+    pybuses.add_stop_setter(setter)
+
+    async def _run():
+        write_behind = pybuses.enable_write_behind(flush_interval=0.05)
+        for stopid in range(5):
+            await pybuses.save_stop(Stop(stopid, "Stop"))
+        with pytest.raises(RuntimeError):
+            write_behind.flush(timeout=1)
+        assert await write_behind.aflush(timeout=5)
+        assert len(setter.stops) == 5
+        await pybuses.save_stop(Stop(10, "Stop"))
+        assert await pybuses.disable_write_behind(timeout=5)
+        assert 10 in setter.stops
+
+    asyncio.run(_run())
+    pybuses.close()
+
+
+def test_async_pending_stops_saved_after_the_loop_finished():
+    setter = MemorySetter()
+    pybuses = AsyncPyBuses()
+    pybuses.add_stop_setter(setter)
+
+    async def _run():
+        write_behind = pybuses.enable_write_behind(flush_interval=0.05)
+        for stopid in range(5):
+            await pybuses.save_stop(Stop(stopid, "Stop"))
+        return write_behind
+
+    write_behind = asyncio.run(_run())
+    start = time.monotonic()
+    assert write_behind.close(timeout=5)
+    assert time.monotonic() - start < 5
+    assert len(setter.stops) == 5 and not write_behind.errors
+    pybuses.close()